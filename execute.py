@@ -1,21 +1,56 @@
 import os
 import sys
+import glob
+import shutil
+import inspect
+import threading
 import argparse
 import csv
-from programs.data_processing.format_ghsom_input_vector import format_ghsom_input_vector
+import pandas as pd
+import numpy as np
+from programs.data_processing.format_ghsom_input_vector import (
+    format_ghsom_input_vector, format_ghsom_input_vector_chunked, format_ghsom_input_vector_from_store,
+    format_ghsom_input_vector_reduced
+)
+from programs.data_processing.raw_data_reader import (
+    DEFAULT_MEMORY_BUDGET_MB, read_raw_float32, read_header, marker_columns, count_csv_rows,
+    iter_raw_chunks, chunk_rows_for_budget
+)
+from programs.data_processing.columnar_store import (
+    open_store, build_store, build_store_from_binary, store_files, column_names, read_columns,
+    read_sparse_features, iter_column_blocks
+)
+from programs.data_processing.pca_reduction import (
+    REDUCTION_SAMPLE_ROWS, REDUCTION_SEED, reduction_fingerprint, reduction_paths, sample_indices,
+    collect_rows, fit_reduction, save_reduction, load_reduction, project_to_file
+)
+from programs.data_processing.sparse_features import FEATURES_SUFFIX
+from programs.data_processing.sketching import (
+    SAMPLING_MODES, SKETCH_COMPONENTS, sketch_coordinates, geometric_sketch
+)
+from programs.data_processing.kept_rows import kept_rows_path, load_kept_rows
+from programs.data_processing.binary_readers import (
+    RAW_EXTENSIONS, EVENT_COLUMN, is_binary_upload, parse_channel_list
+)
+from programs.data_processing.save_cluster_with_clustered_label import save_cluster_with_clustered_label
+from programs.training.numpy_ghsom import ENGINES, SCHEDULES, TRAINING_REPORT_SUFFIX, train_ghsom
+from programs.training.project_cells import project_cells
+from programs.training.jvm_service import run_in_service
+from programs.training.train_monitor import (
+    new_progress, progress_path, run_monitored, write_progress, finish_progress, record_map
+)
+from programs.evaluation.clustering_scores import clustering_scores
+from programs.pipeline.manifest import (
+    load_manifest, save_manifest, stage_key, is_stage_fresh, record_stage, invalidate_stage, file_digest
+)
+from programs.pipeline.profiling import (
+    start_stage_profile, end_stage_profile, file_bytes, write_job_profile
+)
 
 
 # ============================================================
 # ⭐ Pipeline Functions（原封不動，只更新傳參數）
 # ============================================================
-def create_ghsom_input_file(data, file, index, label, subnum):
-    try:
-        format_ghsom_input_vector(data, file, index, label, subnum)
-        print('Success to create ghsom input file.')
-    except Exception as e:
-        print('Failed to create ghsom input file.')
-        print('Error:', e)
-
 def create_ghsom_prop_file(name, file, tau1=0.1, tau2=0.01,
                            sparseData='yes', isNormalized='false',
                            randomSeed=7, xSize=2, ySize=2,
@@ -39,23 +74,69 @@ def create_ghsom_prop_file(name, file, tau1=0.1, tau2=0.01,
         writer.writerow([f'tau={tau1}'])
         writer.writerow([f'tau2={tau2}'])
 
-def ghsom_clustering(name, file):
+def resolve_ghsom_prop_params(tau1, tau2, prop_params=None):
+    """
+    create_ghsom_prop_file 實際會寫進 .prop 的全部參數（預設值 + 覆寫），result cache 的 fingerprint 用
+    """
+    params = {
+        name: param.default
+        for name, param in inspect.signature(create_ghsom_prop_file).parameters.items()
+        if param.default is not inspect.Parameter.empty
+    }
+    params.update(prop_params or {})
+    params["tau1"] = tau1
+    params["tau2"] = tau2
+    return params
+
+def pipeline_fingerprint_params(tau1, tau2, index=None, label=None, subnum=None, prop_params=None,
+                                channels=None):
+    """
+    所有會影響結果的參數（GHSOM .prop + index / label / subnum，FCS / h5ad 再加上 channel subset）
+    """
+    params = {
+        "ghsom": resolve_ghsom_prop_params(tau1, tau2, prop_params),
+        "index": index,
+        "label": label,
+        "subnum": subnum,
+    }
+    # 沒選 channel 時不加 key → CSV job 的舊 fingerprint 不變
+    if channels is not None:
+        params["channels"] = list(channels)
+    return params
+
+def run_command(cmd):
+    """
+    os.system + 轉成 exit code（profiling 記錄用）
+    """
+    return os.waitstatus_to_exitcode(os.system(cmd))
+
+def ghsom_clustering(name, file, service=False, lean=False, progress=None):
+    prop = f'./applications/{file}/GHSOM/{name}_ghsom.prop'
+    # -h：HTML 報表（.html / somtoolbox.css / wz_tooltip.js）；lean → 不寫 HTML，--noDWM 也不寫 .dwm（都沒有人讀）
+    options = ["--noDWM"] if lean else ["-h"]
+    # somtoolbox 的 log parse 成進度、超過上限就 kill（programs/training/train_monitor.py）
+    if progress is None:
+        progress = new_progress(None, file, "somtoolbox", "service" if service else "launch")
+    if service:
+        # 常駐 JVM（programs/training/jvm_service.py）；無法使用 → 照舊每個 job 開一個 JVM
+        exit_code = run_in_service(["GHSOM", os.path.abspath(prop), *options], progress)
+        if exit_code is not None:
+            return exit_code
+        print("[WARNING] somtoolbox service unavailable (needs a Java 11+ JDK); launching somtoolbox.sh.")
+        write_progress(progress, mode="launch")
     try:
-        cmd = f'./programs/GHSOM/somtoolbox.sh GHSOM ./applications/{file}/GHSOM/{name}_ghsom.prop -h'
-        print("cmd=", cmd)
-        os.system(cmd)
+        cmd = ['./programs/GHSOM/somtoolbox.sh', 'GHSOM', prop, *options]
+        print("cmd=", " ".join(cmd))
+        return run_monitored(cmd, progress)
     except Exception as e:
         print("Error:", e)
-
-def extract_ghsom_output(name, current_path):
-    cmd = f'7z e applications/{name}/GHSOM/output/{name} -o{current_path}/applications/{name}/GHSOM/output/{name}'
-    print("cmd=", cmd)
-    os.system(cmd)
+        finish_progress(progress, None, error=str(e))
 
 def save_ghsom_cluster_label(name, tau1, tau2, index):
     cmd = f'python ./programs/data_processing/save_cluster_with_clustered_label.py --name={name} --tau1={tau1} --tau2={tau2} --index={index}'
-    os.system(cmd)
+    exit_code = run_command(cmd)
     print('Success transfer cluster label.')
+    return exit_code
 
 def clustering_evaluation(name, tau1=0.1, tau2=0.01, label=None, index=None):
     cmd = f'python ./programs/evaluation/clustering_scores.py --name={name} --tau1={tau1} --tau2={tau2}'
@@ -66,50 +147,792 @@ def clustering_evaluation(name, tau1=0.1, tau2=0.01, label=None, index=None):
     if index is not None:
         cmd += f' --index={index}'
 
-    os.system(cmd)
+    exit_code = run_command(cmd)
     print('Success evaluating.')
+    return exit_code
 
 
 # ============================================================
-# ⭐⭐ 封裝 Pipeline 主流程（模組化核心） ⭐⭐
+# ⭐ In-process Stages（raw-data 只讀一次，所有 stage 共用）
 # ============================================================
-def run_pipeline(data, tau1, tau2, index=None, label=None, subnum=None, feature='mean'):
+def build_job_context(data, tau1, tau2, index=None, label=None, subnum=None,
+                      feature='mean', label_backup_dir=None, prop_params=None, decimals=None,
+                      ingest='memory', memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, channels=None,
+                      n_components=None, sampling='uniform', engine='somtoolbox', train_workers=1,
+                      train_schedule='fixed', map_cache=True, project=False, jvm_service=False,
+                      lean_output=False, train_timeout_s=None, train_memory_mb=None):
     """
-    外部 scripts 也能呼叫：
-    from execute import run_pipeline
-    run_pipeline(data="xxx", tau1=0.08, tau2=0.2)
+    一個 job 在 in-process pipeline 中共用的狀態（dict，各 stage 讀寫）
+    """
+    file = f"{data}-{tau1}-{tau2}"
+    app_path = f"./applications/{file}"
+    raw_path = find_raw_path(data)
+    if is_binary_upload(raw_path):
+        # FCS / h5ad 一律直接轉成 columnar store（沒有 CSV 可以 fallback）
+        ingest = "columnar"
+        index = EVENT_COLUMN if index is None else index
+    return {
+        "data": data,
+        "tau1": tau1,
+        "tau2": tau2,
+        "index": index,
+        "label": label,
+        "subnum": subnum,
+        "sampling": sampling,               # subnum 的抽樣方式："uniform"（舊版）或 "sketch"（density-aware）
+        "feature": feature,
+        "label_backup_dir": label_backup_dir,
+        "prop_params": prop_params or {},   # create_ghsom_prop_file 的其他參數
+        "decimals": decimals,               # .in vector round 到小數第幾位（None → 完整精度）
+        "ingest": ingest,                   # "memory"：整份 read_csv；"chunked"：分塊 float32；
+                                            # "columnar"：轉成 .npy columnar store 後 memory-map
+        "memory_budget_mb": memory_budget_mb,
+        "channels": channels,               # FCS / h5ad 只讀這些 channel / gene（None → 全部）
+        "n_components": n_components,       # PCA 降到幾維再訓練 GHSOM（None → 不降維）
+        "engine": engine,                   # GHSOM 訓練引擎："somtoolbox"（Java）或 "numpy"
+        "train_workers": train_workers,     # numpy 引擎同時訓練子 map 的 process 數（0 → CPU 數）
+        "train_schedule": train_schedule,   # numpy 引擎的訓練量："fixed"（numIterations）或 "adaptive"
+        "map_cache": map_cache,             # numpy 引擎沿用只有 tau2 不同的 job 訓練過的 map
+        "project": project,                 # subnum 抽樣訓練後，其餘 cell 投影到訓練好的階層
+        "jvm_service": jvm_service,         # somtoolbox 在常駐 JVM 中訓練（不是每個 job 開一個 JVM）
+        "lean_output": lean_output,         # somtoolbox 不寫 .dwm 與 HTML 報表
+        "train_timeout_s": train_timeout_s, # somtoolbox 訓練的 wall-clock 上限（秒，None → 不限）
+        "train_memory_mb": train_memory_mb, # somtoolbox 訓練（含 JVM）的 RSS 上限（MB，None → 不限）
+        "file": file,
+        "current_path": os.getcwd(),
+        "raw_path": raw_path,
+        "app_path": app_path,
+        "in_path": f"{app_path}/GHSOM/data/{data}_ghsom.in",
+        "kept_rows_path": kept_rows_path(data, file),
+        "prop_path": f"{app_path}/GHSOM/{data}_ghsom.prop",
+        "progress_path": progress_path(app_path),   # 訓練進度（web app 讀）
+        "output_dir": f"{app_path}/GHSOM/output/{file}",
+        "cluster_path": f"{app_path}/data/{data}_with_clustered_label-{tau1}-{tau2}.csv",
+        "features_path": f"{app_path}/data/{data}{FEATURES_SUFFIX}",
+        "result_path": f"./Result/{data}_result.csv",  # 同一個 data 的所有 tau 共用（web / 舊 scripts 讀）
+        "score_path": f"{app_path}/{data}_result.csv",  # 這個 job 自己的 scores（evaluate 的 output）
+        "df": None,            # raw-data（lazy，只 parse 一次）
+        "store": None,         # columnar store（ingest="columnar"，lazy open）
+        "reduction": None,     # reduce stage 的結果（fingerprint / cache 路徑）
+        "df_cluster": None,    # save_cluster_with_clustered_label 的結果
+        "stage_results": {},   # { stage_name : stage 回傳值（會記進 manifest） }
+        "timings": {},         # { stage_name : wall seconds }
+        "exit_codes": {},      # { stage_name : 外部程式 exit code }
+        "profile": [],         # 每個 stage 的 profiling record（寫到 profile.json）
+        "manifest": None,
+        "force": False,
+        # DAG scheduler 可能同時跑同一個 job 的兩個 stage
+        "manifest_lock": threading.Lock(),
+        "load_lock": threading.Lock(),
+    }
+
+def find_raw_path(data):
+    """
+    raw-data/<data>.csv / .fcs / .h5ad，哪個存在用哪個（都不存在 → .csv，讓後面的 stage 報錯）
+    """
+    for ext in RAW_EXTENSIONS:
+        path = f"./raw-data/{data}{ext}"
+        if os.path.exists(path):
+            return path
+    return f"./raw-data/{data}.csv"
+
+def binary_label(ctx):
+    # h5ad 的 label 來自 obs，轉 store 時一併讀進來（CSV 的 label 本來就在欄位裡）
+    return ctx["label"] if is_binary_upload(ctx["raw_path"]) else None
+
+def binary_params(ctx):
+    """
+    FCS / h5ad 的 channel subset / obs label 會改變 store 內容 → 記進 manifest params
+    （CSV job 不加 key，舊 manifest 仍然 fresh）
+    """
+    params = {}
+    if ctx["channels"] is not None:
+        params["channels"] = list(ctx["channels"])
+    if binary_label(ctx) is not None:
+        params["label"] = binary_label(ctx)
+    return params
+
+def load_store(ctx):
+    """
+    ingest="columnar" 時的 columnar store；還沒轉好 / 轉檔失敗 → None（各 stage 改讀 CSV）
+    """
+    if ctx["ingest"] != "columnar":
+        return None
+    with ctx["load_lock"]:
+        if ctx["store"] is None:
+            ctx["store"] = open_store(ctx["raw_path"], channels=ctx["channels"], label=binary_label(ctx))
+    return ctx["store"]
+
+def load_sparse_features(ctx):
+    """
+    sparse h5ad 上傳 → (csr_matrix, gene 名稱)（memory-mapped，不轉 dense）；其他 → None
+    此時 load_raw_data 只有 Event / label 欄位
+    """
+    return read_sparse_features(load_store(ctx))
+
+def load_raw_data(ctx):
+    store = load_store(ctx)
+    with ctx["load_lock"]:
+        if ctx["df"] is None:
+            if store is not None:
+                ctx["df"] = read_columns(store)
+            elif ctx["ingest"] == "chunked":
+                ctx["df"] = read_raw_float32(ctx["raw_path"], ctx["index"], ctx["label"],
+                                             ctx["memory_budget_mb"])
+            else:
+                ctx["df"] = pd.read_csv(ctx["raw_path"], encoding='utf-8')
+    return ctx["df"]
+
+def iter_feature_blocks(ctx):
+    """
+    (feature 名稱, 預估列數, callable → 依序產生 feature block)：index / label 已排除、NA 補 0，
+    值與 format_input 寫進 .in 的相同；sparse 上傳 → csr_matrix block，其他 → DataFrame block
+    """
+    index, label = ctx["index"], ctx["label"]
+    raw_path = ctx["raw_path"]
+
+    sparse_features = load_sparse_features(ctx)
+    if sparse_features is not None:
+        X, names = sparse_features
+        block_rows = chunk_rows_for_budget(len(names), ctx["memory_budget_mb"])
+        return names, X.shape[0], lambda: (X[start:start + block_rows]
+                                           for start in range(0, X.shape[0], block_rows))
+
+    store = load_store(ctx)
+    if store is not None and ctx["df"] is None:
+        names = marker_columns(column_names(store), index, label)
+        block_rows = chunk_rows_for_budget(len(names), ctx["memory_budget_mb"])
+        return names, store["rows"], lambda: (block.fillna(0)
+                                              for block in iter_column_blocks(store, names, block_rows))
+
+    if ctx["ingest"] == "chunked" and ctx["df"] is None:
+        names = marker_columns(read_header(raw_path), index, label)
+        return names, count_csv_rows(raw_path), lambda: (
+            chunk[names] for chunk in iter_raw_chunks(raw_path, index, label, ctx["memory_budget_mb"]))
+
+    df = load_raw_data(ctx)
+    names = marker_columns(df.columns, index, label)
+    block_rows = chunk_rows_for_budget(len(names), ctx["memory_budget_mb"])
+    return names, len(df), lambda: (df[names].iloc[start:start + block_rows].fillna(0)
+                                    for start in range(0, len(df), block_rows))
+
+def reduction_params(ctx):
+    # 沒開降維時不加 key → 舊 manifest 仍然 fresh
+    return {} if ctx["n_components"] is None else {"n_components": ctx["n_components"]}
+
+def reduction_result(ctx):
+    """
+    這次跑出來的，或 manifest 記錄的（reduce stage fresh 被跳過時）；沒有降維 → None
+    """
+    return ctx["reduction"] or ctx["stage_results"].get("reduce")
+
+def sampling_params(ctx):
+    # uniform（舊版）不加 key → 舊 manifest 仍然 fresh
+    return {} if ctx["sampling"] == "uniform" else {"sampling": ctx["sampling"]}
+
+def sketch_rows(ctx):
+    """
+    sampling="sketch" 且有 subnum → geometric sketch 挑出的列（sorted），其他 → None（照舊均勻抽樣）
+    有 PCA 降維時直接用降維後的前幾維，不再另外 fit
+    """
+    if ctx["sampling"] != "sketch" or ctx["subnum"] is None:
+        return None
+    reduction = reduction_result(ctx)
+    if reduction is not None:
+        coords = np.load(reduction["projected"], mmap_mode="r")[:, :SKETCH_COMPONENTS]
+    else:
+        _, n_rows, blocks = iter_feature_blocks(ctx)
+        coords = sketch_coordinates(blocks, n_rows)
+    keep = geometric_sketch(coords, ctx["subnum"])
+    if keep is not None:
+        print(f"[INFO] Geometric sketch: {len(keep)} of {coords.shape[0]} cells")
+    return keep
+
+def engine_params(ctx):
+    # somtoolbox（舊版）/ fixed schedule 不加 key → 舊 manifest 仍然 fresh
+    params = {}
+    if ctx["engine"] != "somtoolbox":
+        params["engine"] = ctx["engine"]
+    if ctx["train_schedule"] != "fixed":
+        params["schedule"] = ctx["train_schedule"]
+    if ctx["lean_output"]:
+        params["lean_output"] = True
+    return params
+
+def projection_params(ctx):
+    # 沒開投影不加 key → 舊 manifest 仍然 fresh
+    return {"project": True} if ctx["project"] else {}
+
+def projected_cells(ctx):
+    """
+    project=True 且 .in 有抽樣 → 沒被抽到的 cell 依訓練好的階層（.wgt prototypes）一路找 BMU 到 leaf，
+    回傳 project_cells 的 DataFrame（index = raw-data 的列）；其他 → None
+    """
+    if not ctx["project"]:
+        return None
+    kept_rows = load_kept_rows(ctx["kept_rows_path"])
+    if kept_rows is None:
+        print("[INFO] Every cell was used for training; nothing to project.")
+        return None
+
+    # 與 .in 相同的 feature 空間：有降維 → 降維後的 vectors，否則 marker（NA 補 0）
+    reduction = reduction_result(ctx)
+    if reduction is not None:
+        vectors = np.load(reduction["projected"], mmap_mode="r")
+        n_rows = vectors.shape[0]
+        block_rows = chunk_rows_for_budget(vectors.shape[1], ctx["memory_budget_mb"])
+        blocks = (vectors[start:start + block_rows] for start in range(0, n_rows, block_rows))
+    else:
+        _, n_rows, make_blocks = iter_feature_blocks(ctx)
+        blocks = make_blocks()
+    rest = np.setdiff1d(np.arange(n_rows), kept_rows)
+    projected = project_cells(ctx["output_dir"], ctx["data"], blocks, rest, ctx["decimals"])
+    print(f"[OK] Projected {len(projected)} cells onto the GHSOM trained on {len(kept_rows)} cells")
+    return projected
+
+def reduction_outputs(ctx):
+    reduction = reduction_result(ctx)
+    if reduction is None:
+        return []
+    return [path for path in (reduction["model"], reduction["projected"]) if os.path.exists(path)]
+
+def output_files(ctx, *patterns):
+    return sorted(
+        path
+        for pattern in patterns
+        for path in glob.glob(os.path.join(ctx["output_dir"], pattern))
+    )
+
+def label_backup_path(ctx):
+    return os.path.join(ctx["label_backup_dir"], f"{ctx['data']}_label.csv")
+
+def stage_convert_store(ctx):
+    """
+    ingest="columnar"：raw-data CSV 只 parse 這一次，之後的 stage 都 memory-map .npy
+    FCS / h5ad：直接從 binary 讀進 store（失敗就是失敗，不 fallback）
+    """
+    if ctx["ingest"] != "columnar" or load_store(ctx) is not None:
+        return
+    if is_binary_upload(ctx["raw_path"]):
+        store = build_store_from_binary(ctx["raw_path"], ctx["channels"], binary_label(ctx),
+                                        memory_budget_mb=ctx["memory_budget_mb"])
+        with ctx["load_lock"]:
+            ctx["store"] = store
+        return
+    try:
+        store = build_store(ctx["raw_path"], memory_budget_mb=ctx["memory_budget_mb"])
+    except ValueError as e:
+        print(f"[WARNING] Cannot build columnar store, falling back to CSV: {e}")
+        return
+    with ctx["load_lock"]:
+        ctx["store"] = store
+
+def stage_reduce(ctx):
+    """
+    n_components 有設定才做：抽樣 fit randomized PCA → 分塊投影全部 cell
+    以 dataset fingerprint（raw-data 內容 + 降維參數）cache，同一份資料的 tau grid 只算一次
+    """
+    if ctx["n_components"] is None:
+        return None
+
+    with ctx["manifest_lock"]:
+        data_hash = file_digest(ctx["manifest"], ctx["raw_path"])
+    fingerprint = reduction_fingerprint(data_hash, {
+        "n_components": ctx["n_components"], "index": ctx["index"], "label": ctx["label"],
+        "ingest": ctx["ingest"], "sample_rows": REDUCTION_SAMPLE_ROWS, "seed": REDUCTION_SEED,
+        **binary_params(ctx),
+    })
+    paths = reduction_paths(fingerprint)
+
+    if os.path.exists(paths["model"]) and os.path.exists(paths["projected"]):
+        print(f"[CACHE HIT] PCA reduction {fingerprint[:12]}")
+        reduction, _ = load_reduction(paths["model"])
+    else:
+        names, n_rows, blocks = iter_feature_blocks(ctx)
+        sample = collect_rows(blocks(), sample_indices(n_rows))
+        print(f"[INFO] Fitting randomized PCA on {sample.shape[0]} x {sample.shape[1]} sample")
+        reduction = fit_reduction(sample, ctx["n_components"])
+        del sample
+        project_to_file(paths["projected"], blocks(), n_rows, reduction)
+        # model 最後寫：model 存在就代表投影也已完成
+        save_reduction(paths["model"], reduction, names)
+
+    explained = float(np.sum(reduction["explained_variance_ratio"]))
+    ctx["reduction"] = {
+        "fingerprint": fingerprint,
+        "model": paths["model"],
+        "projected": paths["projected"],
+        "n_components": int(reduction["components"].shape[0]),
+        "explained_variance": round(explained, 4),
+    }
+    print(f"[OK] PCA reduction: {reduction['components'].shape[1]} → {ctx['reduction']['n_components']} "
+          f"dims, explained variance {explained:.1%}")
+    return ctx["reduction"]
+
+def stage_format_input(ctx):
+    # 失敗直接 raise，stage 才不會被記成完成
+    keep = sketch_rows(ctx)
+    reduction = reduction_result(ctx)
+    if reduction is not None:
+        # GHSOM 用降維後的 vectors 訓練；label / feature map 仍用原始 marker
+        format_ghsom_input_vector_reduced(ctx["data"], ctx["file"], reduction["projected"],
+                                          ctx["subnum"], ctx["decimals"], keep=keep)
+        print('Success to create ghsom input file.')
+        return
+    store = load_store(ctx)
+    if store is not None and ctx["df"] is None:
+        format_ghsom_input_vector_from_store(ctx["data"], ctx["file"], ctx["index"], ctx["label"],
+                                             ctx["subnum"], store, ctx["memory_budget_mb"],
+                                             ctx["decimals"], keep=keep)
+        print('Success to create ghsom input file.')
+        return
+    if ctx["ingest"] == "chunked":
+        # 不載入整份 raw-data：訓練前的峰值記憶體只跟 memory_budget_mb 有關
+        format_ghsom_input_vector_chunked(ctx["data"], ctx["file"], ctx["index"], ctx["label"],
+                                          ctx["subnum"], ctx["memory_budget_mb"], ctx["decimals"],
+                                          keep=keep)
+        print('Success to create ghsom input file.')
+        return
+    format_ghsom_input_vector(ctx["data"], ctx["file"], ctx["index"], ctx["label"],
+                              ctx["subnum"], df=load_raw_data(ctx), decimals=ctx["decimals"], keep=keep)
+    print('Success to create ghsom input file.')
+
+def stage_create_prop(ctx):
+    create_ghsom_prop_file(ctx["data"], ctx["file"], ctx["tau1"], ctx["tau2"], **ctx["prop_params"])
+
+def stage_train(ctx):
+    # 上一次（不同引擎 / 參數）留下的子 map 會被 get_ghsom_dim 算進去 → 先清掉
+    for path in output_files(ctx, "*.gz", "*.map", "*.unit", "*.wgt", "*.dwm", "*.html", "*.css", "*.js",
+                             f"*{TRAINING_REPORT_SUFFIX}"):
+        os.remove(path)
+
+    stats = None
+    mode = "numpy" if ctx["engine"] == "numpy" else ("service" if ctx["jvm_service"] else "launch")
+    progress = new_progress(ctx["progress_path"], ctx["file"], ctx["engine"], mode,
+                            ctx["train_timeout_s"], ctx["train_memory_mb"])
+    if ctx["engine"] == "numpy":
+        if ctx["train_timeout_s"] is not None or ctx["train_memory_mb"] is not None:
+            print("[WARNING] Training limits apply to the somtoolbox process; "
+                  "the numpy engine trains inside the pipeline process.")
+        # 同一份 .prop / .in，在 process 內訓練，輸出格式與 somtoolbox 相同
+        # train_workers / map_cache 不影響結果（每張 map 的亂數由路徑決定）→ 不記進 manifest params
+        # 每張 map 訓練完就更新進度（maps_trained / depth / MQE 來自訓練紀錄）
+        write_progress(progress)
+        try:
+            stats = train_ghsom(ctx["prop_path"], ctx["train_workers"], ctx["train_schedule"], ctx["map_cache"],
+                                on_map=lambda report, qe0: record_map(progress, report, qe0))
+        except Exception as e:
+            finish_progress(progress, None, error=str(e))
+            raise
+        finish_progress(progress, 0)
+    else:
+        if ctx["train_workers"] != 1:
+            print("[WARNING] somtoolbox trains the whole hierarchy in one JVM; "
+                  "parallel child maps need --engine=numpy.")
+        if ctx["train_schedule"] != "fixed":
+            print("[WARNING] somtoolbox always trains numIterations per map; "
+                  "the adaptive schedule needs --engine=numpy.")
+        ctx["exit_codes"]["train"] = ghsom_clustering(ctx["data"], ctx["file"], ctx["jvm_service"],
+                                                      ctx["lean_output"], progress)
+        if progress["state"]["status"] == "killed":
+            raise RuntimeError(f"GHSOM training killed: {progress['state']['error']}")
+    # somtoolbox 失敗不會丟 exception（exit code 也不一定非 0）→ 用輸出檔判斷
+    if not output_files(ctx, "*.unit.gz"):
+        raise RuntimeError(f"GHSOM training produced no .unit.gz in {ctx['output_dir']}")
+    return stats
+
+def stage_label(ctx):
+    features, feature_names = load_sparse_features(ctx) or (None, None)
+    ctx["df_cluster"] = save_cluster_with_clustered_label(
+        ctx["data"], ctx["tau1"], ctx["tau2"], ctx["index"], df_source=load_raw_data(ctx),
+        features=features, feature_names=feature_names, projected=projected_cells(ctx))
+    print('Success transfer cluster label.')
+
+def stage_evaluate(ctx):
+    # CH / DB：有降維 → 在降維後的空間算；sparse 上傳 → 在 CSR 上算
+    reduction = reduction_result(ctx)
+    if reduction is not None:
+        features = np.load(reduction["projected"], mmap_mode="r")
+    else:
+        features, _ = load_sparse_features(ctx) or (None, None)
+    scores = clustering_scores(
+        ctx["data"], ctx["tau1"], ctx["tau2"], ctx["label"], ctx["index"],
+        df_raw=load_raw_data(ctx), df_cluster=ctx["df_cluster"], features=features)
+    keep_job_scores(ctx)
+    print('Success evaluating.')
+    return scores
+
+def keep_job_scores(ctx):
+    """
+    Result/<data>_result.csv 會被同一個 data 的其他 tau 覆寫 → 複製一份到 job 資料夾給 manifest 追蹤
+    """
+    shutil.copyfile(ctx["result_path"], ctx["score_path"])
+
+def restore_result_copy(ctx):
+    """
+    evaluate 被跳過時，Result/<data>_result.csv 可能是其他 tau 的 → 用這個 job 的 scores 蓋回去
+    """
+    os.makedirs(os.path.dirname(ctx["result_path"]), exist_ok=True)
+    shutil.copyfile(ctx["score_path"], ctx["result_path"])
+
+def stage_label_script(ctx):
+    if ctx["project"]:
+        print("[WARNING] Projecting the remaining cells needs the in-process pipeline; "
+              "cells left out of training keep an empty cluster.")
+    ctx["exit_codes"]["label"] = save_ghsom_cluster_label(
+        ctx["data"], ctx["tau1"], ctx["tau2"], ctx["index"])
+
+def stage_evaluate_script(ctx):
+    ctx["exit_codes"]["evaluate"] = clustering_evaluation(
+        ctx["data"], ctx["tau1"], ctx["tau2"], ctx["label"], ctx["index"])
+    keep_job_scores(ctx)
+    return pd.read_csv(ctx["score_path"]).to_dict(orient="records")[0]
+
+def stage_backup_label(ctx):
+    """
+    備份 label 欄位到 label/<job>_label.csv（原本在 web/worker.py 重新讀一次 CSV）
+    """
+    label = ctx["label"]
+    backup_dir = ctx["label_backup_dir"]
+
+    if backup_dir is None:
+        return
+    if label is None:
+        print(f"[INFO] User did not provide label. No label backup needed.")
+        return
+
+    try:
+        store = load_store(ctx)
+        if store is not None and ctx["df"] is None:
+            # 只 memory-map label 這一欄
+            df_raw = read_columns(store, [label]) if label in column_names(store) else pd.DataFrame()
+        elif ctx["ingest"] == "chunked" and ctx["df"] is None:
+            # 只需要 label 這一欄，不為了備份載入整份 raw-data
+            columns = pd.read_csv(ctx["raw_path"], nrows=0).columns
+            df_raw = pd.read_csv(ctx["raw_path"], usecols=[label]) if label in columns else pd.DataFrame()
+        else:
+            df_raw = load_raw_data(ctx)
+        if label in df_raw.columns:
+            os.makedirs(backup_dir, exist_ok=True)
+            backup_path = label_backup_path(ctx)
+            df_raw[[label]].to_csv(backup_path, index=False)
+            print(f"[LABEL SAVED] → {backup_path}")
+        else:
+            print(f"[WARNING] Label column '{label}' not found in raw CSV. Skip backup.")
+    except Exception as e:
+        print(f"[ERROR] Failed to backup label column: {e}")
+
+def backup_label_outputs(ctx):
+    if ctx["label_backup_dir"] is None or ctx["label"] is None:
+        return []
+    path = label_backup_path(ctx)
+    return [path] if os.path.exists(path) else []
+
+
+# ------------------------------------------------------------
+# Stage 表：每個 stage 的 inputs / params / outputs 都記進 manifest，
+# 重跑時只做 inputs hash 變了或 outputs 不見的 stage
+# （outputs 在 stage 跑完後才計算，例如 GHSOM 產生的檔名事先不知道）
+# on_skip（可選）：manifest 判定 up to date 而跳過時呼叫（例如把共用的檔案換回這個 job 的版本）
+# ------------------------------------------------------------
+# Pipeline 順序（完全不變）：(convert store) → (reduce) → format → train → label → evaluate → label backup
+# pool / deps 給 web worker 的 DAG scheduler 用（programs/pipeline/scheduler.py）；
+# run_pipeline 則依列表順序依序執行
+PIPELINE_STAGES = [
+    {
+        "name": "convert_store",
+        "pool": "python",
+        "deps": [],
+        "func": stage_convert_store,
+        "inputs": lambda ctx: [ctx["raw_path"]],
+        "params": lambda ctx: {"ingest": ctx["ingest"], **binary_params(ctx)},
+        "outputs": lambda ctx: store_files(load_store(ctx)),
+    },
+    {
+        "name": "reduce",
+        "pool": "python",
+        "deps": ["convert_store"],
+        "func": stage_reduce,
+        "inputs": lambda ctx: [ctx["raw_path"]],
+        "params": lambda ctx: {"n_components": ctx["n_components"], "index": ctx["index"],
+                               "label": ctx["label"], "ingest": ctx["ingest"], **binary_params(ctx)},
+        "outputs": reduction_outputs,
+    },
+    {
+        "name": "format_input",
+        "pool": "python",
+        "deps": ["convert_store", "reduce"],
+        "func": stage_format_input,
+        "inputs": lambda ctx: [ctx["raw_path"]],
+        "params": lambda ctx: {"index": ctx["index"], "label": ctx["label"], "subnum": ctx["subnum"],
+                               "decimals": ctx["decimals"], "ingest": ctx["ingest"],
+                               **binary_params(ctx), **reduction_params(ctx), **sampling_params(ctx)},
+        "outputs": lambda ctx: [ctx["in_path"]] + (
+            [ctx["kept_rows_path"]] if os.path.exists(ctx["kept_rows_path"]) else []),
+    },
+    {
+        "name": "create_prop",
+        "pool": "python",
+        "deps": [],
+        "func": stage_create_prop,
+        "inputs": lambda ctx: [],
+        "params": lambda ctx: {"tau1": ctx["tau1"], "tau2": ctx["tau2"], **ctx["prop_params"]},
+        "outputs": lambda ctx: [ctx["prop_path"]],
+    },
+    {
+        "name": "train",
+        "pool": "jvm",
+        "deps": ["format_input", "create_prop"],
+        "func": stage_train,
+        "inputs": lambda ctx: [ctx["in_path"], ctx["prop_path"]],
+        "params": engine_params,
+        "outputs": lambda ctx: output_files(ctx, "*.gz", "*.map", f"*{TRAINING_REPORT_SUFFIX}"),
+    },
+    {
+        "name": "label",
+        "pool": "python",
+        "deps": ["train"],
+        "func": stage_label,
+        # .unit.gz / .wgt.gz 直接讀（programs/data_processing/ghsom_output.py），不再用 7z 解壓
+        "inputs": lambda ctx: [ctx["raw_path"]] + output_files(ctx, "*.unit.gz") + (
+            [ctx["kept_rows_path"]] if os.path.exists(ctx["kept_rows_path"]) else []) + (
+            output_files(ctx, "*.wgt.gz") if ctx["project"] else []),
+        "params": lambda ctx: {"index": ctx["index"], **binary_params(ctx), **projection_params(ctx)},
+        "outputs": lambda ctx: [ctx["cluster_path"]] + (
+            [ctx["features_path"]] if os.path.exists(ctx["features_path"]) else []),
+    },
+    {
+        "name": "evaluate",
+        "pool": "python",
+        "deps": ["label"],
+        "func": stage_evaluate,
+        "inputs": lambda ctx: [ctx["raw_path"], ctx["cluster_path"]],
+        "params": lambda ctx: {"index": ctx["index"], "label": ctx["label"], **binary_params(ctx),
+                               **reduction_params(ctx)},
+        "outputs": lambda ctx: [ctx["score_path"]],
+        "on_skip": restore_result_copy,
+    },
+    {
+        "name": "backup_label",
+        "pool": "python",
+        "deps": ["convert_store"],
+        "func": stage_backup_label,
+        "inputs": lambda ctx: [ctx["raw_path"]],
+        "params": lambda ctx: {"label": ctx["label"], "label_backup_dir": ctx["label_backup_dir"]},
+        "outputs": backup_label_outputs,
+    },
+]
+
+# 舊版 script 模式：label / evaluation 用 os.system 執行，其餘 stage 相同
+SCRIPT_STAGE_FUNCS = {
+    "label": stage_label_script,
+    "evaluate": stage_evaluate_script,
+}
+
+def build_pipeline_stages(inprocess=True):
+    if inprocess:
+        return PIPELINE_STAGES
+    return [dict(stage, func=SCRIPT_STAGE_FUNCS.get(stage["name"], stage["func"]))
+            for stage in PIPELINE_STAGES]
+
+def run_stage(ctx, stage):
+    """
+    manifest 判斷是否 fresh → 跳過；否則執行並記錄 inputs hash / outputs 與 profiling record
+    """
+    stage_name = stage["name"]
+    manifest = ctx["manifest"]
+
+    with ctx["manifest_lock"]:
+        params = stage["params"](ctx)
+        inputs = stage["inputs"](ctx)
+        key, input_hashes = stage_key(manifest, inputs, params)
+
+        if not ctx["force"] and is_stage_fresh(manifest, stage_name, key):
+            ctx["stage_results"][stage_name] = manifest["stages"][stage_name]["result"]
+            if "on_skip" in stage:
+                stage["on_skip"](ctx)
+            ctx["profile"].append({"stage": stage_name, "status": "skipped"})
+            print(f"[STAGE] {stage_name}: up to date, skipped.")
+            return
+
+        # 先移除舊紀錄：跑到一半 crash 時這個 stage 一定會被視為 stale
+        invalidate_stage(manifest, stage_name)
+        save_manifest(ctx["app_path"], manifest)
+
+    snapshot = start_stage_profile()
+    try:
+        result = stage["func"](ctx)
+    except BaseException:
+        record = end_stage_profile(snapshot, stage_name, status="failed")
+        raise
+    else:
+        record = end_stage_profile(snapshot, stage_name)
+    finally:
+        record["input_bytes"] = file_bytes(inputs)
+        record["exit_code"] = ctx["exit_codes"].get(stage_name)
+        ctx["profile"].append(record)
+        ctx["timings"][stage_name] = record["wall_s"]
+        print(f"[STAGE] {ctx['file']} {stage_name}: {record['wall_s']:.2f}s "
+              f"(cpu {record['cpu_s']:.2f}s, peak RSS {record['peak_rss_mb']} MB)")
+
+    with ctx["manifest_lock"]:
+        outputs = stage["outputs"](ctx)
+        record["output_bytes"] = file_bytes(outputs)
+        ctx["stage_results"][stage_name] = result
+        record_stage(manifest, stage_name, key, input_hashes, params, outputs, result)
+        save_manifest(ctx["app_path"], manifest)
+
+def print_stage_timings(ctx):
+    print("========== Stage wall time ==========")
+    for stage_name, elapsed in ctx["timings"].items():
+        print(f"{stage_name:<14}{elapsed:>10.2f}s")
+    print(f"{'total':<14}{sum(ctx['timings'].values()):>10.2f}s")
+
+
+# ============================================================
+# ⭐ Job 準備與收尾（run_pipeline 與 web worker 共用）
+# ============================================================
+def prepare_pipeline(data, tau1, tau2, index=None, label=None, subnum=None, feature='mean',
+                     label_backup_dir=None, force=False, prop_params=None, decimals=None,
+                     ingest='memory', memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, channels=None,
+                     n_components=None, sampling='uniform', engine='somtoolbox', train_workers=1,
+                     train_schedule='fixed', map_cache=True, project=False, jvm_service=False,
+                     lean_output=False, train_timeout_s=None, train_memory_mb=None):
+    """
+    建立 ctx、applications 資料夾與 manifest（run_pipeline 與 web worker 共用）
     """
     print(f"tau1 = {tau1}, tau2 = {tau2}")
     print(f"data = {data}, index = {index}, label = {label}")
 
-    file = f"{data}-{tau1}-{tau2}"
-    current_path = os.getcwd()
-    print("Current:", current_path)
+    ctx = build_job_context(data, tau1, tau2, index, label, subnum, feature,
+                            label_backup_dir, prop_params, decimals, ingest, memory_budget_mb,
+                            channels, n_components, sampling, engine, train_workers, train_schedule,
+                            map_cache, project, jvm_service, lean_output, train_timeout_s,
+                            train_memory_mb)
+    ctx["force"] = force
+    print("Current:", ctx["current_path"])
 
     # 建立 applications folder
-    app_path = f'{current_path}/applications/{file}'
+    app_path = ctx["app_path"]
     if os.path.exists(app_path):
-        print(f'Warning : /applications/{file} already exists.')
+        print(f'Resuming /applications/{ctx["file"]} ...')
     else:
-        print(f'Creating /applications/{file} ...')
-        try:
-            os.makedirs(f'{app_path}')
-            os.makedirs(f'{app_path}/data')
-            os.makedirs(f'{app_path}/GHSOM')
-            os.makedirs(f'{app_path}/graphs')
-            os.makedirs(f'{app_path}/GHSOM/data')
-            os.makedirs(f'{app_path}/GHSOM/output')
-
-            # Pipeline 順序（完全不變）
-            create_ghsom_input_file(data, file, index, label, subnum)
-            create_ghsom_prop_file(data, file, tau1, tau2)
-            ghsom_clustering(data, file)
-            extract_ghsom_output(file, current_path)
-            save_ghsom_cluster_label(data, tau1, tau2, index)
-            clustering_evaluation(data, tau1, tau2, label, index)
+        print(f'Creating /applications/{ctx["file"]} ...')
 
-        except Exception as e:
-            print(f'Failed to create /applications/{file} folder due to: {str(e)}')
+    os.makedirs(f'{app_path}/data', exist_ok=True)
+    os.makedirs(f'{app_path}/graphs', exist_ok=True)
+    os.makedirs(f'{app_path}/GHSOM/data', exist_ok=True)
+    os.makedirs(f'{app_path}/GHSOM/output', exist_ok=True)
+
+    ctx["manifest"] = load_manifest(app_path)
+    return ctx
+
+def finish_pipeline(ctx, error=None):
+    """
+    ctx → report { "status", "error", "scores", "timings" }，並釋放已載入的 DataFrame
+    """
+    if error is not None:
+        print(f'Failed to run pipeline for /applications/{ctx["file"]} due to: {str(error)}')
+    else:
+        print_stage_timings(ctx)
+
+    ctx["df"] = None
+    ctx["df_cluster"] = None
+
+    status = "failed" if error is not None else "ok"
+    try:
+        write_job_profile(ctx["app_path"], ctx["file"], status, ctx["profile"])
+    except OSError as e:
+        print(f"[WARNING] Failed to write profile.json: {e}")
+
+    return {
+        "status": status,
+        "error": str(error) if error is not None else None,
+        "scores": ctx["stage_results"].get("evaluate"),
+        "timings": ctx["timings"],
+    }
+
+
+# ============================================================
+# ⭐⭐ 封裝 Pipeline 主流程（模組化核心） ⭐⭐
+# ============================================================
+def run_pipeline(data, tau1, tau2, index=None, label=None, subnum=None, feature='mean',
+                 inprocess=True, label_backup_dir=None, force=False, prop_params=None,
+                 decimals=None, ingest='memory', memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB,
+                 channels=None, n_components=None, sampling='uniform', engine='somtoolbox',
+                 train_workers=1, train_schedule='fixed', map_cache=True, project=False,
+                 jvm_service=False, lean_output=False, train_timeout_s=None, train_memory_mb=None):
+    """
+    外部 scripts 也能呼叫：
+    from execute import run_pipeline
+    run_pipeline(data="xxx", tau1=0.08, tau2=0.2)
+
+    inprocess=True  : raw-data 只讀一次，label / evaluation 直接在同一個 process 執行
+    inprocess=False : 舊版行為，os.system 呼叫各個 script
+    label_backup_dir : 有給才把 label 欄位備份到該資料夾（web worker 使用）
+    force : 忽略 manifest，全部 stage 重跑
+    prop_params : 傳給 create_ghsom_prop_file 的其他參數（randomSeed、xSize ...）
+    decimals : .in 檔 vector round 到小數第幾位（檔案較小、寫得較快）；None → 與舊版相同
+    ingest : "memory" → 整份 pd.read_csv（舊版）；"chunked" → 分塊讀、marker 欄位 float32，
+             .in 邊讀邊寫，格式化階段的峰值記憶體由 memory_budget_mb（MB）決定；
+             "columnar" → 先轉成 raw-data/<data>.cols（每欄一個 .npy），之後各 stage
+             memory-map 需要的欄位，不再重複 parse CSV
+    channels : raw-data 是 FCS / h5ad 時只讀這些 channel / gene（None → 全部）；
+               binary 上傳一律走 "columnar"，index 預設為自動加上的 Event 欄位
+               （script 模式的 label / evaluation 只讀 CSV，binary 上傳請用 inprocess）
+    n_components : 先用 randomized PCA 降到這個維度再訓練 GHSOM（CH / DB 也在降維空間算），
+                   label / feature map 仍是原始 marker；fit 結果依 dataset fingerprint cache 在
+                   web/cache/reductions/，同一份資料的 tau grid 只 fit 一次；None → 不降維
+    sampling : subnum 的抽樣方式；"uniform" → 舊版均勻抽樣，"sketch" → geometric sketching
+               （PCA 空間切格子、每格輪流挑），5–10% 的 cell 也保留稀有族群；
+               留下哪些列記在 GHSOM/data/<data>_ghsom_rows.npy，label stage 依此對應回原本的 cell
+    engine : GHSOM 訓練引擎；"somtoolbox" → Java（somtoolbox.sh），"numpy" → programs/training/numpy_ghsom.py
+             （同一份 .prop / .in，batched BMU 的 GHSOM，輸出相同格式的 .unit / .wgt / .map）
+    train_workers : engine="numpy" 時同時訓練兄弟子 map 的 process 數（0 → CPU 數）；結果與 1 相同
+    train_schedule : engine="numpy" 時每張 map 的訓練量；"fixed" → numIterations（與 somtoolbox 相同），
+                     "adaptive" → 依 map 的 cell 數決定 iteration 與 mini-batch 大小，QE 收斂就提前停止；
+                     每張 map 的 iteration 數與 QE trajectory 記在 GHSOM/output/<job>/<data>_training.json
+    map_cache : engine="numpy" 時訓練完的 map 依 (.in 的 sha256, seed, tau1, 訓練參數, parent unit 路徑)
+                cache 在 web/cache/ghsom_maps/；只有 tau2 不同的 job 直接沿用，tau2 sweep 只訓練一次第一層，
+                結果與重新訓練相同；False → 每張 map 都重新訓練
+    project : subnum（uniform / sketch）只拿部分 cell 訓練 GHSOM，其餘 cell 在 label stage 從第一層往下
+              找 BMU（.wgt prototypes，分塊 GEMM）到 leaf，clustered_label / x_y_label / clusterL* 與
+              訓練的 cell 格式相同，evaluation 以全部 cell 計算；False → 沒被抽到的 cell 沒有 cluster
+    jvm_service : engine="somtoolbox" 時在常駐的 JVM（programs/GHSOM/GHSOMService.java，需要 Java 11+ JDK）
+                  中訓練，省下每個 job 的 JVM 啟動與 JIT warm-up；輸出與 somtoolbox.sh 相同，
+                  service 無法啟動 → 自動改用 somtoolbox.sh
+    lean_output : engine="somtoolbox" 時不輸出沒有用到的 .dwm（--noDWM）與 HTML 報表（不加 -h）；
+                  GHSOM 的 .unit.gz / .wgt.gz 一律直接讀，不再用 7z 解壓
+    train_timeout_s / train_memory_mb : engine="somtoolbox" 時訓練 process（somtoolbox.sh + JVM，或常駐 service）
+                  的 wall-clock（秒）/ RSS（MB）上限，超過 → kill，train stage 失敗；None → 不限
+                  （常駐 service 的 memory 上限只算 TRAIN 之後增加的 RSS，見 programs/training/jvm_service.py）
+                  訓練進度（elapsed / RSS / log tail；numpy 引擎另有已訓練的 map 數、層數、MQE）
+                  寫到 applications/<data>-<tau1>-<tau2>/train_progress.json（web app 的 /api/job/<id>/progress）
+
+    已存在的 applications/<data>-<tau1>-<tau2> 不再整個跳過：
+    manifest.json 記錄每個 stage 的 inputs hash，只重跑 stale / 缺少的 stage。
+
+    每個 stage 的 profiling record（wall / CPU / peak RSS / IO / exit code）寫到
+    applications/<data>-<tau1>-<tau2>/profile.json
+
+    回傳 { "status", "error", "scores", "timings" }
+    """
+    try:
+        ctx = prepare_pipeline(data, tau1, tau2, index, label, subnum, feature,
+                               label_backup_dir, force, prop_params, decimals,
+                               ingest, memory_budget_mb, channels, n_components, sampling, engine,
+                               train_workers, train_schedule, map_cache, project, jvm_service,
+                               lean_output, train_timeout_s, train_memory_mb)
+    except Exception as e:
+        print(f'Failed to create /applications/{data}-{tau1}-{tau2} folder due to: {str(e)}')
+        return {"status": "failed", "error": str(e), "scores": None, "timings": {}}
+
+    try:
+        for stage in build_pipeline_stages(inprocess):
+            run_stage(ctx, stage)
+    except Exception as e:
+        return finish_pipeline(ctx, e)
+
+    return finish_pipeline(ctx)
 
 
 # ============================================================
@@ -126,7 +949,36 @@ def main():
     parser.add_argument('--label', type=str, default=None)
 
     parser.add_argument('--subnum', type=int, default=None)
+    parser.add_argument('--sampling', type=str, default='uniform', choices=list(SAMPLING_MODES),
+                        help='how --subnum picks training cells (sketch keeps rare populations)')
     parser.add_argument('--feature', type=str, default='mean')
+    parser.add_argument('--mode', type=str, default='inprocess', choices=['inprocess', 'script'])
+    parser.add_argument('--force', action='store_true')
+    parser.add_argument('--decimals', type=int, default=None)
+    parser.add_argument('--ingest', type=str, default='memory', choices=['memory', 'chunked', 'columnar'])
+    parser.add_argument('--memory_budget_mb', type=int, default=DEFAULT_MEMORY_BUDGET_MB)
+    parser.add_argument('--channels', type=str, default=None,
+                        help='FCS / h5ad only: comma-separated channels or genes to keep')
+    parser.add_argument('--n_components', type=int, default=None,
+                        help='reduce to N principal components before GHSOM training')
+    parser.add_argument('--engine', type=str, default='somtoolbox', choices=list(ENGINES),
+                        help='GHSOM training engine (numpy needs no Java)')
+    parser.add_argument('--train_workers', type=int, default=1,
+                        help='numpy engine: processes training sibling child maps (0 = all CPUs)')
+    parser.add_argument('--train_schedule', type=str, default='fixed', choices=list(SCHEDULES),
+                        help='numpy engine: adaptive sizes training to each map and stops when QE plateaus')
+    parser.add_argument('--no_map_cache', action='store_true',
+                        help='numpy engine: retrain every map instead of reusing maps from jobs that differ only in tau2')
+    parser.add_argument('--project', action='store_true',
+                        help='with --subnum: assign the cells left out of training by descending the trained GHSOM')
+    parser.add_argument('--jvm_service', action='store_true',
+                        help='somtoolbox engine: train in a long-lived JVM instead of launching one per job')
+    parser.add_argument('--lean_output', action='store_true',
+                        help='somtoolbox engine: skip the unused .dwm file and HTML report')
+    parser.add_argument('--train_timeout', type=float, default=None,
+                        help='somtoolbox engine: kill training after this many seconds')
+    parser.add_argument('--train_memory_mb', type=int, default=None,
+                        help='somtoolbox engine: kill training when its RSS exceeds this many MB')
 
     args = parser.parse_args()
 
@@ -137,7 +989,24 @@ def main():
         index=args.index,
         label=args.label,
         subnum=args.subnum,
-        feature=args.feature
+        feature=args.feature,
+        inprocess=(args.mode == 'inprocess'),
+        force=args.force,
+        decimals=args.decimals,
+        ingest=args.ingest,
+        memory_budget_mb=args.memory_budget_mb,
+        channels=parse_channel_list(args.channels),
+        n_components=args.n_components,
+        sampling=args.sampling,
+        engine=args.engine,
+        train_workers=args.train_workers,
+        train_schedule=args.train_schedule,
+        map_cache=not args.no_map_cache,
+        project=args.project,
+        jvm_service=args.jvm_service,
+        lean_output=args.lean_output,
+        train_timeout_s=args.train_timeout,
+        train_memory_mb=args.train_memory_mb
     )
 
 
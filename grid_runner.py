@@ -1,7 +1,6 @@
-import os
-import subprocess
 import csv
 import gc
+from execute import run_pipeline
 
 # ============ 參數 =============
 tau1_list = [0.08]
@@ -10,37 +9,25 @@ tau2_list = [0.02, 1.0]
 output_csv = "test.csv"
 data_name = "Samusik_01_cleaned"
 index_name = "Event"
+# "numpy"：同一個 tau1 的 tau2 sweep 沿用已訓練的 map（web/cache/ghsom_maps/），第一層只訓練一次
+engine = "somtoolbox"
 
 results = [["tau1", "tau2", "ARI", "NMI", "CH", "DB", "Leaf_Num"]]
 
 # ============ 核心函數 ============
 
-def parse_score_file(score_file_path):
-    score_dict = {}
-    with open(score_file_path, "r") as f:
-        for line in f:
-            if ":" in line:
-                key, value = line.split(":", 1)
-                score_dict[key.strip()] = value.strip()
+def parse_scores(scores):
+    """
+    run_pipeline 回傳的 scores dict → (ARI, NMI, CH, DB, Leaf)
+    """
+    if scores is None:
+        raise ValueError("[❌ Error] Pipeline returned no clustering scores")
 
-    # Robust key matching
-    def find_key(key_words):
-        for key in score_dict:
-            if all(kw.lower() in key.lower() for kw in key_words):
-                return key
-        raise KeyError(f"[❌ Error] Could not find key containing: {key_words}")
-
-    try:
-        ari = float(score_dict[find_key(["ari"])])
-        nmi = float(score_dict[find_key(["nmi"])])
-        ch = float(score_dict[find_key(["ch"])])
-        db = float(score_dict[find_key(["db"])])
-        leaf_raw = score_dict[find_key(["leaf", "number"])]
-        # 提取數字
-        leaf = int(''.join(filter(str.isdigit, leaf_raw)))
-    except Exception as e:
-        print(f"[❌ Error] Failed to parse score file: {e}")
-        raise
+    ari = scores["ARI"]
+    nmi = scores["NMI"]
+    ch = float(scores["CH"])
+    db = float(scores["DB"])
+    leaf = int(scores["Leaf_Number"])
 
     return ari, nmi, ch, db, leaf
 
@@ -50,16 +37,12 @@ for tau1 in tau1_list:
     for tau2 in tau2_list:
         print(f"\n--- Running tau1={tau1}, tau2={tau2} ---")
         try:
-            # run main
-            cmd = f"python3 execute.py --index={index_name} --data={data_name} --tau1={tau1} --tau2={tau2}"
-            subprocess.run(cmd, shell=True, check=True)
-
-            # load clustering score
-            score_file = f"./applications/{data_name}-{tau1}-{tau2}/data/clustering_score.txt"
-            if not os.path.exists(score_file):
-                raise FileNotFoundError(f"Score file not found: {score_file}")
+            # run main（in-process，不再另開 python interpreter）
+            report = run_pipeline(data=data_name, tau1=tau1, tau2=tau2, index=index_name, engine=engine)
+            if report["status"] == "failed":
+                raise RuntimeError(report["error"])
 
-            ari, nmi, ch, db, leaf = parse_score_file(score_file)
+            ari, nmi, ch, db, leaf = parse_scores(report["scores"])
             results.append([tau1, tau2, ari, nmi, ch, db, leaf])
 
         except Exception as e:
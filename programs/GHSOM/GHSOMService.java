@@ -0,0 +1,128 @@
+import java.io.BufferedReader;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.nio.charset.StandardCharsets;
+import java.security.Permission;
+
+/**
+ * 常駐的 somtoolbox 訓練 service：一個 JVM 依序訓練多個 .prop，省下每個 job 的 JVM 啟動、
+ * 載入 lib/*.jar 與 JIT warm-up（python 端：programs/training/jvm_service.py）。
+ *
+ * 以 Java 11+ 的 single-file source 模式執行，不需要另外編譯：
+ *   java -cp somtoolbox.jar:lib/*:rsc programs/GHSOM/GHSOMService.java
+ *
+ * Protocol（stdin / stdout，一行一個訊息，UTF-8）：
+ *   → READY <java.version> <trap-exit|no-trap-exit>     啟動完成
+ *   ← TRAIN <arg>\t<arg>...                              例如 TRAIN GHSOM\t/abs/x.prop\t-h
+ *   → DONE <exit code> <millis>                          訓練結束，可以送下一個 job
+ *   → RESTART <exit code> <millis>                       Error（OOM ...）→ 回報後結束，由 python 端重開
+ *   ← PING → PONG；QUIT 或 stdin EOF → 結束
+ * somtoolbox 的 log 全部改寫到 stderr，stdout 只有 protocol。
+ * somtoolbox 內部的 System.exit 以 SecurityManager 攔下、當成 exit code（Java 24+ 不支援 →
+ * 該 job 結束時整個 JVM 也結束，python 端以 process exit code 判斷並重開）。
+ */
+public class GHSOMService {
+    static final String MAIN_CLASS = "at.tuwien.ifs.somtoolbox.apps.SOMToolboxMain";
+
+    static class ExitTrappedException extends SecurityException {
+        final int status;
+
+        ExitTrappedException(int status) {
+            super("System.exit(" + status + ")");
+            this.status = status;
+        }
+    }
+
+    static boolean installExitTrap() {
+        try {
+            System.setSecurityManager(new SecurityManager() {
+                @Override
+                public void checkPermission(Permission perm) {
+                }
+
+                @Override
+                public void checkPermission(Permission perm, Object context) {
+                }
+
+                @Override
+                public void checkExit(int status) {
+                    throw new ExitTrappedException(status);
+                }
+            });
+            return true;
+        } catch (UnsupportedOperationException | SecurityException e) {
+            return false;
+        }
+    }
+
+    static ExitTrappedException trappedExit(Throwable error) {
+        for (Throwable cause = error; cause != null; cause = cause.getCause()) {
+            if (cause instanceof ExitTrappedException) {
+                return (ExitTrappedException) cause;
+            }
+        }
+        return null;
+    }
+
+    public static void main(String[] args) throws Exception {
+        PrintStream protocol = new PrintStream(new FileOutputStream(FileDescriptor.out), true, "UTF-8");
+        System.setOut(System.err);
+
+        Method main = Class.forName(MAIN_CLASS).getMethod("main", String[].class);
+        boolean trapExit = installExitTrap();
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        protocol.println("READY " + System.getProperty("java.version") + (trapExit ? " trap-exit" : " no-trap-exit"));
+
+        String line;
+        while ((line = in.readLine()) != null) {
+            line = line.trim();
+            if (line.isEmpty()) {
+                continue;
+            }
+            if (line.equals("QUIT")) {
+                break;
+            }
+            if (line.equals("PING")) {
+                protocol.println("PONG");
+                continue;
+            }
+            if (!line.startsWith("TRAIN ")) {
+                protocol.println("ERROR unknown command: " + line);
+                continue;
+            }
+
+            String[] argv = line.substring("TRAIN ".length()).split("\t");
+            long start = System.nanoTime();
+            int status = 0;
+            boolean restart = false;
+            try {
+                main.invoke(null, (Object) argv);
+            } catch (InvocationTargetException e) {
+                Throwable cause = e.getCause();
+                ExitTrappedException exit = trappedExit(cause);
+                if (exit != null) {
+                    status = exit.status;
+                } else {
+                    cause.printStackTrace();
+                    status = 1;
+                    // OutOfMemoryError 之類的 Error 之後 JVM 狀態不可靠 → 換一個新的
+                    restart = cause instanceof Error;
+                }
+            } catch (ExitTrappedException e) {
+                status = e.status;
+            }
+            System.err.flush();
+            long millis = (System.nanoTime() - start) / 1_000_000;
+            protocol.println((restart ? "RESTART " : "DONE ") + status + " " + millis);
+            if (restart) {
+                break;
+            }
+        }
+        // exit trap 還在 → 用 halt 結束
+        Runtime.getRuntime().halt(0);
+    }
+}
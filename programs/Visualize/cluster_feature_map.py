@@ -10,22 +10,47 @@ from dash.dependencies import Input, Output
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data_processing')))
 import get_ghsom_dim
+from programs.pipeline.result_cache import resolve_job_id
+from programs.pipeline.metrics import REGISTRY
+from programs.data_processing.sparse_features import (
+    FEATURES_SUFFIX, load_sparse_features, sparse_cluster_moments
+)
 
 
 # ======================================================================
 # ⭐ 全域 Cache（每個 job_id 只載入一次）
 # ======================================================================
-JOB_CACHE = {}     # { job_id : {df, has_label, cluster_means, pathlist, feature_cols} }
+JOB_CACHE = {}     # { job_id : {df, has_label, cluster_means, cluster_sq_means, pathlist, feature_cols} }
+
+# ---- /metrics（web/app.py）----
+JOB_CACHE_REQUESTS = REGISTRY.counter(
+    "scghsom_job_cache_requests_total", "Feature map JOB_CACHE lookups.", ["result"])
+JOB_CACHE_ENTRIES = REGISTRY.gauge(
+    "scghsom_job_cache_entries", "Jobs currently held in the feature map JOB_CACHE.")
+JOB_CACHE_LOAD_SECONDS = REGISTRY.histogram(
+    "scghsom_job_cache_load_seconds", "Time to load a job into JOB_CACHE on a miss.")
+DASH_CALLBACK_SECONDS = REGISTRY.histogram(
+    "scghsom_dash_callback_seconds", "Feature map Dash callback latency.", ["callback"])
 
 
 def load_job_into_cache(job_id):
     """
     若 job_id 不在 cache → 讀取資料並預先計算所有 expensive 元件
+    （result cache 的 alias job 共用來源 job 的 cache entry）
     """
 
+    job_id = resolve_job_id(job_id)
     if job_id in JOB_CACHE:
+        JOB_CACHE_REQUESTS.inc(result="hit")
         return JOB_CACHE[job_id]
 
+    JOB_CACHE_REQUESTS.inc(result="miss")
+    with JOB_CACHE_LOAD_SECONDS.time():
+        return _load_job(job_id)
+
+
+def _load_job(job_id):
+
     # ---- 找資料夾 ----
     app_root = "./applications"
     folders = [f for f in os.listdir(app_root) if f.startswith(job_id + "-")]
@@ -59,20 +84,33 @@ def load_job_into_cache(job_id):
         if col in df.columns and df[col].nunique() > 1:
             pathlist.append(col)
 
+    # ---- sparse 上傳（h5ad CSR）：gene 不在 CSV 裡，cluster 統計直接在 CSR 上算 ----
+    features_path = f"./applications/{folder}/data/{job_id}{FEATURES_SUFFIX}"
+    sparse = os.path.exists(features_path)
+
     # ---- 找 feature columns（一次性）----
-    exclude_cols = set(pathlist + [
-        "Event", "label", "clustered_label",
-        "x_y_label", "point_x", "point_y",
-        "mean", "median"
-    ])
-    feature_cols = [c for c in df.columns if c not in exclude_cols]
+    if sparse:
+        X, feature_cols = load_sparse_features(features_path)
+    else:
+        exclude_cols = set(pathlist + [
+            "Event", "label", "clustered_label",
+            "x_y_label", "point_x", "point_y",
+            "mean", "median"
+        ])
+        feature_cols = [c for c in df.columns if c not in exclude_cols]
 
     # ---- 預先計算 cluster means 避免每次 callback 重算 ----
     cluster_means_cache = {}
+    cluster_sq_means_cache = {}
 
     for depth, col in enumerate(pathlist, start=1):
-        feature_means = df.groupby(col)[feature_cols].mean()
-        cluster_means_cache[depth] = feature_means
+        if sparse:
+            clusters, _, means, sq_means = sparse_cluster_moments(X, df[col].values)
+            cluster_means_cache[depth] = pd.DataFrame(means, index=clusters, columns=feature_cols)
+            cluster_sq_means_cache[depth] = pd.DataFrame(sq_means, index=clusters, columns=feature_cols)
+        else:
+            feature_means = df.groupby(col)[feature_cols].mean()
+            cluster_means_cache[depth] = feature_means
 
     # ---- 存 cache ----
     info = {
@@ -81,15 +119,150 @@ def load_job_into_cache(job_id):
         "pathlist": pathlist,
         "feature_cols": feature_cols,
         "cluster_means": cluster_means_cache,
+        "cluster_sq_means": cluster_sq_means_cache,   # 只有 sparse job 有
+        "sparse": sparse,
         "folder": folder,
         "tau1": tau1,
         "tau2": tau2,
     }
 
     JOB_CACHE[job_id] = info
+    JOB_CACHE_ENTRIES.set(len(JOB_CACHE))
     return info
 
 
+# ======================================================================
+# ⭐ Callback 本體（module level：benchmark 不用起 Dash server 也能直接呼叫）
+# ======================================================================
+# 載入 Treemap（第一次）
+def build_treemap(pathname):
+
+    if pathname is None:
+        raise dash.exceptions.PreventUpdate
+
+    job_id = pathname.replace("/feature-map/", "").strip("/")
+
+    # ---- 使用 Cache ----
+    try:
+        info = load_job_into_cache(job_id)
+    except:
+        return f"Feature Map — Job {job_id} NOT FOUND", go.Figure()
+
+    df = info["df"]
+    pathlist = info["pathlist"]
+
+    # ---- Treemap ----
+    fig = px.treemap(
+        df,
+        path=pathlist,
+        color='mean',
+        color_continuous_scale='RdBu',
+        branchvalues='remainder',
+    )
+
+    return f"Feature Map — Job {job_id}", fig
+
+
+# 點擊 Treemap → 顯示 Top5 + Pie（極速版本）
+def build_feature_panels(clickData, pathname):
+
+    if pathname is None or clickData is None:
+        raise dash.exceptions.PreventUpdate
+
+    job_id = pathname.replace("/feature-map/", "").strip("/")
+    info = load_job_into_cache(job_id)
+
+    df = info["df"]
+    has_label = info["has_label"]
+    pathlist = info["pathlist"]
+    feature_cols = info["feature_cols"]
+    cluster_means_cache = info["cluster_means"]
+
+    # ---- 找點到的 cluster ----
+    clicked_id = clickData['points'][0]['id'].rstrip('/')
+    levels = clicked_id.split('/')
+    depth = len(levels)
+    cluster_name = levels[-1]
+
+    mask = df[f"clusterL{depth}"] == cluster_name
+    sub_df = df[mask]
+
+    # ---- Significant Feature 計算（極速）----
+    cluster_means = cluster_means_cache[depth]
+    all_clusters = cluster_means.index.tolist()
+
+    sig_scores = {}
+
+    if info["sparse"]:
+        # sparse job：cluster 內的 mean / std 由預先算好的 E[x]、E[x^2] 得到（所有 gene 一次算完）
+        others = [c for c in all_clusters if c != cluster_name]
+        m_c = cluster_means.loc[cluster_name]
+        sigma_I = np.sqrt(np.clip(info["cluster_sq_means"][depth].loc[cluster_name] - m_c ** 2, 0, None))
+        sigma_B = np.sqrt(((cluster_means.loc[others] - m_c) ** 2).sum() / len(others))
+        sig_scores = (sigma_B - sigma_I).to_dict()
+    else:
+        for col in feature_cols:
+            cluster_mean = sub_df[col].mean()
+            sigma_I = np.sqrt(((sub_df[col] - cluster_mean) ** 2).sum() / len(sub_df))
+
+            others = [c for c in all_clusters if c != cluster_name]
+            m_c = cluster_means.loc[cluster_name, col]
+            m_c_primes = cluster_means.loc[others, col]
+
+            sigma_B = np.sqrt(((m_c - m_c_primes) ** 2).sum() / len(others))
+
+            sig_scores[col] = sigma_B - sigma_I
+
+    # Top 5
+    top5 = sorted(sig_scores.items(), key=lambda x: x[1], reverse=True)[:5]
+    names = [x[0] for x in top5]
+    if info["sparse"]:
+        values = [cluster_means.loc[cluster_name, x[0]] for x in top5]
+    else:
+        values = [sub_df[x[0]].mean() for x in top5]
+
+    fig_bar = go.Figure([
+        go.Bar(x=values, y=names, orientation='h')
+    ])
+    fig_bar.update_layout(
+        title="Top 5 Significant Features",
+        yaxis={'autorange': 'reversed'}
+    )
+
+    # ---- Pie chart ----
+    if not has_label:
+        return fig_bar, go.Figure(), {'display': 'none'}
+
+    counts = sub_df["label"].value_counts()
+    total = counts.sum()
+    counts = counts[counts / total >= 0.05]
+
+    if len(counts) > 5:
+        counts = counts[:5]
+
+    others = total - counts.sum()
+    if others > 0:
+        counts["Others"] = others
+
+    blue_colors = [
+        'rgb(198,219,239)', 'rgb(158,202,225)', 'rgb(107,174,214)',
+        'rgb(49,130,189)', 'rgb(8,81,156)', 'rgb(200,200,200)'
+    ]
+
+    fig_pie = go.Figure(
+        go.Pie(
+            labels=counts.index,
+            values=counts.values,
+            hole=0.5,
+            marker_colors=blue_colors[:len(counts)],
+            textinfo='percent+label'
+        )
+    )
+    fig_pie.update_layout(title='Cell Type Distribution')
+
+    return fig_bar, fig_pie, {'display': 'block'}
+
+
 # ======================================================================
 # ⭐ 建立 Dash app（只做一次）
 # ======================================================================
@@ -128,31 +301,8 @@ def init_feature_map_dash(flask_app):
         [Input('url', 'pathname')]
     )
     def load_treemap(pathname):
-
-        if pathname is None:
-            raise dash.exceptions.PreventUpdate
-
-        job_id = pathname.replace("/feature-map/", "").strip("/")
-
-        # ---- 使用 Cache ----
-        try:
-            info = load_job_into_cache(job_id)
-        except:
-            return f"Feature Map — Job {job_id} NOT FOUND", go.Figure()
-
-        df = info["df"]
-        pathlist = info["pathlist"]
-
-        # ---- Treemap ----
-        fig = px.treemap(
-            df,
-            path=pathlist,
-            color='mean',
-            color_continuous_scale='RdBu',
-            branchvalues='remainder',
-        )
-
-        return f"Feature Map — Job {job_id}", fig
+        with DASH_CALLBACK_SECONDS.time(callback="load_treemap"):
+            return build_treemap(pathname)
 
     # ==================================================================
     # ⭐ Callback：點擊 Treemap → 顯示 Top5 + Pie（極速版本）
@@ -165,91 +315,8 @@ def init_feature_map_dash(flask_app):
          Input('url', 'pathname')]
     )
     def update_features(clickData, pathname):
-
-        if pathname is None or clickData is None:
-            raise dash.exceptions.PreventUpdate
-
-        job_id = pathname.replace("/feature-map/", "").strip("/")
-        info = load_job_into_cache(job_id)
-
-        df = info["df"]
-        has_label = info["has_label"]
-        pathlist = info["pathlist"]
-        feature_cols = info["feature_cols"]
-        cluster_means_cache = info["cluster_means"]
-
-        # ---- 找點到的 cluster ----
-        clicked_id = clickData['points'][0]['id'].rstrip('/')
-        levels = clicked_id.split('/')
-        depth = len(levels)
-        cluster_name = levels[-1]
-
-        mask = df[f"clusterL{depth}"] == cluster_name
-        sub_df = df[mask]
-
-        # ---- Significant Feature 計算（極速）----
-        cluster_means = cluster_means_cache[depth]
-        all_clusters = cluster_means.index.tolist()
-
-        sig_scores = {}
-
-        for col in feature_cols:
-            cluster_mean = sub_df[col].mean()
-            sigma_I = np.sqrt(((sub_df[col] - cluster_mean) ** 2).sum() / len(sub_df))
-
-            others = [c for c in all_clusters if c != cluster_name]
-            m_c = cluster_means.loc[cluster_name, col]
-            m_c_primes = cluster_means.loc[others, col]
-
-            sigma_B = np.sqrt(((m_c - m_c_primes) ** 2).sum() / len(others))
-
-            sig_scores[col] = sigma_B - sigma_I
-
-        # Top 5
-        top5 = sorted(sig_scores.items(), key=lambda x: x[1], reverse=True)[:5]
-        names = [x[0] for x in top5]
-        values = [sub_df[x[0]].mean() for x in top5]
-
-        fig_bar = go.Figure([
-            go.Bar(x=values, y=names, orientation='h')
-        ])
-        fig_bar.update_layout(
-            title="Top 5 Significant Features",
-            yaxis={'autorange': 'reversed'}
-        )
-
-        # ---- Pie chart ----
-        if not has_label:
-            return fig_bar, go.Figure(), {'display': 'none'}
-
-        counts = sub_df["label"].value_counts()
-        total = counts.sum()
-        counts = counts[counts / total >= 0.05]
-
-        if len(counts) > 5:
-            counts = counts[:5]
-
-        others = total - counts.sum()
-        if others > 0:
-            counts["Others"] = others
-
-        blue_colors = [
-            'rgb(198,219,239)', 'rgb(158,202,225)', 'rgb(107,174,214)',
-            'rgb(49,130,189)', 'rgb(8,81,156)', 'rgb(200,200,200)'
-        ]
-
-        fig_pie = go.Figure(
-            go.Pie(
-                labels=counts.index,
-                values=counts.values,
-                hole=0.5,
-                marker_colors=blue_colors[:len(counts)],
-                textinfo='percent+label'
-            )
-        )
-        fig_pie.update_layout(title='Cell Type Distribution')
-
-        return fig_bar, fig_pie, {'display': 'block'}
+        with DASH_CALLBACK_SECONDS.time(callback="update_features"):
+            return build_feature_panels(clickData, pathname)
 
     return dash_app
 
@@ -0,0 +1,114 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+
+from execute import prepare_pipeline, run_stage, PIPELINE_STAGES
+from programs.benchmark.synthetic_data import write_synthetic_csv
+from programs.benchmark.run_benchmark import SOMTOOLBOX_JAR, parse_sizes
+from programs.training.jvm_service import java_command, shutdown_services
+
+
+# ============================================================
+# ⭐ Benchmark：somtoolbox 每個 job 開一個 JVM vs 常駐 JVM service
+# ============================================================
+# 在 repo 根目錄執行：
+#   python -m programs.benchmark.jvm_service_benchmark --cells=2000 --jobs=10
+#
+# 同一份小的 synthetic data、同一個 tau1，tau2 依序取 --jobs 個值（tau grid 的典型情況）：
+#   launch  : 每個 job 跑 somtoolbox.sh（新的 JVM）
+#   service : 每個 job 送到常駐的 service（第一個 job 含 service 啟動時間）
+# 每個 job 只量 train stage 的 wall；輸出每個 mode 的 total / 第一個 job / 其餘 job 的平均，
+# 以及 service 相對 launch 的加速倍數
+MODES = ("launch", "service")
+
+
+def tau2_values(n_jobs, low=0.01, high=0.5):
+    if n_jobs == 1:
+        return [low]
+    step = (high - low) / (n_jobs - 1)
+    return [round(low + i * step, 4) for i in range(n_jobs)]
+
+
+def run_mode(mode, data, tau1, tau2_list):
+    stages = {stage["name"]: stage for stage in PIPELINE_STAGES}
+    jobs = []
+    for tau2 in tau2_list:
+        ctx = prepare_pipeline(data, tau1, tau2, index="Event", label="label", force=True,
+                               jvm_service=(mode == "service"))
+        try:
+            for name in ["convert_store", "format_input", "create_prop", "train"]:
+                run_stage(ctx, stages[name])
+            status = "ok"
+        except Exception as e:
+            status = f"failed: {e}"
+        jobs.append({"tau2": tau2, "status": status, "train_s": ctx["timings"].get("train"),
+                     "exit_code": ctx["exit_codes"].get("train")})
+        shutil.rmtree(ctx["app_path"], ignore_errors=True)
+    if mode == "service":
+        shutdown_services()
+
+    walls = [job["train_s"] for job in jobs if job["train_s"] is not None]
+    return {
+        "mode": mode,
+        "jobs": jobs,
+        "total_s": round(sum(walls), 3),
+        "first_s": walls[0] if walls else None,
+        "rest_mean_s": round(sum(walls[1:]) / len(walls[1:]), 3) if len(walls) > 1 else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-job somtoolbox launches with the long-lived JVM service')
+    parser.add_argument('--cells', type=str, default='2000')
+    parser.add_argument('--markers', type=int, default=10)
+    parser.add_argument('--jobs', type=int, default=10, help='grid points (tau2 values) per size')
+    parser.add_argument('--tau1', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', type=str, default='./jvm_service_benchmark.json')
+    args = parser.parse_args()
+
+    if shutil.which(os.environ.get("JAVA", "java")) is None or not os.path.exists(SOMTOOLBOX_JAR):
+        print("[ERROR] somtoolbox needs java and programs/GHSOM/somtoolbox.jar.")
+        return 1
+    if java_command() is None:
+        print("[WARNING] No Java 11+ JDK; the service mode falls back to somtoolbox.sh.")
+
+    sizes = []
+    for n_cells in parse_sizes(args.cells):
+        data = f"bench_jvm_{n_cells}x{args.markers}"
+        raw_path = f"./raw-data/{data}.csv"
+        write_synthetic_csv(raw_path, n_cells, args.markers, args.seed)
+        try:
+            modes = {mode: run_mode(mode, data, args.tau1, tau2_values(args.jobs)) for mode in MODES}
+        finally:
+            os.remove(raw_path)
+        launch, service = modes["launch"]["total_s"], modes["service"]["total_s"]
+        sizes.append({"cells": n_cells, "markers": args.markers, "modes": modes,
+                      "speedup": round(launch / service, 2) if launch and service else None})
+
+    results = {
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "host": {"platform": platform.platform(), "cpu_count": os.cpu_count(),
+                 "python": sys.version.split()[0]},
+        "config": {"jobs": args.jobs, "tau1": args.tau1, "seed": args.seed},
+        "sizes": sizes,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=4, default=str)
+
+    print("========== somtoolbox train wall: launch vs service ==========")
+    for size in sizes:
+        for mode, result in size["modes"].items():
+            print(f"{size['cells']:>10} x {size['markers']:<5}{mode:<9}total={result['total_s']}s  "
+                  f"first={result['first_s']}s  rest_mean={result['rest_mean_s']}s")
+        print(f"{'':>18}speedup={size['speedup']}")
+    print(f"[OK] Benchmark results saved at {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,309 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import numpy as np
+import pandas as pd
+
+from execute import prepare_pipeline, finish_pipeline, run_stage, load_raw_data, PIPELINE_STAGES
+from programs.benchmark.synthetic_data import write_synthetic_csv
+from programs.data_processing.raw_data_reader import DEFAULT_MEMORY_BUDGET_MB
+from programs.data_processing.columnar_store import store_path
+from programs.pipeline.profiling import start_stage_profile, end_stage_profile
+from programs.training.numpy_ghsom import ENGINES, SCHEDULES
+from programs.Visualize import cluster_feature_map
+
+
+# ============================================================
+# ⭐ Benchmark：合成資料 × 不同規模，逐 stage 量 wall / CPU / peak RSS
+# ============================================================
+# 在 repo 根目錄執行：
+#   python -m programs.benchmark.run_benchmark --cells=10000,100000,1000000 --markers=10,50,200
+#
+# 每個 (cells, markers) 組合：
+#   generate → convert_store → load_csv → reduce（--n_components）→ format_input → create_prop → backup_label
+#   → train（somtoolbox 需要 Java + somtoolbox.jar）→ label → evaluate
+#   → feature_map_load → feature_map_click
+# load_csv 只在 --ingest=memory 時獨立量測（chunked / columnar 的 format_input 不載入整份資料）
+# 無法訓練時 train 之後依賴 GHSOM 輸出的 stage 記為 skipped。
+#
+# --engines=somtoolbox,numpy：同一個 seed 產生的同一份資料，兩個訓練引擎各跑一次，
+# 另外輸出 engines：每個規模的 train wall、加速倍數與 CH / DB / ARI / NMI / leaf 數的對照
+#
+# 輸出 JSON：每個 stage 的 profiling record + throughput（cells/s、MB/s），
+# 以及 scaling：固定 engine / markers 時 log(wall) 對 log(cells) 的斜率（≈1 為線性）
+TRAIN_DEPENDENT = ["label", "evaluate", "feature_map_load", "feature_map_click"]
+SOMTOOLBOX_JAR = os.path.join("programs", "GHSOM", "somtoolbox.jar")
+
+
+def training_available(engine="somtoolbox"):
+    if engine == "numpy":
+        return True
+    return shutil.which("java") is not None and os.path.exists(SOMTOOLBOX_JAR)
+
+
+def load_csv_stage():
+    """
+    把 raw-data parse 獨立成一個 stage，format_input 的時間就不含 read_csv
+    """
+    return {
+        "name": "load_csv",
+        "func": lambda ctx: load_raw_data(ctx).shape,
+        "inputs": lambda ctx: [ctx["raw_path"]],
+        "params": lambda ctx: {},
+        "outputs": lambda ctx: [],
+    }
+
+
+def profile_call(ctx, stage_name, func, *args):
+    """
+    不經過 manifest 的 stage（feature map）也記成同樣格式的 profiling record
+    """
+    snapshot = start_stage_profile()
+    try:
+        result = func(*args)
+    except BaseException:
+        ctx["profile"].append(end_stage_profile(snapshot, stage_name, status="failed"))
+        raise
+    ctx["profile"].append(end_stage_profile(snapshot, stage_name))
+    return result
+
+
+def feature_map_stages(ctx):
+    job_id = ctx["data"]
+    cluster_feature_map.JOB_CACHE.pop(job_id, None)
+    info = profile_call(ctx, "feature_map_load", cluster_feature_map.load_job_into_cache, job_id)
+
+    if not info["pathlist"]:
+        print(f"[WARNING] {job_id}: GHSOM produced a single cluster, skip feature_map_click.")
+        return
+
+    # 模擬點擊 treemap 第一層最大的 cluster
+    cluster_name = info["df"][info["pathlist"][0]].value_counts().index[0]
+    click = {"points": [{"id": str(cluster_name)}]}
+    profile_call(ctx, "feature_map_click", cluster_feature_map.build_feature_panels,
+                 click, f"/feature-map/{job_id}")
+
+
+def add_throughput(records, n_cells):
+    for record in records:
+        wall = record.get("wall_s")
+        if record.get("status") != "ok" or not wall:
+            continue
+        record["cells_per_s"] = round(n_cells / wall, 1)
+        if record.get("input_bytes"):
+            record["input_mb_per_s"] = round(record["input_bytes"] / 1024 / 1024 / wall, 2)
+    return records
+
+
+def cleanup(ctx, label_dir):
+    shutil.rmtree(ctx["app_path"], ignore_errors=True)
+    shutil.rmtree(store_path(ctx["raw_path"]), ignore_errors=True)
+    for path in [ctx["raw_path"], ctx["result_path"], os.path.join(label_dir, f"{ctx['data']}_label.csv")]:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def run_one(n_cells, n_markers, tau1, tau2, train, seed, label_dir, keep=False, decimals=None,
+            ingest='memory', memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, n_components=None,
+            engine='somtoolbox', train_workers=1, train_schedule='fixed'):
+    data = f"bench_{n_cells}x{n_markers}" + ("" if engine == "somtoolbox" else f"_{engine}")
+    raw_path = f"./raw-data/{data}.csv"
+
+    print(f"========== {data} ==========")
+    start = time.perf_counter()
+    meta = write_synthetic_csv(raw_path, n_cells, n_markers, seed)
+    generate_s = round(time.perf_counter() - start, 4)
+
+    # map_cache=False：同一份 synthetic data 每次都重新訓練，量到的才是訓練時間
+    ctx = prepare_pipeline(data, tau1, tau2, index="Event", label="label",
+                           label_backup_dir=label_dir, force=True, decimals=decimals,
+                           ingest=ingest, memory_budget_mb=memory_budget_mb, n_components=n_components,
+                           engine=engine, train_workers=train_workers, train_schedule=train_schedule,
+                           map_cache=False)
+    error = None
+    try:
+        stages = {stage["name"]: stage for stage in PIPELINE_STAGES}
+        run_stage(ctx, stages["convert_store"])
+        if ingest == "memory":
+            run_stage(ctx, load_csv_stage())
+        for name in ["reduce", "format_input", "create_prop", "backup_label"]:
+            run_stage(ctx, stages[name])
+
+        if train:
+            for name in ["train", "label", "evaluate"]:
+                run_stage(ctx, stages[name])
+            feature_map_stages(ctx)
+        else:
+            ctx["profile"].append({"stage": "train", "status": "skipped",
+                                   "reason": f"{engine} engine not available (java / somtoolbox.jar)"})
+            for name in TRAIN_DEPENDENT:
+                ctx["profile"].append({"stage": name, "status": "skipped", "reason": "needs GHSOM output"})
+    except Exception as e:
+        error = e
+    finally:
+        report = finish_pipeline(ctx, error)
+        cluster_feature_map.JOB_CACHE.pop(data, None)
+        if not keep:
+            cleanup(ctx, label_dir)
+
+    return {
+        "data": data,
+        "engine": engine,
+        "cells": n_cells,
+        "markers": n_markers,
+        "data_bytes": meta["bytes"],
+        "generate_s": generate_s,
+        "populations": meta["populations"],
+        "status": report["status"],
+        "error": report["error"],
+        "scores": report["scores"],
+        "stages": add_throughput(ctx["profile"], n_cells),
+    }
+
+
+def scaling_curves(runs):
+    """
+    { stage, engine, markers, exponent, points: [[cells, wall_s], ...] }
+    exponent = log(wall) 對 log(cells) 的最小平方斜率（至少兩個規模才算）
+    """
+    points = {}
+    for run in runs:
+        for record in run["stages"]:
+            if record.get("status") != "ok" or not record.get("wall_s"):
+                continue
+            key = (record["stage"], run["engine"], run["markers"])
+            points.setdefault(key, []).append([run["cells"], record["wall_s"]])
+
+    curves = []
+    for (stage_name, engine, n_markers), pts in sorted(points.items()):
+        pts.sort()
+        exponent = None
+        if len({cells for cells, _ in pts}) >= 2:
+            x = np.log([cells for cells, _ in pts])
+            y = np.log([wall for _, wall in pts])
+            exponent = round(float(np.polyfit(x, y, 1)[0]), 3)
+        curves.append({"stage": stage_name, "engine": engine, "markers": n_markers,
+                       "exponent": exponent, "points": pts})
+    return curves
+
+
+def engine_comparison(runs):
+    """
+    同一個 (cells, markers) 的各引擎：train wall、相對第一個引擎的加速倍數、clustering 分數
+    """
+    groups = {}
+    for run in runs:
+        groups.setdefault((run["cells"], run["markers"]), []).append(run)
+
+    comparison = []
+    for (n_cells, n_markers), group in sorted(groups.items()):
+        if len(group) < 2:
+            continue
+        engines = {}
+        for run in group:
+            train = next((r for r in run["stages"] if r["stage"] == "train"), {})
+            engines[run["engine"]] = {
+                "status": train.get("status"),
+                "train_s": train.get("wall_s"),
+                "peak_rss_mb": train.get("peak_rss_mb"),
+                "scores": run["scores"],
+            }
+        baseline = engines[group[0]["engine"]]["train_s"]
+        for result in engines.values():
+            if baseline and result["train_s"]:
+                result["speedup"] = round(baseline / result["train_s"], 2)
+        comparison.append({"cells": n_cells, "markers": n_markers, "baseline": group[0]["engine"],
+                           "engines": engines})
+    return comparison
+
+
+def parse_sizes(value):
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the scGHSOM pipeline on synthetic data')
+    parser.add_argument('--cells', type=str, default='10000,100000')
+    parser.add_argument('--markers', type=str, default='10,50')
+    parser.add_argument('--tau1', type=float, default=0.1)
+    parser.add_argument('--tau2', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--train', type=str, default='auto', choices=['auto', 'on', 'off'])
+    parser.add_argument('--label_dir', type=str, default='./label')
+    parser.add_argument('--output', type=str, default='./benchmark_results.json')
+    parser.add_argument('--ingest', type=str, default='memory', choices=['memory', 'chunked', 'columnar'])
+    parser.add_argument('--memory_budget_mb', type=int, default=DEFAULT_MEMORY_BUDGET_MB)
+    parser.add_argument('--decimals', type=int, default=None, help='round the .in vectors to N decimals')
+    parser.add_argument('--n_components', type=int, default=None, help='PCA-reduce before GHSOM training')
+    parser.add_argument('--engines', type=str, default='somtoolbox',
+                        help=f'comma-separated GHSOM engines to compare ({", ".join(ENGINES)})')
+    parser.add_argument('--train_workers', type=int, default=1,
+                        help='numpy engine: processes training sibling child maps (0 = all CPUs)')
+    parser.add_argument('--train_schedule', type=str, default='fixed', choices=list(SCHEDULES),
+                        help='numpy engine: fixed numIterations or adaptive with early stopping')
+    parser.add_argument('--keep', action='store_true', help='keep generated data and applications folders')
+    args = parser.parse_args()
+
+    engines = [e.strip() for e in args.engines.split(",") if e.strip()]
+    unknown = [e for e in engines if e not in ENGINES]
+    if unknown:
+        parser.error(f"unknown engines {unknown}; choose from {list(ENGINES)}")
+
+    train = {}
+    for engine in engines:
+        train[engine] = args.train == 'on' or (args.train == 'auto' and training_available(engine))
+        if not train[engine]:
+            print(f"[INFO] GHSOM training with {engine} disabled "
+                  f"(java / somtoolbox.jar not found or --train=off).")
+
+    runs = []
+    for n_markers in parse_sizes(args.markers):
+        for n_cells in parse_sizes(args.cells):
+            for engine in engines:
+                runs.append(run_one(n_cells, n_markers, args.tau1, args.tau2, train[engine],
+                                    args.seed, args.label_dir, args.keep, args.decimals,
+                                    args.ingest, args.memory_budget_mb, args.n_components, engine,
+                                    args.train_workers, args.train_schedule))
+
+    results = {
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "host": {
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+        },
+        "config": {"tau1": args.tau1, "tau2": args.tau2, "seed": args.seed, "train": train,
+                   "decimals": args.decimals, "ingest": args.ingest,
+                   "memory_budget_mb": args.memory_budget_mb, "n_components": args.n_components,
+                   "engines": engines, "train_workers": args.train_workers,
+                   "train_schedule": args.train_schedule},
+        "runs": runs,
+        "scaling": scaling_curves(runs),
+        "engines": engine_comparison(runs),
+    }
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=4, default=str)
+
+    print("========== Scaling (wall ∝ cells^k) ==========")
+    for curve in results["scaling"]:
+        print(f"{curve['stage']:<20}{curve['engine']:<12}markers={curve['markers']:<6}k={curve['exponent']}")
+    if results["engines"]:
+        print("========== Engines (train wall, speedup, ARI) ==========")
+        for row in results["engines"]:
+            for engine, result in row["engines"].items():
+                ari = (result["scores"] or {}).get("ARI")
+                train_s = "-" if result["train_s"] is None else f"{result['train_s']}s"
+                print(f"{row['cells']:>10} x {row['markers']:<5}{engine:<12}{result['status'] or '-':<9}"
+                      f"train={train_s}  speedup={result.get('speedup', '-')}  ARI={ari}")
+    print(f"[OK] Benchmark results saved at {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import os
+import json
+import argparse
+import numpy as np
+import pandas as pd
+
+
+# ============================================================
+# ⭐ 合成 cytometry 資料（有已知階層結構的 populations）
+# ============================================================
+# 結構：lineage（第一層）→ subset（第二層）+ 少數 rare populations
+#   - lineage : 隨機一組 marker 為 positive（arcsinh 空間 mean 3 ~ 5，其餘 ~0.3）
+#   - subset  : 繼承 lineage 的 mean，再在 2~3 個 marker 上 ±1.5
+#   - rare    : 每個只佔 ~0.2%，有自己獨特的 marker 組合（測 GHSOM 是否切得出來）
+# 欄位：Event（1-based）、M001 ... M{n_markers}、label（leaf population 的整數代號 1..K）
+# label 用整數（跟 Samusik 等公開資料一樣）：save_cluster_with_clustered_label 的 row mean / median
+# 會把 index 以外的欄位都算進去，字串 label 會讓它失敗。代號 ↔ 名稱（P2.1 / R1）記在 metadata。
+DEFAULT_CHUNK_SIZE = 200_000
+
+
+def build_hierarchy(n_markers, branching=(4, 3), n_rare=2, rare_fraction=0.002, seed=7):
+    """
+    回傳 list of { "code", "label", "parent", "mean" (np.ndarray), "weight" }（weight 總和 = 1）
+    """
+    rng = np.random.default_rng(seed)
+    n_lineage, n_subset = branching
+    n_positive = max(1, n_markers // 5)
+
+    populations = []
+    lineage_weights = rng.dirichlet(np.full(n_lineage, 5.0))
+    remaining = 1.0 - n_rare * rare_fraction
+
+    for i in range(n_lineage):
+        lineage_mean = np.full(n_markers, 0.3)
+        positive = rng.choice(n_markers, n_positive, replace=False)
+        lineage_mean[positive] = rng.uniform(3.0, 5.0, n_positive)
+
+        subset_weights = rng.dirichlet(np.full(n_subset, 3.0))
+        for j in range(n_subset):
+            mean = lineage_mean.copy()
+            shifted = rng.choice(n_markers, min(n_markers, rng.integers(2, 4)), replace=False)
+            mean[shifted] = np.clip(mean[shifted] + rng.choice([-1.5, 1.5], len(shifted)), 0.0, None)
+            populations.append({
+                "label": f"P{i + 1}.{j + 1}",
+                "parent": f"P{i + 1}",
+                "mean": mean,
+                "weight": remaining * lineage_weights[i] * subset_weights[j],
+            })
+
+    for k in range(n_rare):
+        mean = np.full(n_markers, 0.3)
+        positive = rng.choice(n_markers, min(n_markers, 3), replace=False)
+        mean[positive] = rng.uniform(5.0, 6.0, len(positive))
+        populations.append({
+            "label": f"R{k + 1}",
+            "parent": f"R{k + 1}",
+            "mean": mean,
+            "weight": rare_fraction,
+        })
+
+    for code, population in enumerate(populations, start=1):
+        population["code"] = code
+    return populations
+
+
+def marker_names(n_markers):
+    return [f"M{i + 1:03d}" for i in range(n_markers)]
+
+
+def generate_chunks(n_cells, n_markers, chunk_size=DEFAULT_CHUNK_SIZE, seed=7, populations=None):
+    """
+    逐塊產生 DataFrame（記憶體只跟 chunk_size 有關，5M cells 也不會整個放進記憶體）
+    """
+    if populations is None:
+        populations = build_hierarchy(n_markers, seed=seed)
+
+    rng = np.random.default_rng(seed + 1)
+    means = np.vstack([p["mean"] for p in populations]).astype(np.float32)
+    weights = np.array([p["weight"] for p in populations])
+    weights = weights / weights.sum()
+    codes = np.array([p["code"] for p in populations])
+    columns = marker_names(n_markers)
+
+    for start in range(0, n_cells, chunk_size):
+        size = min(chunk_size, n_cells - start)
+        pop = rng.choice(len(populations), size=size, p=weights)
+
+        values = means[pop] + rng.normal(0.0, 0.35, (size, n_markers)).astype(np.float32)
+        np.clip(values, 0.0, None, out=values)
+
+        df = pd.DataFrame(np.round(values, 4), columns=columns)
+        df.insert(0, "Event", np.arange(start + 1, start + size + 1))
+        df["label"] = codes[pop]
+        yield df
+
+
+def write_synthetic_csv(path, n_cells, n_markers, seed=7, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    寫成 raw-data 格式的 CSV，回傳 metadata（實際的 population 比例、檔案大小）
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    populations = build_hierarchy(n_markers, seed=seed)
+
+    counts = {}
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        for i, df in enumerate(generate_chunks(n_cells, n_markers, chunk_size, seed, populations)):
+            df.to_csv(f, index=False, header=(i == 0))
+            for code, count in df["label"].value_counts().items():
+                counts[code] = counts.get(code, 0) + int(count)
+
+    return {
+        "path": path,
+        "n_cells": n_cells,
+        "n_markers": n_markers,
+        "seed": seed,
+        "bytes": os.path.getsize(path),
+        "populations": {
+            p["code"]: {"name": p["label"], "parent": p["parent"], "cells": counts.get(p["code"], 0)}
+            for p in populations
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic cytometry CSV with planted populations')
+    parser.add_argument('--cells', type=int, default=100000)
+    parser.add_argument('--markers', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', type=str, default=None)
+    args = parser.parse_args()
+
+    output = args.output or f"./raw-data/synthetic_{args.cells}x{args.markers}.csv"
+    meta = write_synthetic_csv(output, args.cells, args.markers, args.seed)
+
+    print(json.dumps(meta, indent=4))
+    print(f"[OK] Synthetic data saved at {output}")
+
+
+if __name__ == "__main__":
+    main()
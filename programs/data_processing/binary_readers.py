@@ -0,0 +1,358 @@
+import os
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+try:
+    import h5py
+except ImportError:     # h5ad 上傳才需要
+    h5py = None
+
+
+# ============================================================
+# ⭐ Binary 上傳格式：FCS 3.x（cytometry）與 .h5ad（AnnData）
+# ============================================================
+# 直接讀進數值矩陣（FCS 用 np.memmap，h5ad 用 h5py 分塊讀），不轉成 CSV。
+# open_binary() 回傳：
+#   { "names": [欄位...], "rows": n, "blocks": callable(block_rows) → DataFrame iterator }
+# 第一欄固定是 Event（1-based row number，與 raw-data CSV 的慣例相同，例如 benchmark/synthetic_data.py），
+# 之後是選到的 channel / gene，h5ad 有指定 label 時最後一欄是 obs[label]。
+# h5ad 的 X 是 CSR / CSC 時另外有：
+#   "sparse"     : callable() → (選到的 gene 的 csr_matrix, gene 名稱)
+#   "meta_names" : 不含 gene 的欄位（Event / label），blocks(block_rows, with_features=False) 的欄位
+BINARY_EXTENSIONS = (".fcs", ".h5ad")
+RAW_EXTENSIONS = (".csv",) + BINARY_EXTENSIONS
+EVENT_COLUMN = "Event"
+FCS_HEADER_BYTES = 58
+
+
+def is_binary_upload(path):
+    return os.path.splitext(path)[1].lower() in BINARY_EXTENSIONS
+
+
+def parse_channel_list(value):
+    """
+    "CD3, CD4 CD8" → ["CD3", "CD4", "CD8"]；空字串 / None → None（全部）
+    """
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)):
+        names = [str(v).strip() for v in value]
+    else:
+        names = value.replace(",", " ").split()
+    names = [n for n in names if n]
+    return names or None
+
+
+def _select(available, requested, aliases=None):
+    """
+    requested 中的名稱 → available 的 index（保留 requested 的順序）
+    aliases : { 其他名稱 : index }（例如 FCS 的 $PnN / $PnS 都可以用）
+    """
+    if requested is None:
+        return list(range(len(available)))
+
+    lookup = {name: i for i, name in enumerate(available)}
+    lookup.update(aliases or {})
+    missing = [name for name in requested if name not in lookup]
+    if missing:
+        preview = ", ".join(available[:20]) + (" ..." if len(available) > 20 else "")
+        raise ValueError(f"Unknown channels {missing}. Available: {preview}")
+    # 重複指定同一個 channel 只取一次
+    return list(dict.fromkeys(lookup[name] for name in requested))
+
+
+def _event_block(start, stop):
+    # Event 是 1-based；DataFrame index 仍是 0-based 的 row 位置
+    return pd.DataFrame({EVENT_COLUMN: np.arange(start + 1, stop + 1, dtype=np.int64)},
+                        index=pd.RangeIndex(start, stop))
+
+
+# ============================================================
+# FCS 3.0 / 3.1（list mode，$DATATYPE F / D / I）
+# ============================================================
+def _parse_fcs_text(raw):
+    """
+    TEXT segment：第一個字元是 delimiter，連續兩個 delimiter 代表字面上的 delimiter
+    """
+    delimiter = raw[0:1]
+    tokens = []
+    current = bytearray()
+    i = 1
+    while i < len(raw):
+        byte = raw[i:i + 1]
+        if byte == delimiter:
+            if raw[i + 1:i + 2] == delimiter:
+                current += delimiter
+                i += 2
+                continue
+            tokens.append(current.decode("latin-1"))
+            current = bytearray()
+        else:
+            current += byte
+        i += 1
+    if current:
+        tokens.append(current.decode("latin-1"))
+
+    return {tokens[k].strip().upper(): tokens[k + 1].strip() for k in range(0, len(tokens) - 1, 2)}
+
+
+def read_fcs_metadata(path):
+    with open(path, "rb") as f:
+        header = f.read(FCS_HEADER_BYTES)
+        version = header[0:6].decode("ascii", "replace")
+        if not version.startswith("FCS"):
+            raise ValueError(f"{path} is not an FCS file")
+
+        offsets = [int(header[k:k + 8].strip() or 0) for k in (10, 18, 26, 34)]
+        text_start, text_end, data_start, data_end = offsets
+        f.seek(text_start)
+        text = _parse_fcs_text(f.read(text_end - text_start + 1))
+
+    # data segment 超過 99,999,999 bytes 時 HEADER 填 0，位置只記在 TEXT
+    if data_start == 0 or data_end == 0:
+        data_start = int(text.get("$BEGINDATA", 0))
+        data_end = int(text.get("$ENDDATA", 0))
+
+    if text.get("$MODE", "L").upper() != "L":
+        raise ValueError(f"{path}: only list-mode FCS ($MODE=L) is supported")
+
+    n_par = int(text["$PAR"])
+    channels = []
+    for n in range(1, n_par + 1):
+        channels.append({
+            "short": text.get(f"$P{n}N", f"P{n}"),
+            "marker": text.get(f"$P{n}S", ""),
+            "bits": int(text.get(f"$P{n}B", 0) or 0),
+            "range": float(text.get(f"$P{n}R", 0) or 0),
+        })
+
+    return {
+        "version": version,
+        "text": text,
+        "channels": channels,
+        "rows": int(text["$TOT"]),
+        "data_start": data_start,
+        "data_end": data_end,
+    }
+
+
+def _fcs_dtype(meta):
+    text = meta["text"]
+    datatype = text.get("$DATATYPE", "F").upper()
+    byteord = text.get("$BYTEORD", "1,2,3,4").replace(" ", "")
+    endian = "<" if byteord.startswith("1") else ">"
+
+    if datatype == "F":
+        return np.dtype(endian + "f4")
+    if datatype == "D":
+        return np.dtype(endian + "f8")
+    if datatype == "I":
+        bits = {c["bits"] for c in meta["channels"]}
+        if len(bits) != 1 or next(iter(bits)) not in (8, 16, 32, 64):
+            raise ValueError(f"Unsupported FCS integer layout ($PnB = {sorted(bits)})")
+        return np.dtype(endian + f"u{next(iter(bits)) // 8}")
+    raise ValueError(f"Unsupported FCS $DATATYPE '{datatype}'")
+
+
+def fcs_column_names(meta):
+    """
+    欄位名稱用 $PnS（marker，例如 CD3）；沒有 $PnS 或重複時用 $PnN（channel，例如 Nd142Di）
+    """
+    names = []
+    for channel in meta["channels"]:
+        name = channel["marker"] or channel["short"]
+        if name in names or name == EVENT_COLUMN:
+            name = channel["short"]
+        names.append(name)
+    return names
+
+
+def open_fcs(path, channels=None):
+    meta = read_fcs_metadata(path)
+    dtype = _fcs_dtype(meta)
+    n_rows, n_par = meta["rows"], len(meta["channels"])
+
+    names = fcs_column_names(meta)
+    aliases = {c["short"]: i for i, c in enumerate(meta["channels"])}
+    aliases.update({c["marker"]: i for i, c in enumerate(meta["channels"]) if c["marker"]})
+    selected = _select(names, channels, aliases)
+
+    matrix = np.memmap(path, dtype=dtype, mode="r", offset=meta["data_start"], shape=(n_rows, n_par))
+
+    # 整數資料：$PnR 不是 2 的次方時，高位元不屬於量測值 → mask
+    masks = {}
+    if dtype.kind == "u":
+        for i in selected:
+            value_range = int(meta["channels"][i]["range"])
+            if value_range > 0:
+                mask = (1 << int(np.ceil(np.log2(value_range)))) - 1
+                if mask < np.iinfo(dtype).max:
+                    masks[i] = mask
+
+    selected_names = [names[i] for i in selected]
+
+    def blocks(block_rows):
+        for start in range(0, n_rows, block_rows):
+            stop = min(start + block_rows, n_rows)
+            values = np.asarray(matrix[start:stop, selected])
+            if dtype.kind == "u":
+                for j, i in enumerate(selected):
+                    if i in masks:
+                        values[:, j] &= masks[i]
+                # 整數 channel 轉 float32（與 $DATATYPE=F 的 FCS 一致）
+                values = values.astype(np.float32)
+            else:
+                values = values.astype(dtype.newbyteorder("="), copy=False)
+
+            block = _event_block(start, stop)
+            yield pd.concat([block, pd.DataFrame(values, columns=selected_names, index=block.index)], axis=1)
+
+    return {"names": [EVENT_COLUMN] + selected_names, "rows": n_rows, "blocks": blocks}
+
+
+# ============================================================
+# .h5ad（AnnData；X 可以是 dense 或 CSR / CSC sparse）
+# ============================================================
+def _h5_strings(dataset):
+    values = dataset[()]
+    return [v.decode("utf-8") if isinstance(v, bytes) else str(v) for v in values]
+
+
+def _h5_index(group):
+    key = group.attrs.get("_index", "_index")
+    if isinstance(key, bytes):
+        key = key.decode("utf-8")
+    return _h5_strings(group[key])
+
+
+def _h5_obs_column(f, name):
+    """
+    obs 欄位（label）：新版 categorical 是 group（categories + codes），舊版放在 obs/__categories
+    """
+    obs = f["obs"]
+    if name not in obs:
+        return None
+
+    item = obs[name]
+    if isinstance(item, h5py.Group):
+        categories = np.asarray(_h5_strings(item["categories"]), dtype=object)
+        codes = item["codes"][()]
+        return np.where(codes >= 0, categories[np.clip(codes, 0, None)], None)
+
+    values = item[()]
+    if "__categories" in obs and name in obs["__categories"]:
+        categories = np.asarray(_h5_strings(obs["__categories"][name]), dtype=object)
+        return np.where(values >= 0, categories[np.clip(values, 0, None)], None)
+    if values.dtype.kind in ("S", "O"):
+        return np.asarray([v.decode("utf-8") if isinstance(v, bytes) else v for v in values], dtype=object)
+    return values
+
+
+def _sparse_rows_to_dense(data, indices, indptr, positions, n_selected):
+    """
+    CSR 的一段 row → dense（只保留 positions >= 0 的 column）
+    """
+    n_rows = len(indptr) - 1
+    dense = np.zeros((n_rows, n_selected), dtype=np.float32)
+    rows = np.repeat(np.arange(n_rows), np.diff(indptr))
+    keep = positions[indices] >= 0
+    dense[rows[keep], positions[indices[keep]]] = data[keep]
+    return dense
+
+
+def open_h5ad(path, channels=None, label=None):
+    if h5py is None:
+        raise ValueError("h5ad upload requires the optional dependency h5py (pip install h5py)")
+
+    with h5py.File(path, "r") as f:
+        genes = _h5_index(f["var"])
+        n_rows = len(_h5_index(f["obs"]))
+        X = f["X"]
+        encoding = "dense" if isinstance(X, h5py.Dataset) else X.attrs.get("encoding-type", "csr_matrix")
+        if isinstance(encoding, bytes):
+            encoding = encoding.decode("utf-8")
+        has_label = label is not None and label in f["obs"]
+
+    selected = _select(genes, channels)
+    names = [genes[i] for i in selected]
+    if len(names) > 1000 and encoding == "dense":
+        print(f"[WARNING] {len(names)} genes selected from {path}; consider a channel subset.")
+
+    positions = np.full(len(genes), -1, dtype=np.int64)
+    positions[selected] = np.arange(len(selected))
+    order = np.argsort(selected)
+    sorted_selected = np.asarray(selected)[order]
+
+    def blocks(block_rows, with_features=True):
+        with h5py.File(path, "r") as f:
+            X = f["X"]
+            labels = _h5_obs_column(f, label) if has_label else None
+
+            csc_dense = None
+            if encoding == "csc_matrix" and with_features:
+                # CSC：一次取出選到的 column（n × 選到的 gene，dense float32）
+                indptr = X["indptr"][()]
+                csc_dense = np.zeros((n_rows, len(selected)), dtype=np.float32)
+                for j, gene in enumerate(selected):
+                    lo, hi = indptr[gene], indptr[gene + 1]
+                    csc_dense[X["indices"][lo:hi], j] = X["data"][lo:hi]
+
+            for start in range(0, n_rows, block_rows):
+                stop = min(start + block_rows, n_rows)
+                block = _event_block(start, stop)
+                if not with_features:
+                    if labels is not None:
+                        block[label] = labels[start:stop]
+                    yield block
+                    continue
+
+                if encoding == "dense":
+                    values = np.empty((stop - start, len(selected)), dtype=np.float32)
+                    values[:, order] = X[start:stop, sorted_selected.tolist()]
+                elif encoding == "csr_matrix":
+                    indptr = X["indptr"][start:stop + 1]
+                    lo, hi = indptr[0], indptr[-1]
+                    values = _sparse_rows_to_dense(X["data"][lo:hi], X["indices"][lo:hi], indptr - lo,
+                                                   positions, len(selected))
+                elif encoding == "csc_matrix":
+                    values = csc_dense[start:stop]
+                else:
+                    raise ValueError(f"Unsupported h5ad X encoding '{encoding}'")
+
+                block = pd.concat([block, pd.DataFrame(values, columns=names, index=block.index)], axis=1)
+                if labels is not None:
+                    block[label] = labels[start:stop]
+                yield block
+
+    def sparse_matrix():
+        # 整個 X 的 data / indices / indptr 讀進來（大小 ∝ 非零值數），只取選到的 gene
+        with h5py.File(path, "r") as f:
+            X = f["X"]
+            arrays = (X["data"][()], X["indices"][()], X["indptr"][()])
+        if encoding == "csr_matrix":
+            matrix = sparse.csr_matrix(arrays, shape=(n_rows, len(genes)))
+        else:
+            matrix = sparse.csc_matrix(arrays, shape=(n_rows, len(genes)))
+        matrix = matrix[:, selected].tocsr()
+        matrix.sum_duplicates()
+        return matrix, names
+
+    reader = {
+        "names": [EVENT_COLUMN] + names + ([label] if has_label else []),
+        "rows": n_rows,
+        "blocks": blocks,
+    }
+    if encoding in ("csr_matrix", "csc_matrix"):
+        reader["sparse"] = sparse_matrix
+        reader["meta_names"] = [EVENT_COLUMN] + ([label] if has_label else [])
+    return reader
+
+
+def open_binary(path, channels=None, label=None):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".fcs":
+        return open_fcs(path, channels)
+    if ext == ".h5ad":
+        return open_h5ad(path, channels, label)
+    raise ValueError(f"Unsupported upload format '{ext}'")
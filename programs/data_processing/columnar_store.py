@@ -0,0 +1,298 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+from numpy.lib.format import open_memmap
+from programs.data_processing.raw_data_reader import (
+    DEFAULT_MEMORY_BUDGET_MB, read_header, count_csv_rows, chunk_rows_for_budget
+)
+from programs.data_processing.binary_readers import open_binary, is_binary_upload
+from programs.data_processing.sparse_features import to_csr
+
+
+# ============================================================
+# ⭐ Columnar store：上傳的 CSV 只 parse 一次，之後各 stage memory-map
+# ============================================================
+# raw-data/<data>.cols/
+#   columns.json : { "source": { size, mtime_ns[, channels, label, event_base] }, "rows": n,
+#                    "columns": [ { name, file, kind, dtype, categories? } ... ] }
+#   c0000.npy ... : 每欄一個 .npy（np.load(mmap_mode='r')，同時跑的 stage 共用 page cache）
+#   X_data.npy / X_indices.npy / X_indptr.npy : sparse h5ad 的 gene matrix（CSR，不轉 dense），
+#                   columns.json 的 "sparse": { names, shape, files }；columns 只剩 Event / label
+#
+# 來源可以是 CSV（build_store）或 FCS / h5ad（build_store_from_binary，binary_readers.py）
+#
+# kind = "numeric"     : int64 / float64（與 pd.read_csv 推斷的型別相同，.in 逐 byte 不變）
+# kind = "categorical" : 文字欄位（例如 label）存 int32 codes，categories 記在 columns.json，
+#                        -1 = NA
+STORE_SUFFIX = ".cols"
+STORE_MANIFEST = "columns.json"
+
+
+def store_path(raw_path):
+    return os.path.splitext(raw_path)[0] + STORE_SUFFIX
+
+
+def _source_stat(raw_path, channels=None, label=None):
+    stat = os.stat(raw_path)
+    source = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if channels is not None:
+        source["channels"] = list(channels)
+    if label is not None:
+        source["label"] = label
+    if is_binary_upload(raw_path):
+        # binary 的 Event 改成 1-based 之前建的 store（0-based）→ 不相符，重建
+        source["event_base"] = 1
+    return source
+
+
+def open_store(raw_path, store_dir=None, channels=None, label=None):
+    """
+    store 存在且與 raw-data 的 size / mtime（binary 上傳再加上 channel subset / obs label）相符
+    → 回傳 store dict，否則 None
+    """
+    store_dir = store_dir or store_path(raw_path)
+    try:
+        with open(os.path.join(store_dir, STORE_MANIFEST), "r") as f:
+            store = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if not os.path.exists(raw_path) or store.get("source") != _source_stat(raw_path, channels, label):
+        return None
+    store["dir"] = store_dir
+    return store
+
+
+def store_files(store):
+    if store is None:
+        return []
+    files = [spec["file"] for spec in store["columns"]]
+    if "sparse" in store:
+        files += list(store["sparse"]["files"].values())
+    return [os.path.join(store["dir"], STORE_MANIFEST)] + [os.path.join(store["dir"], f) for f in files]
+
+
+# ------------------------------------------------------------
+# 建立 store（分塊 parse，記憶體由 memory_budget_mb 決定）
+# ------------------------------------------------------------
+def _column_kind(values):
+    if pd.api.types.is_bool_dtype(values) or not pd.api.types.is_numeric_dtype(values):
+        return "categorical"
+    return "numeric"
+
+
+def _promote_to_float(column, n_rows, filled):
+    """
+    前面幾塊推斷為整數、後面出現小數或 NA → 整欄改成 float64（與 read_csv 整份讀的結果相同）
+    """
+    old_path = column["path"] + ".int"
+    del column["array"]
+    os.replace(column["path"], old_path)
+
+    old = np.load(old_path, mmap_mode="r")
+    array = open_memmap(column["path"], mode="w+", dtype=np.float64, shape=(n_rows,))
+    array[:filled] = old[:filled]
+    del old
+    os.remove(old_path)
+
+    column["array"] = array
+    column["spec"]["dtype"] = "float64"
+
+
+def _write_chunk(column, values, start, n_rows):
+    spec = column["spec"]
+    stop = start + len(values)
+
+    if spec["kind"] == "categorical":
+        if _column_kind(values) == "numeric" and not values.isna().all():
+            raise ValueError(f"Column '{spec['name']}' mixes text and numeric values")
+        codes, uniques = pd.factorize(values.astype(object))
+        lookup = np.array([column["codes"].setdefault(u, len(column["codes"])) for u in uniques],
+                          dtype=np.int32)
+        column["array"][start:stop] = np.where(codes >= 0, lookup[codes] if len(lookup) else -1, -1)
+        return
+
+    if _column_kind(values) != "numeric":
+        raise ValueError(f"Column '{spec['name']}' mixes numeric and text values")
+    if spec["dtype"] == "int64" and not pd.api.types.is_integer_dtype(values):
+        _promote_to_float(column, n_rows, start)
+    column["array"][start:stop] = values.to_numpy(dtype=column["array"].dtype)
+
+
+def _truncate_npy(path, n_rows):
+    """
+    換行數多於實際列數（檔尾空行）→ 重寫成正確長度
+    """
+    array = np.load(path, mmap_mode="r")
+    tmp_path = path + ".tmp"
+    np.save(tmp_path, array[:n_rows])
+    del array
+    os.replace(tmp_path + ".npy", path)
+
+
+def _write_sparse(tmp_dir, matrix, names):
+    files = {}
+    for part in ("data", "indices", "indptr"):
+        files[part] = f"X_{part}.npy"
+        np.save(os.path.join(tmp_dir, files[part]), getattr(matrix, part))
+    return {"names": list(names), "shape": list(matrix.shape), "files": files}
+
+
+def _write_store(blocks, names, n_rows, store_dir, source, origin, sparse_features=None):
+    """
+    blocks : 依序產生 DataFrame（欄位順序 = names），n_rows 為預估列數（只能多不能少）
+    sparse_features : (csr_matrix, gene 名稱)，另外存成 CSR 三個 .npy
+    先寫到 <store>.tmp，完成後才換上，不會留下半個 store
+    """
+    tmp_dir = store_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    columns = []
+    row = 0
+    try:
+        for chunk in blocks:
+            if row + len(chunk) > n_rows:
+                raise ValueError(f"{origin}: more rows than lines (quoted newlines are not supported)")
+
+            for i, name in enumerate(names):
+                values = chunk.iloc[:, i]
+                if i == len(columns):
+                    kind = _column_kind(values)
+                    if kind == "categorical":
+                        dtype = np.int32
+                    elif pd.api.types.is_integer_dtype(values):
+                        dtype = np.int64
+                    else:
+                        # FCS / h5ad 的 float32 保留 float32；CSV parse 出來一律 float64
+                        dtype = values.dtype if values.dtype == np.float32 else np.float64
+                    path = os.path.join(tmp_dir, f"c{i:04d}.npy")
+                    columns.append({
+                        "spec": {"name": name, "file": os.path.basename(path), "kind": kind,
+                                 "dtype": np.dtype(dtype).name},
+                        "path": path,
+                        "array": open_memmap(path, mode="w+", dtype=dtype, shape=(n_rows,)),
+                        "codes": {},
+                    })
+                _write_chunk(columns[i], values, row, n_rows)
+            row += len(chunk)
+
+        specs = []
+        for column in columns:
+            column["array"].flush()
+            del column["array"]
+            if row != n_rows:
+                _truncate_npy(column["path"], row)
+            if column["spec"]["kind"] == "categorical":
+                column["spec"]["categories"] = [str(c) for c in column["codes"]]
+            specs.append(column["spec"])
+
+        sparse_spec = _write_sparse(tmp_dir, *sparse_features) if sparse_features is not None else None
+    except Exception:
+        columns.clear()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    store = {"source": source, "rows": row, "columns": specs}
+    if sparse_spec is not None:
+        store["sparse"] = sparse_spec
+    with open(os.path.join(tmp_dir, STORE_MANIFEST), "w") as f:
+        json.dump(store, f, indent=4)
+
+    shutil.rmtree(store_dir, ignore_errors=True)
+    os.replace(tmp_dir, store_dir)
+    print(f"[OK] Columnar store saved at {store_dir} ({row} rows, {len(specs)} columns)")
+
+    store["dir"] = store_dir
+    return store
+
+
+def build_store(raw_path, store_dir=None, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB):
+    """
+    raw-data CSV → columnar store
+    欄位型別無法一致（同一欄有文字也有數字）→ ValueError，呼叫端改用 CSV
+    """
+    names = read_header(raw_path)
+    chunk_rows = chunk_rows_for_budget(len(names), memory_budget_mb)
+    blocks = pd.read_csv(raw_path, encoding='utf-8', chunksize=chunk_rows)
+    return _write_store(blocks, names, count_csv_rows(raw_path), store_dir or store_path(raw_path),
+                        _source_stat(raw_path), raw_path)
+
+
+def build_store_from_binary(raw_path, channels=None, label=None, store_dir=None,
+                            memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB):
+    """
+    FCS / h5ad → columnar store，直接從 binary 讀進來，不經過 CSV
+    channels : 只保留這些 channel / gene（None → 全部）
+    label    : h5ad 的 obs 欄位名稱（例如 cell_type），一併存成 categorical 欄位
+    h5ad 的 X 是 sparse → gene matrix 保持 CSR（read_sparse_features），不展開成每個 gene 一欄
+    """
+    reader = open_binary(raw_path, channels, label)
+    store_dir = store_dir or store_path(raw_path)
+    source = _source_stat(raw_path, channels, label)
+
+    if "sparse" in reader:
+        matrix, names = reader["sparse"]()
+        print(f"[INFO] Sparse X: {matrix.shape[0]} x {matrix.shape[1]}, "
+              f"{matrix.nnz / max(1, matrix.shape[0] * matrix.shape[1]):.1%} non-zero")
+        block_rows = chunk_rows_for_budget(len(reader["meta_names"]), memory_budget_mb)
+        return _write_store(reader["blocks"](block_rows, with_features=False), reader["meta_names"],
+                            reader["rows"], store_dir, source, raw_path, sparse_features=(matrix, names))
+
+    block_rows = chunk_rows_for_budget(len(reader["names"]), memory_budget_mb)
+    return _write_store(reader["blocks"](block_rows), reader["names"], reader["rows"],
+                        store_dir, source, raw_path)
+
+
+# ------------------------------------------------------------
+# 讀取（memory-mapped，只讀需要的欄位）
+# ------------------------------------------------------------
+def column_names(store):
+    return [spec["name"] for spec in store["columns"]]
+
+
+def _spec(store, name):
+    for spec in store["columns"]:
+        if spec["name"] == name:
+            return spec
+    raise KeyError(f"Column '{name}' not in columnar store {store['dir']}")
+
+
+def read_column(store, name, start=None, stop=None):
+    """
+    numeric → memory-mapped ndarray（slice 不複製）
+    categorical → object ndarray（原始文字，NA = NaN）
+    """
+    spec = _spec(store, name)
+    array = np.load(os.path.join(store["dir"], spec["file"]), mmap_mode="r")[start:stop]
+    if spec["kind"] == "categorical":
+        return np.asarray(pd.Categorical.from_codes(array, spec["categories"]), dtype=object)
+    return array
+
+
+def read_columns(store, columns=None, start=None, stop=None):
+    """
+    DataFrame（欄位順序與 CSV 相同），columns=None → 全部
+    """
+    names = column_names(store) if columns is None else list(columns)
+    index = pd.RangeIndex(start or 0, stop if stop is not None else store["rows"])
+    return pd.DataFrame({name: read_column(store, name, start, stop) for name in names}, index=index)
+
+
+def read_sparse_features(store):
+    """
+    sparse store → (memory-mapped csr_matrix, gene 名稱)；dense store → None
+    """
+    if store is None or "sparse" not in store:
+        return None
+    spec = store["sparse"]
+    parts = {part: np.load(os.path.join(store["dir"], name), mmap_mode="r")
+             for part, name in spec["files"].items()}
+    return to_csr(parts["data"], parts["indices"], parts["indptr"], spec["shape"][1]), spec["names"]
+
+
+def iter_column_blocks(store, columns, block_rows):
+    for start in range(0, store["rows"], block_rows):
+        yield read_columns(store, columns, start, min(start + block_rows, store["rows"]))
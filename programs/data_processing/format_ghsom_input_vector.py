@@ -1,14 +1,81 @@
+import os
+import shutil
 import pandas as pd
-import csv
 import numpy as np
+from programs.data_processing.raw_data_reader import (
+    DEFAULT_MEMORY_BUDGET_MB, read_header, count_csv_rows, chunk_rows_for_budget, iter_raw_chunks
+)
+from programs.data_processing.columnar_store import iter_column_blocks, read_sparse_features
+from programs.data_processing.sparse_features import is_integral, format_sparse_values
+from programs.data_processing.kept_rows import kept_rows_path, save_kept_rows
 
-def format_ghsom_input_vector(name, file, index, label, subnum):
+# ============================================================
+# ⭐ SOMLib .in writer（header + vectors 直接從 DataFrame 串流寫出）
+# ============================================================
+# 格式與舊版（to_csv → _ghsom.csv → csv.reader / csv.writer 複製）逐 byte 相同：
+#   $TYPE inputvec / $XDIM n / $YDIM 1 / $VECDIM d，接一行空行
+#   每個 vector：d 個數值 + 最後一欄 vector name（0-based row number），空白分隔
+#   行尾一律 \r\n（舊版 csv.writer 的預設 lineterminator）
+IN_LINE_TERMINATOR = '\r\n'
+IN_CHUNK_ROWS = 50_000
+COPY_BLOCK_SIZE = 1 << 20
+
+
+def write_in_header(f, x_dim, vec_dim, y_dim=1, data_type='inputvec'):
+    f.write(f'$TYPE {data_type}{IN_LINE_TERMINATOR}')
+    f.write(f'$XDIM {x_dim}{IN_LINE_TERMINATOR}')
+    f.write(f'$YDIM {y_dim}{IN_LINE_TERMINATOR}')
+    f.write(f'$VECDIM {vec_dim}{IN_LINE_TERMINATOR}')
+    f.write(IN_LINE_TERMINATOR)
+
+
+def write_in_vectors(f, df, start=0, decimals=None, chunk_rows=IN_CHUNK_ROWS):
+    """
+    df           : 只含 feature 欄位的 DataFrame（index / label 已 drop）
+    start        : 第一列的 vector name（分塊寫入時接續上一塊）
+    decimals     : 先 round 到小數第幾位再寫（vectorized，比 to_csv 的 float_format 快，檔案也小）；
+                   None → 與舊版相同（pandas 預設 repr，完整精度）
+    回傳寫到下一列的 vector name
+    """
+    for offset in range(0, len(df), chunk_rows):
+        block = df.iloc[offset:offset + chunk_rows]
+        block = block.round(decimals) if decimals is not None else block.copy()
+        # 欄位名稱不會寫出（header=False），用固定名稱避免跟 feature 欄位撞名
+        block['__vector_name__'] = range(start + offset, start + offset + len(block))
+        block.to_csv(f, sep=' ', index=False, header=False,
+                     lineterminator=IN_LINE_TERMINATOR)
+    return start + len(df)
+
+
+def write_in_vectors_sparse(f, X, start=0, decimals=None, chunk_rows=IN_CHUNK_ROWS):
+    """
+    X : csr_matrix（只含 feature）→ 與 write_in_vectors 相同的 dense 文字格式
+    SOMLib 的 .in 沒有 sparse 寫法（sparseData=yes 只影響 somtoolbox 讀進來後的記憶體），
+    所以 0 還是要寫出來，但只格式化非零值，0 直接寫成 "0"；count matrix 寫成整數
+    """
+    integral = is_integral(X.data)
+    for offset in range(0, X.shape[0], chunk_rows):
+        block = X[offset:offset + chunk_rows]
+        tokens = np.full((block.shape[0], X.shape[1] + 1), '0', dtype=object)
+        rows = np.repeat(np.arange(block.shape[0]), np.diff(block.indptr))
+        tokens[rows, block.indices] = format_sparse_values(block.data, decimals, integral)
+        tokens[:, -1] = np.arange(start + offset, start + offset + block.shape[0]).astype(str)
+        for row in tokens.tolist():
+            f.write(' '.join(row))
+            f.write(IN_LINE_TERMINATOR)
+    return start + X.shape[0]
+
+
+def format_ghsom_input_vector(name, file, index, label, subnum, df=None, decimals=None, keep=None):
     """
     name : dataset name (string)
     file : application folder name (data-t1-t2)
     index : user-provided index column (string or None)
     label : user-provided label column (string or None)
     subnum : subsample number (int or None)
+    df : already-loaded raw-data DataFrame (in-process pipeline); None → read CSV
+    decimals : round the .in vectors to this many decimals; None → full precision (pandas default)
+    keep : rows to train on (e.g. a density-aware sketch); overrides the uniform subnum sample
     """
 
     print(subnum)
@@ -16,7 +83,8 @@ def format_ghsom_input_vector(name, file, index, label, subnum):
     # ============================
     # 讀 raw-data（新版）
     # ============================
-    df = pd.read_csv(f'./raw-data/{name}.csv', encoding='utf-8')
+    if df is None:
+        df = pd.read_csv(f'./raw-data/{name}.csv', encoding='utf-8')
 
     # ============================
     # 補 NA → 0（保持舊版邏輯）
@@ -26,8 +94,15 @@ def format_ghsom_input_vector(name, file, index, label, subnum):
     # ============================
     # Subsample（舊版一致）
     # ============================
-    if subnum is not None:
+    if keep is None:
+        subnum = clamp_subnum(len(df), subnum)
+    if keep is not None:
+        df = df.iloc[keep]
+    elif subnum is not None:
         df = df.sample(n=subnum)
+    # vector name k → raw-data 第幾列（label stage 對應回原本的 cell）
+    sampled = keep is not None or subnum is not None
+    save_kept_rows(kept_rows_path(name, file), df.index.to_numpy() if sampled else None)
 
     # ============================
     # 處理 index（使用者有填才 drop）
@@ -48,51 +123,193 @@ def format_ghsom_input_vector(name, file, index, label, subnum):
     # ============================
     rows_amount = df.shape[0]
     columns_amount = df.shape[1]
-    df[index] = range(0,rows_amount)
 
     print('rows=', rows_amount)
     print('columns=', columns_amount)
 
     # ============================
-    # 寫出 GHSOM input CSV（完全照舊版）
+    # 寫出 .in 檔（單次串流，不再經過 _ghsom.csv）
     # ============================
-    ghsom_csv_path = f'./applications/{file}/GHSOM/data/{name}_ghsom.csv'
-    df.to_csv(ghsom_csv_path, sep=' ', index=False, header=False)
+    ghsom_in_path = f'./applications/{file}/GHSOM/data/{name}_ghsom.in'
 
-    # ============================
-    # 寫出 .in 檔（完全照舊版）
-    # ============================
+    with open(ghsom_in_path, 'w', newline='', encoding='utf-8') as f:
+        write_in_header(f, rows_amount, columns_amount)
+        write_in_vectors(f, df, decimals=decimals)
+
+    print("[OK] GHSOM input formatting completed (final version).")
+
+
+# ============================================================
+# ⭐ Out-of-core 版本：raw-data 分塊（CSV chunk 或 columnar store block）→ 直接寫 .in
+# ============================================================
+def clamp_subnum(total_rows, subnum):
+    """
+    subnum ≥ 總列數 → None（全部列都拿來訓練，印 warning）；memory / chunked / columnar 結果一致
+    """
+    if subnum is not None and subnum >= total_rows:
+        print(f"[WARNING] subnum = {subnum} ≥ {total_rows} rows; training on all rows.")
+        return None
+    return subnum
+
+
+def subsample_rows(total_rows, subnum):
+    """
+    subnum：先決定要留哪些列（依原始順序，sorted），分塊時再挑出來；None → 全部
+    """
+    subnum = clamp_subnum(total_rows, subnum)
+    if subnum is None:
+        return None
+    return np.sort(np.random.default_rng().choice(total_rows, subnum, replace=False))
+
+
+def resolve_kept_rows(name, file, total_rows, subnum, keep=None):
+    """
+    keep（例如 sketching.geometric_sketch 的結果）優先，否則依 subnum 均勻抽樣；
+    結果記錄到 <name>_ghsom_rows.npy（沒抽樣 → 刪掉舊紀錄）
+    """
+    if keep is None:
+        keep = subsample_rows(total_rows, subnum)
+    save_kept_rows(kept_rows_path(name, file), keep)
+    return keep
+
+
+def write_in_file_from_blocks(ghsom_in_path, blocks, x_dim, vec_dim, keep=None, decimals=None):
+    """
+    blocks : 依序產生只含 feature 欄位、已補 NA 的 DataFrame
+    x_dim  : 預估的 vector 數；與實際寫出的不同（例如檔尾空行）→ 修正 $XDIM
+    """
+    written = 0
+    row_start = 0
+    with open(ghsom_in_path, 'w', newline='', encoding='utf-8') as f:
+        write_in_header(f, x_dim, vec_dim)
+
+        for block in blocks:
+            row_stop = row_start + len(block)
+            if keep is not None:
+                lo, hi = np.searchsorted(keep, [row_start, row_stop])
+                block = block.iloc[keep[lo:hi] - row_start]
+            written = write_in_vectors(f, block, start=written, decimals=decimals)
+            row_start = row_stop
+
+    if written != x_dim:
+        print(f"[WARNING] Expected {x_dim} vectors but wrote {written}, rewriting $XDIM.")
+        _rewrite_in_xdim(ghsom_in_path, written)
+    return written
+
+
+def format_ghsom_input_vector_chunked(name, file, index, label, subnum,
+                                      memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, decimals=None, keep=None):
+    """
+    與 format_ghsom_input_vector 相同的 .in（fillna(0)、drop index / label、subnum 抽樣），
+    但不把整份 raw-data 載入記憶體：峰值由 memory_budget_mb 決定，與資料大小無關。
+    marker 欄位以 float32 parse（整數欄位會寫成 1.0 而非 1，somtoolbox 讀起來一樣）。
+    """
+    raw_path = f'./raw-data/{name}.csv'
     ghsom_in_path = f'./applications/{file}/GHSOM/data/{name}_ghsom.in'
 
-    data_type = 'inputvec'
-    x_dim = rows_amount
-    y_dim = 1
-    vec_dim = columns_amount
+    columns = read_header(raw_path)
+    features = [c for c in columns if c not in (index, label)]
+    total_rows = count_csv_rows(raw_path)
+    keep = resolve_kept_rows(name, file, total_rows, subnum, keep)
+    x_dim = total_rows if keep is None else len(keep)
 
-    with open(ghsom_in_path, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.writer(csvfile)
+    print('rows=', x_dim)
+    print('columns=', len(features))
+    print(f"[INFO] Chunked ingestion: {chunk_rows_for_budget(len(columns), memory_budget_mb)} rows "
+          f"per chunk (budget {memory_budget_mb} MB)")
 
-        writer.writerow([f'$TYPE {data_type}'])
-        writer.writerow([f'$XDIM {x_dim}'])
-        writer.writerow([f'$YDIM {y_dim}'])
-        writer.writerow([f'$VECDIM {vec_dim}'])
+    blocks = (chunk[features] for chunk in iter_raw_chunks(raw_path, index, label, memory_budget_mb))
+    write_in_file_from_blocks(ghsom_in_path, blocks, x_dim, len(features), keep, decimals)
 
-        with open(ghsom_csv_path, 'r', newline='', encoding='utf-8') as rawfile:
-            rows = csv.reader(rawfile)
-            writer.writerow([])
+    print("[OK] GHSOM input formatting completed (chunked).")
 
-            for row in rows:
-                writer.writerow(row)
-        
 
-    print("[OK] GHSOM input formatting completed (final version).")
+def format_ghsom_input_vector_from_store(name, file, index, label, subnum, store,
+                                         memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, decimals=None,
+                                         keep=None):
+    """
+    從 columnar store（programs/data_processing/columnar_store.py）memory-map 需要的欄位寫 .in：
+    不 parse CSV，欄位型別與 pd.read_csv 相同 → 輸出與 format_ghsom_input_vector 逐 byte 相同
+    """
+    ghsom_in_path = f'./applications/{file}/GHSOM/data/{name}_ghsom.in'
 
+    sparse_features = read_sparse_features(store)
+    if sparse_features is not None:
+        X, names = sparse_features
+        keep = resolve_kept_rows(name, file, X.shape[0], subnum, keep)
+        format_ghsom_input_vector_sparse(ghsom_in_path, X, names, keep=keep,
+                                         memory_budget_mb=memory_budget_mb, decimals=decimals)
+        return
 
+    features = [spec for spec in store["columns"] if spec["name"] not in (index, label)]
+    text_columns = [spec["name"] for spec in features if spec["kind"] == "categorical"]
+    if text_columns:
+        raise ValueError(f"Non-numeric feature columns cannot be used for GHSOM: {text_columns}")
 
+    names = [spec["name"] for spec in features]
+    keep = resolve_kept_rows(name, file, store["rows"], subnum, keep)
+    x_dim = store["rows"] if keep is None else len(keep)
 
+    print('rows=', x_dim)
+    print('columns=', len(names))
+
+    block_rows = chunk_rows_for_budget(len(names), memory_budget_mb)
+    blocks = (block.fillna(0) for block in iter_column_blocks(store, names, block_rows))
+    write_in_file_from_blocks(ghsom_in_path, blocks, x_dim, len(names), keep, decimals)
+
+    print("[OK] GHSOM input formatting completed (columnar store).")
+
+
+def format_ghsom_input_vector_sparse(ghsom_in_path, X, names, keep=None,
+                                     memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, decimals=None):
+    """
+    sparse store（h5ad 的 CSR X）→ .in：只有 gene matrix，Event / label 本來就不在 X 裡
+    keep : 要寫出的列（None → 全部）
+    每塊的文字 token 是 rows × genes → 塊大小依 memory_budget_mb 決定
+    """
+    if keep is not None:
+        X = X[keep]
+
+    print('rows=', X.shape[0])
+    print('columns=', len(names))
+
+    with open(ghsom_in_path, 'w', newline='', encoding='utf-8') as f:
+        write_in_header(f, X.shape[0], X.shape[1])
+        write_in_vectors_sparse(f, X, decimals=decimals,
+                                chunk_rows=chunk_rows_for_budget(X.shape[1], memory_budget_mb))
+
+    print("[OK] GHSOM input formatting completed (sparse).")
+
+
+def format_ghsom_input_vector_reduced(name, file, projected_path, subnum=None, decimals=None, keep=None):
+    """
+    PCA 降維後的 vectors（programs/data_processing/pca_reduction.py 的 .npy）→ .in
+    """
+    ghsom_in_path = f'./applications/{file}/GHSOM/data/{name}_ghsom.in'
 
+    projected = np.load(projected_path, mmap_mode='r')
+    keep = resolve_kept_rows(name, file, projected.shape[0], subnum, keep)
+    x_dim = projected.shape[0] if keep is None else len(keep)
 
+    print('rows=', x_dim)
+    print('columns=', projected.shape[1])
 
+    blocks = (pd.DataFrame(projected[start:start + IN_CHUNK_ROWS])
+              for start in range(0, projected.shape[0], IN_CHUNK_ROWS))
+    write_in_file_from_blocks(ghsom_in_path, blocks, x_dim, projected.shape[1], keep, decimals)
 
+    print("[OK] GHSOM input formatting completed (PCA reduced).")
 
 
+def _rewrite_in_xdim(path, x_dim):
+    tmp_path = path + '.tmp'
+    with open(path, 'r', newline='', encoding='utf-8') as src, \
+            open(tmp_path, 'w', newline='', encoding='utf-8') as dst:
+        for line in src:
+            if line.startswith('$XDIM '):
+                line = f'$XDIM {x_dim}{IN_LINE_TERMINATOR}'
+                dst.write(line)
+                break
+            dst.write(line)
+        shutil.copyfileobj(src, dst, COPY_BLOCK_SIZE)
+    os.replace(tmp_path, path)
@@ -5,43 +5,43 @@ from pandas import ExcelWriter
 #from pymongo import MongoClient
 import argparse
 import os
+from ghsom_output import UNIT_SUFFIX, list_map_names, read_unit_header
 
 def layers(name):
     # init an array to store every layers 
     layer = []
     max_layer = 1
 
-    # list all files in /output folder
-    for file in os.listdir('./applications/%s/GHSOM/output/%s' % (name,name)):
-        # get all .unit files in /output folder
-        if file.endswith('.unit'):
-            
-            # get file path
-            unit_file_path = os.path.join('./applications/%s/GHSOM/output/%s' % (name,name), file)
-            print(unit_file_path)
-
-            # get attr from content
-            text_file = open(unit_file_path).read().split()
-
-            # get each layer dimension info
-            x_dim = int(text_file[text_file.index('$XDIM')+1])
-            y_dim = int(text_file[text_file.index('$YDIM')+1])
-            # print('$XDIM:',text_file[text_file.index('$XDIM')+1])
-            # print('$YDIM:',text_file[text_file.index('$YDIM')+1])
-
-            # first layer
-            if 'lvl' not in file:
+    # list all maps in /output folder（.unit.gz 直接讀，不需要先解壓）
+    # 名稱排序 → 第一層在前，接著 lvl2、lvl3 ...
+    output_dir = './applications/%s/GHSOM/output/%s' % (name,name)
+    for map_name in list_map_names(output_dir):
+        file = map_name + UNIT_SUFFIX
+
+        # get file path
+        unit_file_path = os.path.join(output_dir, file)
+        print(unit_file_path)
+
+        # get attr from header（讀到第一個 unit 就停，不讀 mapped vectors）
+        header = read_unit_header(unit_file_path)
+
+        # get each layer dimension info
+        x_dim = int(header['$XDIM'])
+        y_dim = int(header['$YDIM'])
+
+        # first layer
+        if 'lvl' not in file:
+            layer.append(x_dim*y_dim)
+        # other layers
+        else:
+            file_lvls = file.split('lvl')[1]
+            layer_index = int(file_lvls.split('_')[0])
+            max_layer = layer_index if max_layer < layer_index else max_layer
+            if len(layer) != layer_index:
                 layer.append(x_dim*y_dim)
-            # other layers
             else:
-                file_lvls = file.split('lvl')[1]
-                layer_index = int(file_lvls.split('_')[0])
-                max_layer = layer_index if max_layer < layer_index else max_layer
-                if len(layer) != layer_index:
-                    layer.append(x_dim*y_dim)
-                else:
-                    if (x_dim*y_dim) > layer[layer_index-1]:
-                        layer[layer_index-1] = x_dim*y_dim
+                if (x_dim*y_dim) > layer[layer_index-1]:
+                    layer[layer_index-1] = x_dim*y_dim
 
     print('layer:',layer)
     print('max_layer:',max_layer)
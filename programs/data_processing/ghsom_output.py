@@ -0,0 +1,119 @@
+import os
+import gzip
+import numpy as np
+
+
+# ============================================================
+# ⭐ 直接讀 GHSOM 輸出的 .gz（不再用 7z 解壓）
+# ============================================================
+# somtoolbox / numpy 引擎輸出 <map>.unit.gz / .wgt.gz；以前 extract stage 用 7z 解壓一份，
+# 每個 job 資料夾同時有壓縮與未壓縮的檔案。現在讀的人直接串流 .gz：
+#   ghsom_output_path(base) : <base>.gz 存在就用它，否則 <base>（舊 job 已解壓的檔案）
+#   open_ghsom_output(base) : 文字模式開啟（gzip 或一般檔案）
+#   list_map_names(dir)     : 資料夾中所有 map 的名稱（.unit / .unit.gz 去掉副檔名）
+#   read_unit_header / read_unit_file : .unit 的 streaming parser（見下方）
+# （不 import programs.*：label script 以 script 執行時也要能讀）
+GZIP_SUFFIX = ".gz"
+UNIT_SUFFIX = ".unit"
+
+
+def ghsom_output_path(base):
+    """
+    base : 不含 .gz 的路徑，例如 <output_dir>/<map>.unit
+    """
+    return base + GZIP_SUFFIX if os.path.exists(base + GZIP_SUFFIX) else base
+
+
+def open_ghsom_output(base):
+    path = ghsom_output_path(base)
+    if path.endswith(GZIP_SUFFIX):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def read_ghsom_output(base):
+    with open_ghsom_output(base) as f:
+        return f.read()
+
+
+def list_map_names(output_dir):
+    names = set()
+    for file in os.listdir(output_dir):
+        if file.endswith(GZIP_SUFFIX):
+            file = file[:-len(GZIP_SUFFIX)]
+        if file.endswith(UNIT_SUFFIX):
+            names.add(file[:-len(UNIT_SUFFIX)])
+    return sorted(names)
+
+
+# ============================================================
+# ⭐ SOMLib .unit 的 streaming parser
+# ============================================================
+# 以前每個讀 .unit 的地方都 read().split() 整個檔案，再用 list.index 找 $XDIM / $POS_X ...：
+#   - get_ghsom_dim 只要 $XDIM / $YDIM，卻讀完整個檔案（每個 mapped vector 一行，1 MB 以上）
+#   - format_cluster_info_to_dict 每個 unit 切一段 token list、反覆 .index / in
+# 這裡一行一行讀（.unit.gz 直接串流），只走一次：
+#   read_unit_header(base) : 讀到第一個 $POS_X 就停 → { "$XDIM": "2", "$YDIM": "2", ... }
+#   read_unit_file(base)   : (header, 依檔案順序的 unit list)；每個 unit：
+#       { "x", "y"（int）, "unit_id", "mapped"（$MAPPED_VECS 的 vector name，int64 array）,
+#         "child"（$URL_MAPPED_SOMS 的子 map 名稱，沒有 → None） }
+UNIT_START = "$POS_X"
+MAPPED_VECS = "$MAPPED_VECS"
+URL_MAPPED_SOMS = "$URL_MAPPED_SOMS"
+
+
+def read_unit_header(base):
+    """
+    base : 不含 .gz 的 .unit 路徑；回傳 header 的 { "$KEY": 第一個值 }（只讀到第一個 unit 之前）
+    """
+    header = {}
+    with open_ghsom_output(base) as f:
+        for line in f:
+            tokens = line.split()
+            if not tokens or not tokens[0].startswith("$"):
+                continue
+            if tokens[0] == UNIT_START:
+                break
+            if len(tokens) > 1:
+                header[tokens[0]] = tokens[1]
+    return header
+
+
+def _close_unit(unit):
+    # $MAPPED_VECS 的資料行 → vector name（int64，與 np.array(group_data_index, dtype='int64') 相同）
+    unit["mapped"] = np.array("".join(unit["mapped"]).split(), dtype="int64")
+    return unit
+
+
+def read_unit_file(base):
+    header, units = {}, []
+    unit, block = None, None
+    with open_ghsom_output(base) as f:
+        for line in f:
+            if not line.startswith("$"):
+                # $MAPPED_VECS 的資料行先原樣收集，unit 結束時一次轉成 int64；
+                # $MAPPED_VECS_DIST 的距離沒有人用 → block 是 None，略過
+                if block is not None:
+                    block.append(line)
+                continue
+            block = None
+            tokens = line.split()
+            key, values = tokens[0], tokens[1:]
+            if key == UNIT_START:
+                if unit is not None:
+                    units.append(_close_unit(unit))
+                unit = {"x": int(values[0]), "y": None, "unit_id": None, "mapped": [], "child": None}
+            elif unit is None:
+                if values:
+                    header[key] = values[0]
+            elif key == "$POS_Y":
+                unit["y"] = int(values[0])
+            elif key == "$UNIT_ID":
+                unit["unit_id"] = values[0] if values else None
+            elif key == MAPPED_VECS:
+                block = unit["mapped"]
+            elif key == URL_MAPPED_SOMS and values:
+                unit["child"] = values[0]
+    if unit is not None:
+        units.append(_close_unit(unit))
+    return header, units
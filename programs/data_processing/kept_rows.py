@@ -0,0 +1,34 @@
+import os
+import numpy as np
+
+
+# ============================================================
+# ⭐ 抽樣訓練時 .in vector → raw-data 列的對應
+# ============================================================
+# subnum（uniform / sketch）只把部分 cell 寫進 .in，vector name 是 0..subnum-1；
+# GHSOM/data/<name>_ghsom_rows.npy 記錄第 k 個 vector 是 raw-data 的第幾列，
+# save_cluster_with_clustered_label 依此把 cluster 標回原本的 cell。
+# （不 import programs.*：label script 以 script 執行時也要能讀）
+KEPT_ROWS_SUFFIX = "_ghsom_rows.npy"
+
+
+def kept_rows_path(name, file):
+    """
+    .in 有抽樣時記錄每個 vector 對應 raw-data 的哪一列（vector name k → 第 keep[k] 列）
+    """
+    return f'./applications/{file}/GHSOM/data/{name}{KEPT_ROWS_SUFFIX}'
+
+
+def save_kept_rows(path, keep):
+    """
+    keep=None（沒有抽樣）→ 刪掉舊的紀錄，label stage 才不會拿去對應
+    """
+    if keep is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    np.save(path, np.asarray(keep, dtype=np.int64))
+
+
+def load_kept_rows(path):
+    return np.load(path) if os.path.exists(path) else None
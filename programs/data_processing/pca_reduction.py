@@ -0,0 +1,131 @@
+import os
+import uuid
+import numpy as np
+from numpy.lib.format import open_memmap
+from scipy import sparse
+from sklearn.decomposition import PCA, TruncatedSVD
+from programs.pipeline.result_cache import CACHE_DIR, job_fingerprint
+
+
+# ============================================================
+# ⭐ Randomized PCA 降維（GHSOM 訓練前的 optional stage）
+# ============================================================
+# 高維 input（幾百個 marker / 幾千個 gene）會讓 somtoolbox 與 CH / DB 都很慢：
+#   1. 隨機抽 REDUCTION_SAMPLE_ROWS 列 fit randomized PCA（sparse → TruncatedSVD，不置中才不會變 dense）
+#   2. 全部 cell 分塊投影到 n_components 維，存成 float32 .npy
+#   3. .in 與 CH / DB 用降維後的 vectors；label / feature map 仍用原始 marker
+#
+# 結果以 dataset fingerprint（raw-data sha256 + 降維參數）cache 在 web/cache/reductions/：
+#   <fingerprint>.npz            : components / mean / explained_variance_ratio / feature names
+#   <fingerprint>_projected.npy  : n × n_components 的投影結果
+# 同一份上傳跑 tau grid 時只 fit / 投影一次。
+REDUCTION_DIR = os.path.join(CACHE_DIR, "reductions")
+REDUCTION_SAMPLE_ROWS = 100_000
+REDUCTION_SEED = 7
+
+
+def reduction_fingerprint(data_hash, params):
+    return job_fingerprint(data_hash, dict(params, stage="reduce"))
+
+
+def reduction_paths(fingerprint, reduction_dir=REDUCTION_DIR):
+    return {
+        "model": os.path.join(reduction_dir, f"{fingerprint}.npz"),
+        "projected": os.path.join(reduction_dir, f"{fingerprint}_projected.npy"),
+    }
+
+
+def sample_indices(n_rows, sample_rows=REDUCTION_SAMPLE_ROWS, seed=REDUCTION_SEED):
+    if n_rows <= sample_rows:
+        return np.arange(n_rows)
+    return np.sort(np.random.default_rng(seed).choice(n_rows, sample_rows, replace=False))
+
+
+def collect_rows(blocks, keep):
+    """
+    blocks : 依序產生的 feature block（DataFrame / ndarray / csr_matrix）
+    keep   : 要留下的列（sorted）→ 疊成一個 sample matrix
+    """
+    parts = []
+    row_start = 0
+    for block in blocks:
+        row_stop = row_start + block.shape[0]
+        lo, hi = np.searchsorted(keep, [row_start, row_stop])
+        if hi > lo:
+            rows = keep[lo:hi] - row_start
+            parts.append(block[rows] if sparse.issparse(block) else np.asarray(block)[rows])
+        row_start = row_stop
+    if parts and sparse.issparse(parts[0]):
+        return sparse.vstack(parts, format="csr")
+    return np.vstack(parts)
+
+
+def fit_reduction(sample, n_components, seed=REDUCTION_SEED):
+    n_components = min(n_components, sample.shape[1] - 1, sample.shape[0] - 1)
+    if n_components < 1:
+        raise ValueError(f"Cannot reduce a {sample.shape[0]} x {sample.shape[1]} sample with PCA")
+
+    if sparse.issparse(sample):
+        model = TruncatedSVD(n_components, algorithm="randomized", random_state=seed).fit(sample)
+        mean = np.zeros(sample.shape[1])
+    else:
+        model = PCA(n_components, svd_solver="randomized", random_state=seed).fit(sample)
+        mean = model.mean_
+    return {
+        "components": model.components_,
+        "mean": mean,
+        "explained_variance_ratio": model.explained_variance_ratio_,
+    }
+
+
+def project_block(block, reduction):
+    if sparse.issparse(block):
+        # TruncatedSVD 沒有置中（mean = 0），直接 sparse @ dense
+        projected = block @ reduction["components"].T
+    else:
+        projected = (np.asarray(block, dtype=np.float64) - reduction["mean"]) @ reduction["components"].T
+    return np.asarray(projected, dtype=np.float32)
+
+
+def save_reduction(path, reduction, names):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp.npz"
+    np.savez(tmp_path, names=np.asarray(names, dtype=str), **reduction)
+    os.replace(tmp_path, path)
+
+
+def load_reduction(path):
+    with np.load(path, allow_pickle=False) as z:
+        reduction = {key: z[key] for key in ("components", "mean", "explained_variance_ratio")}
+        names = z["names"].tolist()
+    return reduction, names
+
+
+def project_to_file(path, blocks, n_rows, reduction):
+    """
+    分塊投影 → float32 .npy（先寫暫存檔，完成才換上）
+    n_rows : 預估列數（只能多不能少，例如 CSV 的換行數）；實際較少 → 截短
+    回傳實際列數
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # 同一份資料的兩個 job 可能同時在算（web worker 的 DAG scheduler）→ 暫存檔名不能撞
+    tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp.npy"
+    out = open_memmap(tmp_path, mode="w+", dtype=np.float32,
+                      shape=(n_rows, reduction["components"].shape[0]))
+    row = 0
+    for block in blocks:
+        if row + block.shape[0] > n_rows:
+            raise ValueError(f"More than the expected {n_rows} rows to project")
+        out[row:row + block.shape[0]] = project_block(block, reduction)
+        row += block.shape[0]
+    out.flush()
+
+    if row != n_rows:
+        short_path = tmp_path[:-len(".tmp.npy")] + ".short.npy"
+        np.save(short_path, out[:row])
+        del out
+        os.replace(short_path, tmp_path)
+    else:
+        del out
+    os.replace(tmp_path, path)
+    return row
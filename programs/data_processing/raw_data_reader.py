@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+
+
+# ============================================================
+# ⭐ Out-of-core raw-data 讀取（分塊 + float32）
+# ============================================================
+# 5M cells 的上傳檔用 pd.read_csv 一次讀完（float64）worker 會先 OOM。
+# 這裡依 memory budget 決定每塊列數，marker 欄位直接 parse 成 float32，
+# 每塊只在記憶體停留一次（format .in 時寫完就丟）。
+DEFAULT_MEMORY_BUDGET_MB = 512
+# 每個數值在一塊中大約佔用的 bytes：
+# CSV tokenizer buffer + float64 parse 結果 + float32 欄位 + to_csv 文字緩衝
+BYTES_PER_VALUE = 48
+MIN_CHUNK_ROWS = 1_000
+COUNT_BLOCK_SIZE = 1 << 20
+
+
+def read_header(path):
+    return list(pd.read_csv(path, nrows=0, encoding='utf-8').columns)
+
+
+def marker_columns(columns, index=None, label=None):
+    return [c for c in columns if c != index and c != label]
+
+
+def chunk_rows_for_budget(n_columns, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB):
+    budget_bytes = memory_budget_mb * 1024 * 1024
+    return max(MIN_CHUNK_ROWS, int(budget_bytes // (max(1, n_columns) * BYTES_PER_VALUE)))
+
+
+def count_csv_rows(path):
+    """
+    資料列數（不含 header）：只數換行，不 parse
+    結尾的空行 pandas 會略過，這裡不會 → 呼叫端要以實際讀到的列數為準
+    """
+    lines = 0
+    last = b"\n"
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(COUNT_BLOCK_SIZE), b""):
+            lines += block.count(b"\n")
+            last = block[-1:]
+    if last != b"\n":
+        lines += 1
+    return max(0, lines - 1)
+
+
+def float32_dtypes(path, index=None, label=None):
+    """
+    marker 欄位一律 float32（index / label 保留 pandas 推斷的型別）
+    所有 chunk 的 dtype 一致，不會因為某塊剛好全是整數而寫出不同格式
+    """
+    return {col: np.float32 for col in marker_columns(read_header(path), index, label)}
+
+
+def iter_raw_chunks(path, index=None, label=None, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB,
+                    usecols=None, fill_na=True):
+    """
+    逐塊讀 raw-data：marker 欄位 float32、fill_na → NA 補 0（與 format_ghsom_input_vector 相同）
+    """
+    columns = read_header(path)
+    if usecols is not None:
+        columns = [c for c in columns if c in usecols]
+    dtypes = {col: np.float32 for col in marker_columns(columns, index, label)}
+    chunk_rows = chunk_rows_for_budget(len(columns), memory_budget_mb)
+
+    for chunk in pd.read_csv(path, encoding='utf-8', usecols=usecols, dtype=dtypes,
+                             chunksize=chunk_rows):
+        yield chunk.fillna(0) if fill_na else chunk
+
+
+def read_raw_float32(path, index=None, label=None, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB):
+    """
+    整份 raw-data（label / evaluation stage 用），分塊 parse 後 concat：
+    峰值約為 float32 結果 + 一塊的 parse 緩衝，不再是整份 float64 + tokenizer
+    NA 保留（與 pd.read_csv 相同），由各 stage 自己處理
+    """
+    chunks = list(iter_raw_chunks(path, index, label, memory_budget_mb, fill_na=False))
+    if not chunks:
+        return pd.read_csv(path, encoding='utf-8', dtype=float32_dtypes(path, index, label))
+    return pd.concat(chunks, ignore_index=True, copy=False)
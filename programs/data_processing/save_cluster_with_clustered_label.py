@@ -4,54 +4,26 @@ from pandas import ExcelWriter
 from fractions import Fraction
 #import pymongo
 import argparse
-import get_ghsom_dim
-
-parser = argparse.ArgumentParser(description='manual to this script')
-parser.add_argument('--name', type=str, default=None)
-parser.add_argument('--tau1', type=float, default=0.1)
-parser.add_argument('--tau2', type=float, default=0.01)
-parser.add_argument('--index', type=str, default=None)
-
-args = parser.parse_args()
-
-prefix = args.name
-t1 = args.tau1
-t2 = args.tau2
-index = args.index
-file = f'{prefix}-{t1}-{t2}'
-
-layers, max_layer, number_of_digits = get_ghsom_dim.layers(file)
-df_source = pd.read_csv('./raw-data/%s.csv' % prefix, encoding='utf-8')
-
-median = df_source.iloc[:, 1:].median(axis=1)
-mean = df_source.iloc[:, 1:].mean(axis=1)
-
-df_source['mean'] = mean
-df_source['median'] = median
-df_source['clustered_label'] = np.nan
-df_source['x_y_label'] = np.nan
-for i in range(1, max_layer + 1):
-    df_source['clusterL' + str(i)] = np.nan
+import os
+import sys
 
-def get_cluster_flag(text_file):
-    get_cluster_flag = [i for i, x in enumerate(text_file) if x == '$POS_X']
-    get_cluster_flag.append(len(text_file) + 1)
-    return get_cluster_flag
+# 讓 execute.py 以 package 方式 import 時也找得到 get_ghsom_dim
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+import get_ghsom_dim
+from ghsom_output import read_unit_file
+from sparse_features import FEATURES_SUFFIX, sparse_row_mean_median, save_sparse_features
+from kept_rows import kept_rows_path, load_kept_rows
 
-def format_cluster_info_to_dict(unit_file_name, source_data, saved_data_type=None, structure_type=None, parent_name=None, parent_file_position=None, parent_clustered_string=None, x_y_clustered_string=None):
+def format_cluster_info_to_dict(unit_file_name, source_data, saved_data_type=None, structure_type=None, parent_name=None, parent_file_position=None, parent_clustered_string=None, x_y_clustered_string=None, file=None, number_of_digits=None):
     Groups_info = []
+    df_source = source_data
     unit_file_path = ('./applications/%s/GHSOM/output/%s/' % (file, file)) + unit_file_name + '.unit'
     print(unit_file_path)
-    text_file = open(unit_file_path).read().split()
-    flag = get_cluster_flag(text_file)
-
-    if 'lvl' in unit_file_name:
-        layer_index = int(unit_file_name.split('lvl')[1][0])
-    else:
-        layer_index = 1
+    # 一次讀完 header 與每個 unit（programs/data_processing/ghsom_output.py）
+    header, units = read_unit_file(unit_file_path)
 
-    XDIM = text_file[text_file.index('$XDIM') + 1]
-    YDIM = text_file[text_file.index('$YDIM') + 1]
+    XDIM = header['$XDIM']
+    YDIM = header['$YDIM']
     map_size = int(XDIM) * int(YDIM)
 
     if parent_name is None:
@@ -65,46 +37,27 @@ def format_cluster_info_to_dict(unit_file_name, source_data, saved_data_type=Non
     if parent_clustered_string is None:
         parent_clustered_string = ''
 
-    for i, map_index in zip(range(len(flag) - 1), range(map_size)):
-        start_index = flag[i]
-        end_index = flag[i + 1]
-        currentSection = text_file[flag[i]:flag[i + 1]]
-
-        x_position = currentSection[currentSection.index('$POS_X') + 1]
-        y_position = currentSection[currentSection.index('$POS_Y') + 1]
+    for unit in units[:map_size]:
+        x_position = str(unit['x'])
+        y_position = str(unit['y'])
 
         group_position = x_position + y_position
 
-        group_data_index = currentSection[currentSection.index(
-            '$MAPPED_VECS') + 1:currentSection.index('$MAPPED_VECS_DIST')] if '$MAPPED_VECS' in currentSection else []
-
-        sub_map_file_name = currentSection[currentSection.index(
-            '$URL_MAPPED_SOMS') + 1] if '$URL_MAPPED_SOMS' in currentSection else 'None'
+        # $MAPPED_VECS 的 vector name（int64 array）
+        group_data_index = unit['mapped']
+        index = group_data_index
 
-        map_index_int = map_index + 1
-
-        digit = 1
-        while True:
-            if (map_index_int // 10) != 0:
-                digit += 1
-                map_index_int = map_index_int // 10
-            else:
-                break
-
-        zero = ''
-        for i in range(number_of_digits[layer_index - 1] - digit):
-            zero += '0'
+        sub_map_file_name = unit['child'] if unit['child'] is not None else 'None'
 
         cluster_string = str(parent_clustered_string) + str(XDIM) + ';' + str(YDIM) + ';' + x_position + ';' + y_position + ';'
         x_y_string = str(x_y_clustered_string) + '-' + x_position + 'x' + y_position
 
-        index = np.array(group_data_index, dtype='int64')
         current_group_source = df_source.iloc[index, :]
 
         current_group_statistic_info = current_group_source.describe().to_dict()
 
         if sub_map_file_name != 'None':
-            format_cluster_info_to_dict(sub_map_file_name, source_data, saved_data_type, structure_type, unit_file_name, group_position, cluster_string, x_y_string)
+            format_cluster_info_to_dict(sub_map_file_name, source_data, saved_data_type, structure_type, unit_file_name, group_position, cluster_string, x_y_string, file, number_of_digits)
             leaf_node = 0
         else:
             leaf_node = 1
@@ -132,7 +85,7 @@ def format_cluster_info_to_dict(unit_file_name, source_data, saved_data_type=Non
                 'parent': parent_name
             }
             if sub_map_file_name != 'None':
-                sub_map_info = format_cluster_info_to_dict(sub_map_file_name, source_data, saved_data_type, structure_type, unit_file_name, group_position, cluster_string, x_y_string)
+                sub_map_info = format_cluster_info_to_dict(sub_map_file_name, source_data, saved_data_type, structure_type, unit_file_name, group_position, cluster_string, x_y_string, file, number_of_digits)
                 leaf_node = 0
 
         elif str(saved_data_type) == 'result_detail':
@@ -170,15 +123,73 @@ def GHSOM_center_point(data_list):
 
     return [Px, Py]
 
-saved_file_type = 'result_detail'
-result = format_cluster_info_to_dict(prefix, df_source, saved_file_type, 'flat')
-
-result_frame = pd.DataFrame(result)
-
-df_source.to_csv('./applications/%s/data/%s_with_clustered_label-%s-%s.csv' % (file, prefix, t1, t2), index=False)
-
-
-
-
-
+def save_cluster_with_clustered_label(prefix, t1, t2, index=None, df_source=None,
+                                      features=None, feature_names=None, projected=None):
+    """
+    依 GHSOM .unit 結果替每個 cell 加上 clustered_label / x_y_label / clusterL*，
+    寫出 <prefix>_with_clustered_label-<t1>-<t2>.csv 並回傳該 DataFrame。
+    df_source : 已載入的 raw-data（in-process pipeline 共用）；None → 讀 CSV
+    features / feature_names : sparse 上傳的 gene matrix（csr_matrix）；df_source 只有 Event / label，
+                               mean / median 由 CSR 計算，matrix 另存 <prefix>_features.npz 給 feature map
+    .in 有抽樣（subnum / sketch）時，.unit 的 vector name 是 GHSOM/data/<prefix>_ghsom_rows.npy 的第幾個，
+    對應回 raw-data 的列；沒被抽到的 cell 沒有 cluster（NaN）
+    projected : 沒被抽到的 cell 投影到階層的結果（programs/training/project_cells.py，index = raw-data 的列）；
+                有給 → 這些 cell 也填上 cluster 欄位
+    """
+    file = f'{prefix}-{t1}-{t2}'
+
+    layers, max_layer, number_of_digits = get_ghsom_dim.layers(file)
+    if df_source is None:
+        df_source = pd.read_csv('./raw-data/%s.csv' % prefix, encoding='utf-8')
+    else:
+        # 不改動呼叫端的 raw-data（evaluation 還要用原始欄位）
+        df_source = df_source.copy()
 
+    if features is not None:
+        mean, median = sparse_row_mean_median(features)
+        save_sparse_features('./applications/%s/data/%s%s' % (file, prefix, FEATURES_SUFFIX),
+                             features, feature_names)
+    else:
+        median = df_source.iloc[:, 1:].median(axis=1)
+        mean = df_source.iloc[:, 1:].mean(axis=1)
+
+    df_source['mean'] = mean
+    df_source['median'] = median
+    df_source['clustered_label'] = np.nan
+    df_source['x_y_label'] = np.nan
+    for i in range(1, max_layer + 1):
+        df_source['clusterL' + str(i)] = np.nan
+
+    saved_file_type = 'result_detail'
+    kept_rows = load_kept_rows(kept_rows_path(prefix, file))
+    if kept_rows is None:
+        result = format_cluster_info_to_dict(prefix, df_source, saved_file_type, 'flat', file=file, number_of_digits=number_of_digits)
+    else:
+        # 只有訓練用的列：vector name k → 第 k 列，標完再寫回原本的位置
+        df_trained = df_source.iloc[kept_rows].reset_index(drop=True)
+        result = format_cluster_info_to_dict(prefix, df_trained, saved_file_type, 'flat', file=file, number_of_digits=number_of_digits)
+        cluster_columns = [c for c in df_trained.columns
+                           if c in ('clustered_label', 'x_y_label', 'point_x', 'point_y') or c.startswith('clusterL')]
+        for col in cluster_columns:
+            values = np.full(len(df_source), np.nan, dtype=object)
+            values[kept_rows] = df_trained[col].to_numpy(dtype=object)
+            if projected is not None and col in projected.columns:
+                values[projected.index.to_numpy()] = projected[col].to_numpy(dtype=object)
+            df_source[col] = pd.Series(values, index=df_source.index).infer_objects()
+
+    result_frame = pd.DataFrame(result)
+
+    df_source.to_csv('./applications/%s/data/%s_with_clustered_label-%s-%s.csv' % (file, prefix, t1, t2), index=False)
+    return df_source
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='manual to this script')
+    parser.add_argument('--name', type=str, default=None)
+    parser.add_argument('--tau1', type=float, default=0.1)
+    parser.add_argument('--tau2', type=float, default=0.01)
+    parser.add_argument('--index', type=str, default=None)
+
+    args = parser.parse_args()
+
+    save_cluster_with_clustered_label(args.name, args.tau1, args.tau2, args.index)
@@ -5,6 +5,7 @@ from pandas import ExcelWriter
 # from pymongo import MongoClient
 import argparse
 import get_ghsom_dim
+from ghsom_output import read_ghsom_output
 print("????????????????????????")
 parser = argparse.ArgumentParser(description='manual to this script')
 parser.add_argument('--name', type=str, default = None)
@@ -32,7 +33,7 @@ def format_cluster_info_to_dict(unit_file_name, source_data, saved_data_type=Non
 
     # read .unit file as python list
     unit_file_path = ('./applications/%s/GHSOM/output/%s/' % (prefix,seq_name)) + unit_file_name + ".unit"
-    text_file = open(unit_file_path).read().split()
+    text_file = read_ghsom_output(unit_file_path).split()
     print(unit_file_path)
     # get file secation flag
     flag = get_cluster_flag(text_file)
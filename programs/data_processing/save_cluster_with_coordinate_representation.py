@@ -6,6 +6,7 @@ from pandas import ExcelWriter
 # from pymongo import MongoClient
 from fractions import Fraction
 import argparse
+from ghsom_output import read_ghsom_output
 
 parser = argparse.ArgumentParser(description='manual to this script')
 parser.add_argument('--name', type=str, default = None)
@@ -35,7 +36,7 @@ def format_cluster_info_to_dict(unit_file_name, source_data, saved_data_type, st
 
     # read .unit file as python list
     unit_file_path = './applications/%s/GHSOM/output/%s/' % (source_path, prefix) + unit_file_name + '.unit'
-    text_file = open(unit_file_path).read().split()
+    text_file = read_ghsom_output(unit_file_path).split()
     print(unit_file_path)
     # get file secation flag
     flag = get_cluster_flag(text_file)
@@ -0,0 +1,96 @@
+import numpy as np
+from programs.data_processing.pca_reduction import (
+    REDUCTION_SEED, sample_indices, collect_rows, fit_reduction, project_block
+)
+
+
+# ============================================================
+# ⭐ Density-aware sketching（取代 subnum 的 df.sample 均勻抽樣）
+# ============================================================
+# 均勻抽樣 5–10% 的 cell 時，稀有族群常常整群被抽掉。
+# 這裡用 geometric sketching（Hie et al., 2019）的 grid 版本：
+#   1. cell 投影到前 SKETCH_COMPONENTS 個 PCA 維度（抽樣 fit，分塊投影）
+#   2. 以同一個邊長把空間切成 hypercube，邊長二分搜尋到「非空的格子數 ≥ subnum」
+#   3. 每個非空格子輪流挑一個 cell（格子順序、格子內順序都隨機），挑滿 subnum 為止
+# 密集的族群與稀有族群拿到的格子數接近 → 稀有族群保留下來。
+# 全部是排序 / hash，時間約 O(n log n)，記憶體只有 n × SKETCH_COMPONENTS 的 float32。
+SAMPLING_MODES = ("uniform", "sketch")
+SKETCH_COMPONENTS = 10
+SKETCH_SEARCH_STEPS = 16
+
+
+def sketch_coordinates(blocks, n_rows, n_components=SKETCH_COMPONENTS, seed=REDUCTION_SEED):
+    """
+    blocks : callable → 依序產生 feature block（與 iter_feature_blocks 相同）
+    回傳 n_rows × k 的 float32 PCA 座標（feature 數 ≤ k → 直接用原始 feature）
+    """
+    sample = collect_rows(blocks(), sample_indices(n_rows))
+    if sample.shape[1] <= n_components:
+        reduction = None
+    else:
+        reduction = fit_reduction(sample, n_components, seed)
+    del sample
+
+    parts = []
+    for block in blocks():
+        if reduction is not None:
+            parts.append(project_block(block, reduction))
+        elif hasattr(block, "toarray"):
+            parts.append(block.toarray().astype(np.float32))
+        else:
+            parts.append(np.asarray(block, dtype=np.float32))
+    return np.vstack(parts)
+
+
+def _grid_cells(coords, side):
+    """
+    每列所在 hypercube 的 id（0..m-1）與非空格子數 m
+    格子座標以 uint64 hash 成一個數字（維度多時 bins^k 會 overflow，碰撞機率可忽略）
+    """
+    bins = np.floor(coords / side).astype(np.int64).view(np.uint64)
+    multipliers = np.random.default_rng(0).integers(1, 2 ** 63, size=coords.shape[1],
+                                                    dtype=np.uint64) | np.uint64(1)
+    with np.errstate(over="ignore"):
+        keys = (bins * multipliers).sum(axis=1, dtype=np.uint64)
+    uniques, cells = np.unique(keys, return_inverse=True)
+    return cells.ravel(), len(uniques)
+
+
+def geometric_sketch(coords, subnum, seed=REDUCTION_SEED):
+    """
+    coords : n × k 座標（sketch_coordinates 或 PCA 降維後的 vectors）
+    回傳要留下的 subnum 列（sorted）；subnum ≥ n → None（全部）
+    """
+    n_rows = coords.shape[0]
+    if subnum is None or subnum >= n_rows:
+        return None
+
+    coords = np.asarray(coords, dtype=np.float64)
+    coords = coords - coords.min(axis=0)
+    span = float(coords.max()) or 1.0
+
+    # 邊長越小，非空格子越多：找最大的邊長使格子數 ≥ subnum
+    lo, hi = 0.0, span
+    cells, _ = _grid_cells(coords, span)
+    for _ in range(SKETCH_SEARCH_STEPS):
+        side = (lo + hi) / 2
+        candidate, n_cells = _grid_cells(coords, side)
+        if n_cells >= subnum:
+            lo, cells = side, candidate
+        else:
+            hi = side
+    if lo == 0.0:
+        # 重複的點太多，怎麼切都不到 subnum 個格子 → 用目前最細的切法輪流挑
+        cells, _ = _grid_cells(coords, hi)
+
+    rng = np.random.default_rng(seed)
+    cell_priority = rng.permutation(cells.max() + 1)[cells]
+    # 格子內的名次：0 = 每個格子第一個被挑的 cell
+    order = np.lexsort((rng.random(n_rows), cells))
+    starts = np.flatnonzero(np.r_[True, cells[order][1:] != cells[order][:-1]])
+    sizes = np.diff(np.r_[starts, n_rows])
+    rank = np.empty(n_rows, dtype=np.int64)
+    rank[order] = np.arange(n_rows) - np.repeat(starts, sizes)
+
+    picked = np.lexsort((cell_priority, rank))[:subnum]
+    return np.sort(picked)
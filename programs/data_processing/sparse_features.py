@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+# ============================================================
+# ⭐ Sparse feature matrix（scRNA-seq count：95% 以上是 0）
+# ============================================================
+# h5ad 的 X 是 CSR / CSC 時整條 pipeline 都保持 CSR（scipy.sparse.csr_matrix）：
+#   columnar store 存 data / indices / indptr 三個 .npy（columnar_store.py）
+#   .in 直接由 CSR 寫出（format_ghsom_input_vector.py）
+#   row mean / median、cluster mean、CH / DB 都只看非零值，不轉成 dense
+# feature map 需要的 matrix 存在 applications/<job>/data/<job>_features.npz
+# （worker 跑完會刪 raw-data 與 store，feature map 不能再回去讀）
+FEATURES_SUFFIX = "_features.npz"
+
+
+def to_csr(data, indices, indptr, n_cols):
+    return sparse.csr_matrix((data, indices, indptr), shape=(len(indptr) - 1, n_cols))
+
+
+def save_sparse_features(path, X, names):
+    # 不壓縮：feature map 載入時不用再解壓整個 matrix
+    np.savez(path, data=X.data, indices=X.indices, indptr=X.indptr,
+             shape=np.asarray(X.shape), names=np.asarray(names, dtype=str))
+
+
+def load_sparse_features(path):
+    with np.load(path, allow_pickle=False) as z:
+        X = to_csr(z["data"], z["indices"], z["indptr"], int(z["shape"][1]))
+        names = z["names"].tolist()
+    return X, names
+
+
+def is_integral(values):
+    """
+    count matrix（全部是整數）→ 寫成 1 / 2 / 3，而不是 1.0 / 2.0 / 3.0
+    """
+    return bool(np.all(np.mod(values, 1) == 0))
+
+
+def format_sparse_values(values, decimals=None, integral=False):
+    """
+    非零值 → 字串（float32 用最短 repr，與 pandas to_csv 的輸出相同）
+    """
+    if integral:
+        return values.astype(np.int64).astype(str)
+    if decimals is not None:
+        values = np.round(values, decimals)
+    return values.astype(str)
+
+
+# ------------------------------------------------------------
+# Row 統計（save_cluster_with_clustered_label 的 mean / median 欄位）
+# ------------------------------------------------------------
+def sparse_row_mean_median(X):
+    """
+    每列的 mean / median，把沒存的 0 也算進去（與 dense 的 df.mean(axis=1) / median(axis=1) 相同）
+    median：每列的非零值排序後，依名次判斷落在負值、隱含的 0 還是正值
+    """
+    n_rows, n_cols = X.shape
+    mean = np.asarray(X.sum(axis=1)).ravel() / n_cols
+
+    nnz = np.diff(X.indptr)
+    rows = np.repeat(np.arange(n_rows), nnz)
+    values = X.data[np.lexsort((X.data, rows))]
+    negatives = np.bincount(rows[X.data < 0], minlength=n_rows)
+    zeros = n_cols - nnz
+    row_start = X.indptr[:-1]
+
+    def value_at(rank):
+        out = np.zeros(n_rows)
+        below = rank < negatives
+        out[below] = values[row_start[below] + rank]
+        above = rank >= negatives + zeros
+        out[above] = values[row_start[above] + rank - zeros[above]]
+        return out
+
+    median = (value_at((n_cols - 1) // 2) + value_at(n_cols // 2)) / 2
+    return mean, median
+
+
+# ------------------------------------------------------------
+# Cluster 統計（evaluation / feature map）
+# ------------------------------------------------------------
+def cluster_codes(labels):
+    """
+    labels → (每列的 cluster 代號 0..K-1，NA = -1, cluster 名稱)
+    """
+    return pd.factorize(np.asarray(labels))
+
+
+def cluster_indicator(labels):
+    """
+    labels → (K × n 的 0/1 sparse matrix, cluster 名稱)；NA 的列不屬於任何 cluster
+    M @ X 就是每個 cluster 的 feature 總和
+    """
+    codes, uniques = cluster_codes(labels)
+    rows = np.flatnonzero(codes >= 0)
+    M = sparse.csr_matrix((np.ones(len(rows)), (codes[rows], rows)), shape=(len(uniques), len(codes)))
+    return M, uniques
+
+
+def sparse_cluster_moments(X, labels):
+    """
+    回傳 (cluster 名稱, 每個 cluster 的列數, mean (K × d), mean of squares (K × d))
+    K × d 是 dense（cluster 數遠小於 cell 數），X 本身不轉 dense
+    """
+    M, uniques = cluster_indicator(labels)
+    counts = np.asarray(M.sum(axis=1)).ravel()
+    means = (M @ X).toarray() / counts[:, None]
+    sq_means = (M @ X.multiply(X)).toarray() / counts[:, None]
+    return uniques, counts, means, sq_means
@@ -0,0 +1,187 @@
+import csv
+import numpy as np
+import pandas as pd
+from programs.data_processing.raw_data_reader import chunk_rows_for_budget, marker_columns
+from programs.data_processing.binary_readers import EVENT_COLUMN, is_binary_upload, open_binary
+
+
+# ============================================================
+# ⭐ 上傳檔檢查（/submit 時就擋下，不進 queue）
+# ============================================================
+# 以前非數值欄位、打錯的 index / label、全是 NA 的 marker 要等到 worker 排到、
+# 跑進 somtoolbox 或 calinski_harabasz_score 才失敗，白白佔一個 worker slot。
+# 這裡分塊掃一次 raw-data（記憶體由 VALIDATION_MEMORY_BUDGET_MB 決定），每塊對所有 marker 欄位
+# 一次算完：非數值、inf、非 NA 個數、min / max。
+# 有問題 → ValueError，訊息直接顯示給使用者。
+VALIDATION_MEMORY_BUDGET_MB = 128
+MIN_ROWS = 2
+
+
+def _preview(names, limit=20):
+    return ", ".join(names[:limit]) + (" ..." if len(names) > limit else "")
+
+
+def read_csv_header(raw_path):
+    """
+    第一行的原始欄位名稱（pandas 會把重複的名稱改成 x.1，這裡要看原本的）
+    """
+    try:
+        with open(raw_path, "r", newline="", encoding="utf-8") as f:
+            header = next(csv.reader(f), None)
+    except UnicodeDecodeError:
+        raise ValueError("The CSV is not UTF-8 text.")
+    if not header or not any(name.strip() for name in header):
+        raise ValueError("The CSV is empty (no header row).")
+    return header
+
+
+def check_columns(names, index=None, label=None):
+    """
+    欄位名稱：不可重複 / 空白，index / label 要存在，至少一個 marker
+    回傳 marker 欄位
+    """
+    blank = [i + 1 for i, name in enumerate(names) if not str(name).strip()]
+    if blank:
+        raise ValueError(f"Header has empty column names at positions {blank}.")
+
+    duplicated = sorted({name for name in names if names.count(name) > 1})
+    if duplicated:
+        raise ValueError(f"Duplicate column names: {duplicated}.")
+
+    for role, name in (("Index", index), ("Label", label)):
+        if name is not None and name not in names:
+            raise ValueError(f"{role} column '{name}' not found. Columns: {_preview(names)}")
+
+    markers = marker_columns(names, index, label)
+    if not markers:
+        raise ValueError("No marker columns left after removing the index / label columns.")
+    return markers
+
+
+def _first_non_numeric(values):
+    """
+    object 欄位中第一個無法轉成數字的值 → (在這塊中的位置, 值)
+    """
+    bad = pd.to_numeric(values, errors="coerce").isna() & values.notna()
+    position = int(np.argmax(bad.to_numpy()))
+    return position, values.iloc[position]
+
+
+def new_scan(markers, first_line=2):
+    """
+    分塊檢查的累計狀態（dict）；first_line : 第一列資料在檔案中的行號（CSV 有 header → 2），錯誤訊息用
+    """
+    return {
+        "markers": list(markers),
+        "first_line": first_line,
+        "rows": 0,
+        "counts": np.zeros(len(markers), dtype=np.int64),
+        "mins": np.full(len(markers), np.nan),
+        "maxs": np.full(len(markers), np.nan),
+    }
+
+
+def scan_block(scan, block):
+    """
+    一塊 DataFrame（至少包含 markers 欄位）→ 更新 scan；非數值 / inf → ValueError
+    """
+    markers = scan["markers"]
+    block = block[markers]
+    text_columns = [c for c in markers if not pd.api.types.is_numeric_dtype(block[c])
+                    or pd.api.types.is_bool_dtype(block[c])]
+    for col in text_columns:
+        position, value = _first_non_numeric(block[col].astype(object))
+        raise ValueError(f"Column '{col}' is not numeric (line {scan['first_line'] + scan['rows'] + position}: "
+                         f"'{value}'). Set it as the index or label column, or remove it.")
+
+    values = block.to_numpy(dtype=np.float64)
+    infinite = np.isinf(values).any(axis=0)
+    if infinite.any():
+        raise ValueError(f"Infinite values in columns {[m for m, bad in zip(markers, infinite) if bad]}.")
+
+    scan["counts"] += np.count_nonzero(~np.isnan(values), axis=0)
+    if len(values):
+        scan["mins"] = np.fmin(scan["mins"], np.fmin.reduce(values, axis=0))
+        scan["maxs"] = np.fmax(scan["maxs"], np.fmax.reduce(values, axis=0))
+    scan["rows"] += len(values)
+
+
+def finish_scan(scan):
+    """
+    全部的塊都看過 → { "rows", "constant": [只有一種值的 marker] }；列數不足 / 全 NA / 全部 constant → ValueError
+    """
+    markers, rows = scan["markers"], scan["rows"]
+    if rows < MIN_ROWS:
+        raise ValueError(f"Only {rows} data rows; clustering needs at least {MIN_ROWS}.")
+
+    empty = [m for m, n in zip(markers, scan["counts"]) if n == 0]
+    if empty:
+        raise ValueError(f"Marker columns with only missing values: {_preview(empty)}.")
+
+    constant = [m for m, lo, hi in zip(markers, scan["mins"], scan["maxs"]) if lo == hi]
+    if len(constant) == len(markers):
+        raise ValueError("Every marker column is constant; there is nothing to cluster.")
+    return {"rows": rows, "constant": constant}
+
+
+def scan_marker_blocks(blocks, markers, first_line=2):
+    """
+    blocks : 依序產生 DataFrame（至少包含 markers 欄位）
+    """
+    scan = new_scan(markers, first_line)
+    for block in blocks:
+        scan_block(scan, block)
+    return finish_scan(scan)
+
+
+def validate_csv(raw_path, index=None, label=None, memory_budget_mb=VALIDATION_MEMORY_BUDGET_MB):
+    names = read_csv_header(raw_path)
+    markers = check_columns(names, index, label)
+
+    chunk_rows = chunk_rows_for_budget(len(names), memory_budget_mb)
+    try:
+        # 不用 usecols：欄位數不對的列（多一個逗號）要讓 parser 報錯，而不是默默略過
+        blocks = pd.read_csv(raw_path, encoding="utf-8", chunksize=chunk_rows, low_memory=False)
+        summary = scan_marker_blocks(blocks, markers)
+    except (pd.errors.ParserError, UnicodeDecodeError) as e:
+        raise ValueError(f"Cannot parse the CSV: {str(e).strip()}")
+    return dict(summary, columns=len(names), markers=len(markers))
+
+
+def validate_binary(raw_path, index=None, label=None, channels=None,
+                    memory_budget_mb=VALIDATION_MEMORY_BUDGET_MB):
+    try:
+        reader = open_binary(raw_path, channels, label)
+    except (OSError, KeyError, IndexError) as e:
+        # 壞掉 / 不完整的 h5ad、FCS（h5py 與 struct 的錯誤）→ 統一成使用者看得懂的訊息
+        raise ValueError(f"Cannot read the uploaded file: {e}")
+
+    if index is not None and index != EVENT_COLUMN:
+        raise ValueError(f"FCS / h5ad uploads use the generated '{EVENT_COLUMN}' column as the index; "
+                         f"leave the index empty.")
+    if label is not None and label not in reader["names"]:
+        raise ValueError(f"Label '{label}' not found" +
+                         (" in the h5ad obs table." if raw_path.lower().endswith(".h5ad")
+                          else "; FCS files have no label column."))
+
+    if "sparse" in reader:
+        # sparse X 一定是數值；只檢查列數，不為了檢查把整個 matrix 讀進來
+        if reader["rows"] < MIN_ROWS:
+            raise ValueError(f"Only {reader['rows']} cells; clustering needs at least {MIN_ROWS}.")
+        return {"rows": reader["rows"], "constant": [], "columns": len(reader["names"]),
+                "markers": len(reader["names"]) - len(reader["meta_names"])}
+
+    markers = marker_columns(reader["names"], EVENT_COLUMN, label)
+    summary = scan_marker_blocks(reader["blocks"](chunk_rows_for_budget(len(reader["names"]), memory_budget_mb)),
+                                 markers, first_line=1)
+    return dict(summary, columns=len(reader["names"]), markers=len(markers))
+
+
+def validate_upload(raw_path, index=None, label=None, channels=None,
+                    memory_budget_mb=VALIDATION_MEMORY_BUDGET_MB):
+    """
+    CSV / FCS / h5ad 上傳檔 → { rows, columns, markers, constant }；有問題 → ValueError（精確的訊息）
+    """
+    if is_binary_upload(raw_path):
+        return validate_binary(raw_path, index, label, channels, memory_budget_mb)
+    return validate_csv(raw_path, index, label, memory_budget_mb)
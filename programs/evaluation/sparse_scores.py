@@ -0,0 +1,69 @@
+import os
+import sys
+import numpy as np
+from sklearn.metrics import pairwise_distances
+
+# clustering_scores.py 以 script 執行時也找得到 data_processing 的 sparse helper
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data_processing')))
+from sparse_features import cluster_codes, sparse_cluster_moments
+
+
+# ============================================================
+# ⭐ CH / DB on CSR（與 sklearn 的定義相同，但不把 X 轉成 dense）
+# ============================================================
+# sklearn 的 calinski_harabasz_score / davies_bouldin_score 不接受 sparse input，
+# 這裡用 cluster indicator matrix（K × n）算 centroid，距離用
+#   ||x - c||^2 = ||x||^2 - 2 x·c + ||c||^2
+# x·c 分塊算（每塊 block_rows × K），記憶體與 feature 數無關。
+SCORE_BLOCK_ROWS = 100_000
+
+
+def _check_labels(n_samples, n_labels):
+    if not 1 < n_labels < n_samples:
+        raise ValueError(f"Number of labels is {n_labels}. Valid values are 2 to n_samples - 1 (inclusive)")
+
+
+def sparse_calinski_harabasz_score(X, labels):
+    uniques, counts, means, _ = sparse_cluster_moments(X, labels)
+    n_samples = int(counts.sum())
+    _check_labels(n_samples, len(uniques))
+
+    center = (counts[:, None] * means).sum(axis=0) / n_samples
+    extra_disp = float((counts * ((means - center) ** 2).sum(axis=1)).sum())
+    # within = Σ||x||^2 − Σ n_k ||c_k||^2
+    codes, _ = cluster_codes(labels)
+    row_sq = np.asarray(X.multiply(X).sum(axis=1, dtype=np.float64)).ravel()
+    intra_disp = float(row_sq[codes >= 0].sum() - (counts * (means ** 2).sum(axis=1)).sum())
+
+    if intra_disp <= 0.0:
+        return 1.0
+    return extra_disp * (n_samples - len(uniques)) / (intra_disp * (len(uniques) - 1.0))
+
+
+def sparse_davies_bouldin_score(X, labels, block_rows=SCORE_BLOCK_ROWS):
+    uniques, counts, means, _ = sparse_cluster_moments(X, labels)
+    _check_labels(int(counts.sum()), len(uniques))
+
+    codes, _ = cluster_codes(labels)
+    row_sq = np.asarray(X.multiply(X).sum(axis=1, dtype=np.float64)).ravel()
+    center_sq = (means ** 2).sum(axis=1)
+
+    # 每個 cluster 內所有點到 centroid 的平均距離
+    dist_sum = np.zeros(len(uniques))
+    for start in range(0, X.shape[0], block_rows):
+        stop = min(start + block_rows, X.shape[0])
+        rows = np.flatnonzero(codes[start:stop] >= 0)
+        block_codes = codes[start:stop][rows]
+        dots = np.asarray((X[start:stop][rows] @ means.T))[np.arange(len(rows)), block_codes]
+        sq = row_sq[start:stop][rows] - 2 * dots + center_sq[block_codes]
+        dist_sum += np.bincount(block_codes, weights=np.sqrt(np.clip(sq, 0, None)), minlength=len(uniques))
+    intra_dists = dist_sum / counts
+
+    centroid_distances = pairwise_distances(means)
+    if np.allclose(intra_dists, 0) or np.allclose(centroid_distances, 0):
+        return 0.0
+
+    centroid_distances[centroid_distances == 0] = np.inf
+    combined_intra_dists = intra_dists[:, None] + intra_dists
+    scores = np.max(combined_intra_dists / centroid_distances, axis=1)
+    return float(np.mean(scores))
@@ -0,0 +1,111 @@
+import os
+import json
+import time
+import hashlib
+
+
+# ============================================================
+# ⭐ Stage manifest：applications/<file>/manifest.json
+# ============================================================
+# {
+#   "stages": { stage_name : { key, inputs, params, outputs, result, finished_at } },
+#   "files":  { path : { size, mtime_ns, sha256 } }     ← hash cache（stat 沒變就不重算）
+# }
+MANIFEST_NAME = "manifest.json"
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def manifest_path(app_path):
+    return os.path.join(app_path, MANIFEST_NAME)
+
+
+def load_manifest(app_path):
+    path = manifest_path(app_path)
+    if not os.path.exists(path):
+        return {"stages": {}, "files": {}}
+
+    try:
+        with open(path, "r") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[WARNING] Broken manifest {path}, rebuilding: {e}")
+        return {"stages": {}, "files": {}}
+
+    manifest.setdefault("stages", {})
+    manifest.setdefault("files", {})
+    return manifest
+
+
+def save_manifest(app_path, manifest):
+    """
+    先寫暫存檔再 os.replace，stage 中途 crash 也不會留下寫一半的 manifest
+    """
+    path = manifest_path(app_path)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def file_digest(manifest, path):
+    """
+    檔案內容的 sha256；size / mtime 沒變時直接用 manifest 裡的快取
+    """
+    stat = os.stat(path)
+    cached = manifest["files"].get(path)
+    if cached and cached["size"] == stat.st_size and cached["mtime_ns"] == stat.st_mtime_ns:
+        return cached["sha256"]
+
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            sha.update(block)
+
+    digest = sha.hexdigest()
+    manifest["files"][path] = {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": digest,
+    }
+    return digest
+
+
+def stage_key(manifest, inputs, params):
+    """
+    stage 的 cache key = 所有 input 檔內容 hash + 參數
+    回傳 (key, { input_path : sha256 })
+    """
+    input_hashes = {path: file_digest(manifest, path) for path in sorted(inputs)}
+    payload = json.dumps({"inputs": input_hashes, "params": params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest(), input_hashes
+
+
+def is_stage_fresh(manifest, stage_name, key):
+    """
+    key 相同，而且上次記錄的 outputs 都還在、內容沒被改過 → 不用重跑
+    """
+    record = manifest["stages"].get(stage_name)
+    if record is None or record["key"] != key:
+        return False
+
+    for path, digest in record["outputs"].items():
+        if not os.path.exists(path):
+            return False
+        if file_digest(manifest, path) != digest:
+            return False
+    return True
+
+
+def record_stage(manifest, stage_name, key, input_hashes, params, outputs, result=None):
+    manifest["stages"][stage_name] = {
+        "key": key,
+        "inputs": input_hashes,
+        "params": params,
+        "outputs": {path: file_digest(manifest, path) for path in sorted(outputs)},
+        "result": result,
+        "finished_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def invalidate_stage(manifest, stage_name):
+    manifest["stages"].pop(stage_name, None)
@@ -0,0 +1,211 @@
+import os
+import json
+import time
+import glob
+import argparse
+import resource
+import threading
+
+
+# ============================================================
+# ⭐ Per-stage profiling record
+# ============================================================
+# 每個 stage 一筆：
+#   wall_s / cpu_s（本 thread user+sys）/ child_cpu_s（子 process，例如 JVM）
+#   peak_rss_mb（stage 期間 process 的 VmHWM）/ child_peak_rss_mb（目前為止最大的子 process）
+#   peak_rss_scope："stage"（整段期間只有這個 stage 在跑）/ "process"（有其他 stage 重疊）
+#   read_bytes / write_bytes（本 thread 的 rchar / wchar）
+#   input_bytes / output_bytes（stage 宣告的 input / output 檔案大小）
+#   exit_code（有呼叫外部程式的 stage）
+#
+# 注意：DAG scheduler 同時跑多個 stage 時，peak_rss_mb 與 child_* 是 process 層級的數字，
+# 會包含同時段其他 stage 的用量；cpu_s 與 read/write bytes 是 thread 層級，不受影響。
+# VmHWM 是整個 process 共用的：只有在沒有其他 stage 在跑時才 reset，
+# 否則後開始的 stage 會把還在跑的 stage 的 peak 歸零（peak_rss_mb 偏低）。
+# 有重疊時 peak_rss_mb 是上次 reset 以來的 process peak（只會偏高，不會偏低），peak_rss_scope = "process"
+PROFILE_NAME = "profile.json"
+RUSAGE_THREAD = getattr(resource, "RUSAGE_THREAD", resource.RUSAGE_SELF)
+
+_stages_lock = threading.Lock()
+_stages = {"running": 0, "started": 0}
+
+
+def _thread_io():
+    """
+    /proc/thread-self/io 的 rchar / wchar（Linux 以外回傳 0）
+    """
+    counters = {"rchar": 0, "wchar": 0}
+    try:
+        with open(f"/proc/self/task/{threading.get_native_id()}/io", "r") as f:
+            for line in f:
+                key, value = line.split(":", 1)
+                if key in counters:
+                    counters[key] = int(value)
+    except OSError:
+        pass
+    return counters
+
+
+def _vm_hwm_kb():
+    """
+    process 的 peak RSS（/proc/self/status VmHWM，KB）；拿不到就用 ru_maxrss
+    """
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _reset_peak_rss():
+    """
+    寫 5 到 /proc/self/clear_refs 會把 VmHWM 重設成目前 RSS（Linux ≥ 4.0）
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def file_bytes(paths):
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+
+def start_stage_profile():
+    with _stages_lock:
+        alone = _stages["running"] == 0
+        if alone:
+            _reset_peak_rss()
+        _stages["running"] += 1
+        _stages["started"] += 1
+        seq = _stages["started"]
+    thread_usage = resource.getrusage(RUSAGE_THREAD)
+    child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "started_at": time.time(),
+        "wall": time.perf_counter(),
+        "cpu": thread_usage.ru_utime + thread_usage.ru_stime,
+        "child_cpu": child_usage.ru_utime + child_usage.ru_stime,
+        "io": _thread_io(),
+        "alone": alone,
+        "seq": seq,
+    }
+
+
+def end_stage_profile(snapshot, stage_name, status="ok"):
+    with _stages_lock:
+        _stages["running"] -= 1
+        # 開始時沒有別的 stage、且之後也沒有新的 stage 開始 → peak 只屬於這個 stage
+        isolated = snapshot["alone"] and _stages["started"] == snapshot["seq"]
+    thread_usage = resource.getrusage(RUSAGE_THREAD)
+    child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    io = _thread_io()
+    return {
+        "stage": stage_name,
+        "status": status,
+        "started_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(snapshot["started_at"])),
+        "wall_s": round(time.perf_counter() - snapshot["wall"], 4),
+        "cpu_s": round(thread_usage.ru_utime + thread_usage.ru_stime - snapshot["cpu"], 4),
+        "child_cpu_s": round(child_usage.ru_utime + child_usage.ru_stime - snapshot["child_cpu"], 4),
+        "peak_rss_mb": round(_vm_hwm_kb() / 1024, 1),
+        "peak_rss_scope": "stage" if isolated else "process",
+        "child_peak_rss_mb": round(child_usage.ru_maxrss / 1024, 1),
+        "read_bytes": io["rchar"] - snapshot["io"]["rchar"],
+        "write_bytes": io["wchar"] - snapshot["io"]["wchar"],
+        "input_bytes": None,
+        "output_bytes": None,
+        "exit_code": None,
+    }
+
+
+def write_job_profile(app_path, job, status, records):
+    profile = {
+        "job": job,
+        "status": status,
+        "written_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "stages": records,
+    }
+    path = os.path.join(app_path, PROFILE_NAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(profile, f, indent=4)
+    os.replace(tmp_path, path)
+    return path
+
+
+# ============================================================
+# ⭐ 跨 job 彙整：每個 stage 的 wall / cpu / RSS / IO 分佈
+# ============================================================
+SUMMARY_FIELDS = ["wall_s", "cpu_s", "child_cpu_s", "peak_rss_mb", "child_peak_rss_mb",
+                  "read_bytes", "write_bytes", "input_bytes", "output_bytes"]
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def load_profiles(app_root="./applications"):
+    profiles = []
+    for path in sorted(glob.glob(os.path.join(app_root, "*", PROFILE_NAME))):
+        try:
+            with open(path, "r") as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"[WARNING] Skip broken profile {path}: {e}")
+    return profiles
+
+
+def summarize_profiles(profiles):
+    """
+    回傳 list of rows：{ stage, runs, <field>_mean / _p50 / _p95 / _max ... }
+    （只算實際執行的 stage，manifest 判定 up to date 而跳過的不算）
+    """
+    per_stage = {}
+    for profile in profiles:
+        for record in profile["stages"]:
+            if record.get("status") != "ok":
+                continue
+            per_stage.setdefault(record["stage"], []).append(record)
+
+    rows = []
+    for stage_name, records in per_stage.items():
+        row = {"stage": stage_name, "runs": len(records)}
+        for field in SUMMARY_FIELDS:
+            values = [r[field] for r in records if r.get(field) is not None]
+            if not values:
+                continue
+            row[f"{field}_mean"] = round(sum(values) / len(values), 4)
+            row[f"{field}_p50"] = _percentile(values, 0.5)
+            row[f"{field}_p95"] = _percentile(values, 0.95)
+            row[f"{field}_max"] = max(values)
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize per-stage profiles across jobs')
+    parser.add_argument('--app_root', type=str, default='./applications')
+    parser.add_argument('--output', type=str, default='profile_summary.csv')
+    args = parser.parse_args()
+
+    import pandas as pd
+
+    profiles = load_profiles(args.app_root)
+    rows = summarize_profiles(profiles)
+    df = pd.DataFrame(rows)
+    df.to_csv(args.output, index=False)
+
+    print(f"jobs = {len(profiles)}")
+    if not df.empty:
+        print(df[["stage", "runs", "wall_s_mean", "wall_s_p95", "cpu_s_mean", "peak_rss_mb_max"]].to_string(index=False))
+    print(f"[OK] Profile summary saved at {args.output}")
+
+
+if __name__ == "__main__":
+    main()
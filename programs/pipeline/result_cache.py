@@ -0,0 +1,114 @@
+import os
+import json
+import hashlib
+
+
+# ============================================================
+# ⭐ Content-addressed result cache
+# ============================================================
+# fingerprint = sha256(上傳的 matrix) + 所有 GHSOM / pipeline 參數
+#
+# web/cache/fingerprints/<fingerprint>.json : { "job_id": 跑過這組 input 的 job }
+# web/cache/aliases/<job_id>.json           : { "source_job": 實際 artifacts 所屬的 job }
+#
+# 相同 fingerprint 的新 job 不進 queue，直接 alias 到已完成的 job
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+CACHE_DIR = os.path.join(ROOT_DIR, "web", "cache")
+FINGERPRINT_DIR = os.path.join(CACHE_DIR, "fingerprints")
+ALIAS_DIR = os.path.join(CACHE_DIR, "aliases")
+RESULT_DIR = os.path.join(ROOT_DIR, "Result")
+APPLICATION_DIR = os.path.join(ROOT_DIR, "applications")
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def save_stream_sha256(stream, path):
+    """
+    上傳的 stream 寫到 path，同時算 sha256（不用存完再整個檔讀一次）
+    """
+    sha = hashlib.sha256()
+    with open(path, "wb") as f:
+        for block in iter(lambda: stream.read(HASH_CHUNK_SIZE), b""):
+            sha.update(block)
+            f.write(block)
+    return sha.hexdigest()
+
+
+def job_fingerprint(data_hash, params):
+    """
+    data_hash : 上傳檔案內容的 sha256
+    params    : tau1 / tau2 / randomSeed / numIterations / xSize / ySize ... + index / label / subnum
+    """
+    payload = json.dumps({"data": data_hash, "params": params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _read_json(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(content, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+def has_artifacts(job_id):
+    """
+    Result CSV 與 applications/<job>-* 都還在才算可以重用
+    """
+    if not os.path.exists(os.path.join(RESULT_DIR, f"{job_id}_result.csv")):
+        return False
+    if not os.path.isdir(APPLICATION_DIR):
+        return False
+    return any(f.startswith(job_id + "-") for f in os.listdir(APPLICATION_DIR))
+
+
+def lookup_result(fingerprint):
+    """
+    fingerprint 命中且 artifacts 還在 → 回傳來源 job_id，否則 None
+    """
+    entry = _read_json(os.path.join(FINGERPRINT_DIR, f"{fingerprint}.json"))
+    if entry is None:
+        return None
+
+    job_id = entry.get("job_id")
+    if job_id is None or not has_artifacts(job_id):
+        return None
+    return job_id
+
+
+def record_result(fingerprint, job_id):
+    _write_json(os.path.join(FINGERPRINT_DIR, f"{fingerprint}.json"), {"job_id": job_id})
+
+
+def register_alias(job_id, source_job):
+    _write_json(os.path.join(ALIAS_DIR, f"{job_id}.json"), {"source_job": resolve_job_id(source_job)})
+
+
+def resolve_job_id(job_id):
+    """
+    alias → 實際擁有 artifacts 的 job_id；不是 alias 就原樣回傳
+    """
+    # job_id 來自 URL，不接受路徑字元
+    if os.path.basename(job_id) != job_id or job_id.startswith("."):
+        return job_id
+
+    entry = _read_json(os.path.join(ALIAS_DIR, f"{job_id}.json"))
+    if entry is None:
+        return job_id
+    return entry.get("source_job", job_id)
@@ -0,0 +1,109 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+# ============================================================
+# ⭐ Stage DAG scheduler
+# ============================================================
+# 每個 job 是一個小 DAG（stage["deps"]），每個 stage 指定 resource pool（stage["pool"]）：
+#   "jvm"    : somtoolbox 訓練（子 process，thread 只是在等它）
+#   "python" : input 格式化、label assignment、evaluation ...
+# 不同 job 的 stage 共用同一組 pool → job C 訓練時，job B 的 formatting 與
+# job A 的 evaluation 可以同時進行。
+DEFAULT_POOLS = {"jvm": 1, "python": 1}
+
+
+class StageScheduler:
+
+    def __init__(self, run_stage, pools=None):
+        """
+        run_stage : callable(job, stage) → 執行單一 stage（例外代表該 stage 失敗）
+        pools     : { pool_name : slot 數 }
+        """
+        self.run_stage = run_stage
+        self.pools = dict(DEFAULT_POOLS, **(pools or {}))
+        self.executors = {
+            name: ThreadPoolExecutor(max_workers=slots, thread_name_prefix=f"{name}-pool")
+            for name, slots in self.pools.items()
+        }
+        # RLock：future 若已完成，add_done_callback 會在同一個 thread 立刻回呼
+        self.lock = threading.RLock()
+        self.jobs = {}     # { job_id : 排程狀態 }
+
+    def submit_job(self, job_id, job, stages, on_done):
+        """
+        job      : 傳給 run_stage 的 job 狀態（例如 execute.build_job_context 的 ctx）
+        stages   : stage dict list，需要 "name" / "pool" / "deps"
+        on_done  : callable(job_id, job, error) → 所有 stage 完成（error=None）或任一 stage 失敗
+        """
+        state = {
+            "job": job,
+            "stages": {stage["name"]: stage for stage in stages},
+            "pending": {stage["name"]: set(stage.get("deps", [])) for stage in stages},
+            "running": set(),
+            "error": None,
+            "on_done": on_done,
+        }
+        for name, deps in state["pending"].items():
+            unknown = deps - set(state["stages"])
+            if unknown:
+                raise ValueError(f"Stage '{name}' depends on unknown stages: {sorted(unknown)}")
+
+        with self.lock:
+            if job_id in self.jobs:
+                raise ValueError(f"Job {job_id} is already scheduled")
+            self.jobs[job_id] = state
+            self._dispatch_ready(job_id, state)
+
+    def in_flight(self):
+        with self.lock:
+            return set(self.jobs)
+
+    def shutdown(self, wait=True):
+        for executor in self.executors.values():
+            executor.shutdown(wait=wait)
+
+    # ------------------------------------------------------------
+    # 內部：依賴都完成的 stage 丟到對應 pool
+    # ------------------------------------------------------------
+    def _dispatch_ready(self, job_id, state):
+        ready = [name for name, deps in state["pending"].items() if not deps]
+        # 先全部標記為 running，再 submit（回呼重入時不會重複派發）
+        for name in ready:
+            del state["pending"][name]
+            state["running"].add(name)
+
+        for name in ready:
+            stage = state["stages"][name]
+            executor = self.executors[stage.get("pool", "python")]
+            future = executor.submit(self.run_stage, state["job"], stage)
+            future.add_done_callback(
+                lambda f, job_id=job_id, name=name: self._on_stage_done(job_id, name, f)
+            )
+
+        if self.jobs.get(job_id) is state and not state["pending"] and not state["running"]:
+            self._finish(job_id, state)
+
+    def _on_stage_done(self, job_id, name, future):
+        with self.lock:
+            state = self.jobs[job_id]
+            state["running"].discard(name)
+            error = future.exception()
+
+            if error is not None:
+                # 失敗：不再派發這個 job 的後續 stage，等已在跑的結束
+                if state["error"] is None:
+                    state["error"] = error
+                state["pending"].clear()
+            elif state["error"] is None:
+                for deps in state["pending"].values():
+                    deps.discard(name)
+
+            self._dispatch_ready(job_id, state)
+
+    def _finish(self, job_id, state):
+        del self.jobs[job_id]
+        # on_done 在獨立 thread 執行，不佔用 pool slot 也不持有 scheduler lock
+        threading.Thread(
+            target=state["on_done"], args=(job_id, state["job"], state["error"]), daemon=True
+        ).start()
@@ -0,0 +1,315 @@
+import os
+import io
+import csv
+import json
+import time
+import uuid
+import zlib
+import hashlib
+import threading
+import pandas as pd
+from programs.pipeline.result_cache import ROOT_DIR, HASH_CHUNK_SIZE
+from programs.data_processing.binary_readers import RAW_EXTENSIONS
+from programs.data_processing.upload_validation import (
+    check_columns, new_scan, scan_block, finish_scan, validate_upload
+)
+
+
+# ============================================================
+# ⭐ Resumable chunked upload（多 GB 的上傳不用一次 multipart 送完）
+# ============================================================
+# 1. 建立 session（檔名 + job 參數）→ upload_id
+# 2. 依序 PUT chunk（帶 offset；與伺服器收到的 bytes 數不同 → 回傳目前 offset，client 從那裡續傳）
+# 3. finalize → 檔案搬到 raw-data/，回傳 sha256 與檢查結果，馬上可以進 queue
+#
+# web/uploads/<upload_id>.json : session（檔名、格式、job 參數）
+# web/uploads/<upload_id>.part : 收到的原始 bytes（.csv.gz 就是壓縮檔）；檔案大小 = 已收到的 offset
+# web/uploads/<upload_id>.data : .csv.gz 邊收邊解壓的 CSV
+#
+# 每個 chunk 到達時就：算 sha256（解壓後的內容，與直接上傳 CSV 的 fingerprint 相同）、
+# CSV 讀到 header 就檢查 index / label、完整的列分塊做 upload_validation 的數值檢查。
+# 這些狀態只在記憶體（_STATES）；server 重啟後第一個 chunk 會把 .part 重播一次重建。
+UPLOAD_DIR = os.path.join(ROOT_DIR, "web", "uploads")
+UPLOAD_CHUNK_BYTES = 8 << 20
+UPLOAD_TTL_SECONDS = 24 * 3600      # 超過這麼久沒有新 chunk 的 session 會被清掉
+GZIP_SUFFIX = ".gz"
+
+_STATES = {}
+_LOCK = threading.Lock()
+
+
+def upload_format(filename):
+    """
+    檔名 → (raw-data 副檔名, 是否 gzip)；"x.csv.gz" → (".csv", True)
+    不支援的格式 → ValueError
+    """
+    name = (filename or "").lower()
+    compressed = name.endswith(GZIP_SUFFIX)
+    if compressed:
+        name = name[:-len(GZIP_SUFFIX)]
+    ext = os.path.splitext(name)[1]
+    if ext not in RAW_EXTENSIONS or (compressed and ext != ".csv"):
+        raise ValueError(f"Unsupported file type '{os.path.basename(filename or '')}'. "
+                         f"Please upload a .csv, .csv.gz, .fcs or .h5ad file.")
+    return ext, compressed
+
+
+def _paths(upload_id):
+    base = os.path.join(UPLOAD_DIR, upload_id)
+    return {"session": base + ".json", "part": base + ".part", "data": base + ".data"}
+
+
+def expire_sessions(ttl=UPLOAD_TTL_SECONDS):
+    """
+    放棄的上傳（最後一個 chunk 已超過 ttl 秒）→ 刪掉，不讓半個多 GB 的檔案佔著磁碟
+    """
+    now = time.time()
+    for name in os.listdir(UPLOAD_DIR) if os.path.isdir(UPLOAD_DIR) else []:
+        if not name.endswith(".part"):
+            continue
+        path = os.path.join(UPLOAD_DIR, name)
+        try:
+            expired = now - os.path.getmtime(path) > ttl
+        except OSError:
+            continue
+        if expired:
+            print(f"[UPLOAD] Discarding stale upload {name[:-len('.part')]}")
+            discard_session(name[:-len(".part")])
+
+
+def create_session(filename, params):
+    """
+    params : job 參數（tau1 / tau2 / index / label / channels / gmail），finalize 時原樣回傳
+    """
+    ext, compressed = upload_format(filename)
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    expire_sessions()
+
+    upload_id = uuid.uuid4().hex
+    session = {
+        "upload_id": upload_id,
+        "filename": os.path.basename(filename),
+        "ext": ext,
+        "compressed": compressed,
+        "params": params,
+        "created": time.time(),
+    }
+    paths = _paths(upload_id)
+    with open(paths["session"], "w") as f:
+        json.dump(session, f, indent=4)
+    open(paths["part"], "wb").close()
+    return session
+
+
+def load_session(upload_id):
+    """
+    upload_id 不存在 / 格式不對 → None；session["offset"] = 已收到的 bytes
+    """
+    if not upload_id or not all(c in "0123456789abcdef" for c in upload_id):
+        return None
+    paths = _paths(upload_id)
+    try:
+        with open(paths["session"], "r") as f:
+            session = json.load(f)
+        session["offset"] = os.path.getsize(paths["part"])
+    except (OSError, ValueError):
+        return None
+    return session
+
+
+def discard_session(upload_id):
+    with _LOCK:
+        _STATES.pop(upload_id, None)
+        for path in _paths(upload_id).values():
+            if os.path.exists(path):
+                os.remove(path)
+
+
+# ------------------------------------------------------------
+# 邊收邊處理：gzip 解壓 → sha256 → CSV 檢查
+# ------------------------------------------------------------
+def _new_state(session):
+    params = session["params"]
+    return {
+        "sha": hashlib.sha256(),
+        "inflate": zlib.decompressobj(zlib.MAX_WBITS | 16) if session["compressed"] else None,
+        "inflating": False,   # 目前的 gzip member 還沒結束（finalize 時 → 檔案不完整）
+        "csv": session["ext"] == ".csv",
+        "index": params.get("index"),
+        "label": params.get("label"),
+        "tail": b"",          # 還沒遇到（引號外的）換行的最後一段
+        "quoted": False,      # tail 結尾是否在引號內（欄位值可以有換行，引號狀態要跨 chunk 接著算）
+        "names": None,        # CSV header
+        "scan": None,         # upload_validation 的累計狀態
+    }
+
+
+def _inflate(state, data):
+    """
+    gzip bytes → 解壓後的 bytes（支援多個 member 串在一起，例如 cat a.gz b.gz）
+    """
+    out = []
+    try:
+        while data:
+            out.append(state["inflate"].decompress(data))
+            state["inflating"] = not state["inflate"].eof
+            if state["inflating"]:
+                break
+            data = state["inflate"].unused_data
+            state["inflate"] = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    except zlib.error as e:
+        raise ValueError(f"Invalid gzip data: {e}")
+    return b"".join(out)
+
+
+def _row_ends(data, quoted=False):
+    """
+    data 中引號外的換行（列的結尾）：回傳 (第一個列結尾之後的位置, 最後一個列結尾之後的位置, 結尾是否在引號內)
+    沒有列結尾 → 位置為 0；quoted : data 開頭是否在引號內
+    換行前的引號數（加上開頭狀態）是偶數 → 在引號外；"" 跳脫的引號算兩次，不影響結果
+    """
+    # 從前面找第一個：每一步只數上一個換行到這個換行之間的引號
+    first, pos, inside = data.find(b"\n"), 0, quoted
+    while first >= 0:
+        inside ^= data.count(b'"', pos, first) % 2 == 1
+        if not inside:
+            break
+        pos, first = first, data.find(b"\n", first + 1)
+    if first < 0:
+        return 0, 0, quoted ^ (data.count(b'"') % 2 == 1)
+
+    # 從後面找最後一個
+    end_quoted = quoted ^ (data.count(b'"') % 2 == 1)
+    last, pos, inside = data.rfind(b"\n"), len(data), end_quoted
+    while True:
+        inside ^= data.count(b'"', last, pos) % 2 == 1
+        if not inside:
+            break
+        pos, last = last, data.rfind(b"\n", 0, last)
+    return first + 1, last + 1, end_quoted
+
+
+def _scan_lines(state, lines):
+    """
+    完整的 CSV 列（bytes，以引號外的換行結尾）→ 第一列是 header，其餘分塊做數值檢查
+    """
+    if state["names"] is None:
+        cut = _row_ends(lines)[0]
+        header, lines = lines[:cut], lines[cut:]
+        try:
+            names = next(csv.reader(io.StringIO(header.decode("utf-8"), newline="")), [])
+        except UnicodeDecodeError:
+            raise ValueError("The CSV is not UTF-8 text.")
+        state["names"] = names
+        markers = check_columns(names, state["index"], state["label"])
+        state["scan"] = new_scan(markers)
+    if not lines.strip():
+        return
+    try:
+        block = pd.read_csv(io.BytesIO(lines), header=None, names=state["names"], encoding="utf-8",
+                            low_memory=False, skip_blank_lines=True)
+    except (pd.errors.ParserError, UnicodeDecodeError) as e:
+        raise ValueError(f"Cannot parse the CSV near line {state['scan']['first_line'] + state['scan']['rows']}: "
+                         f"{str(e).strip()}")
+    scan_block(state["scan"], block)
+
+
+def _feed(state, data, out=None):
+    """
+    收到的原始 bytes → （解壓後寫到 out）→ 算 sha256、CSV 檢查完整的列
+    """
+    if state["inflate"] is not None:
+        data = _inflate(state, data)
+        out.write(data)
+    state["sha"].update(data)
+    if not state["csv"]:
+        return
+    # 只掃新的 data：tail 一定從列的開頭開始，引號狀態接著 tail 的結尾
+    _, cut, state["quoted"] = _row_ends(data, state["quoted"])
+    if not cut:
+        state["tail"] += data
+        return
+    lines = state["tail"] + data[:cut]
+    state["tail"] = data[cut:]
+    _scan_lines(state, lines)
+
+
+def _load_state(session):
+    """
+    記憶體裡的狀態；沒有（server 重啟）→ 從 .part 重播一次（.data 重寫）
+    """
+    upload_id = session["upload_id"]
+    state = _STATES.get(upload_id)
+    if state is not None:
+        return state
+
+    state = _new_state(session)
+    paths = _paths(upload_id)
+    out = open(paths["data"], "wb") if session["compressed"] else None
+    try:
+        with open(paths["part"], "rb") as src:
+            for block in iter(lambda: src.read(HASH_CHUNK_SIZE), b""):
+                _feed(state, block, out)
+    finally:
+        if out is not None:
+            out.close()
+    _STATES[upload_id] = state
+    return state
+
+
+def append_chunk(upload_id, offset, data):
+    """
+    offset 與已收到的 bytes 數相同才接受 → 回傳新的 offset；不同 → 回傳目前 offset（不寫入）
+    內容有問題（header / 非數值 ...）→ ValueError，session 保留給呼叫端決定是否丟棄
+    """
+    with _LOCK:
+        session = load_session(upload_id)
+        if session is None:
+            raise KeyError(upload_id)
+        if offset != session["offset"]:
+            return session["offset"]
+
+        state = _load_state(session)
+        paths = _paths(upload_id)
+        if session["compressed"]:
+            with open(paths["data"], "ab") as out:
+                _feed(state, data, out)
+        else:
+            _feed(state, data)
+        with open(paths["part"], "ab") as f:
+            f.write(data)
+        return session["offset"] + len(data)
+
+
+def finalize_session(upload_id, raw_path, channels=None):
+    """
+    最後一段沒換行的列、gzip 結尾都處理完 → 檔案搬到 raw_path
+    回傳 (sha256, 檢查結果)；內容有問題 → ValueError
+    """
+    with _LOCK:
+        session = load_session(upload_id)
+        if session is None:
+            raise KeyError(upload_id)
+        state = _load_state(session)
+        paths = _paths(upload_id)
+
+        if session["compressed"] and (state["inflating"] or session["offset"] == 0):
+            raise ValueError("The gzip file is incomplete; upload the remaining bytes before finalizing.")
+        if state["csv"]:
+            if state["tail"]:
+                _scan_lines(state, state["tail"] + b"\n")
+                state["tail"] = b""
+                state["quoted"] = False
+            if state["names"] is None:
+                raise ValueError("The CSV is empty (no header row).")
+            summary = dict(finish_scan(state["scan"]), columns=len(state["names"]),
+                           markers=len(state["scan"]["markers"]))
+
+        os.replace(paths["data"] if session["compressed"] else paths["part"], raw_path)
+        _STATES.pop(upload_id, None)
+
+    if not state["csv"]:
+        # FCS / h5ad 要整個檔案才能讀（h5ad 的 index 在檔尾）→ 收完才檢查
+        summary = validate_upload(raw_path, session["params"].get("index"), session["params"].get("label"),
+                                  channels)
+    return state["sha"].hexdigest(), summary
@@ -0,0 +1,270 @@
+import os
+import re
+import glob
+import time
+import atexit
+import select
+import shutil
+import threading
+import subprocess
+from programs.pipeline.result_cache import ROOT_DIR
+from programs.training.train_monitor import (
+    POLL_INTERVAL, check_limits, finish_progress, kill_process_group, process_group_rss_mb, record_line,
+    write_progress
+)
+
+
+# ============================================================
+# ⭐ 常駐 JVM 訓練 service（somtoolbox）
+# ============================================================
+# somtoolbox.sh 每個 job 都開一個新的 JVM、載入 lib/ 的 ~30 個 jar、JIT 從頭 warm-up；
+# 小 job / tau grid 的時間大半花在這裡。這裡改成常駐的 JVM（programs/GHSOM/GHSOMService.java）：
+#   - stdin / stdout 一行一個訊息（TRAIN → DONE <exit code> <ms>），只有本機 parent process 能用
+#   - 每個 job 的輸出仍由各自 .prop 的 outputDirectory 決定（applications/<job>/GHSOM/output/<job>）
+#   - 一個 service 同時只跑一個 job；web worker 有多個 jvm slot 時，同時訓練的 job 各用一個 service
+#     （閒置的 service 放回 _IDLE 給下一個 job 用）
+#   - crash isolation：job 讓 JVM 掛掉（或 Error 後要求 RESTART）只影響那一個 job，
+#     下一個 job 自動開新的 service；每個 service 跑 SERVICE_MAX_JOBS 個 job 後換新，
+#     somtoolbox 內部的 static 狀態不會一直累積
+#   - service 的 stderr（somtoolbox 的 log）由 reader thread 轉印，並記進目前 job 的 progress（log tail）；
+#     job 超過 wall-clock / memory 上限 → 整個 service 被 kill，下一個 job 開新的（train_monitor.py）；
+#     memory 上限只算 TRAIN 之後 RSS 增加的部分（前面 job 讓 heap 長大的部分不算）。
+#     已經長大的 heap 被這個 job 重複使用時不會增加 RSS → 上限只擋住讓 JVM 再長大的 job，
+#     要嚴格限制每個 job 的記憶體請用 launch 模式（不加 --jvm_service）
+#   - 沒有 java / JDK（single-file source 模式需要 Java 11+ 的 compiler）/ service 啟動失敗 →
+#     回傳 None，呼叫端改用 somtoolbox.sh
+# JVM 選項與 classpath 與 somtoolbox.sh 相同（JAVA / JAVA_OPTS 環境變數）
+GHSOM_DIR = os.path.join(ROOT_DIR, "programs", "GHSOM")
+SERVICE_SOURCE = os.path.join(GHSOM_DIR, "GHSOMService.java")
+SERVICE_START_TIMEOUT = 120
+SERVICE_MAX_JOBS = 50
+
+_IDLE = []
+_LOCK = threading.Lock()
+_STARTED = False
+
+
+def somtoolbox_classpath(base_dir=GHSOM_DIR):
+    # 與 somtoolbox.sh 相同：somtoolbox.jar（或 bin/core）+ lib/*.jar + rsc
+    jar = os.path.join(base_dir, "somtoolbox.jar")
+    paths = [jar if os.path.exists(jar) else os.path.join(base_dir, "bin", "core")]
+    if os.path.isdir(os.path.join(base_dir, "bin", "optional")):
+        paths.append(os.path.join(base_dir, "bin", "optional"))
+    paths += sorted(glob.glob(os.path.join(base_dir, "lib", "**", "*.jar"), recursive=True))
+    paths.append(os.path.join(base_dir, "rsc"))
+    return os.pathsep.join(paths)
+
+
+def java_major_version(java):
+    try:
+        output = subprocess.run([java, "-version"], capture_output=True, text=True, timeout=30).stderr
+    except (OSError, subprocess.SubprocessError):
+        return None
+    match = re.search(r'version "(\d+)(?:\.(\d+))?', output)
+    if match is None:
+        return None
+    major = int(match.group(1))
+    # 1.8 → 8
+    return int(match.group(2) or 0) if major == 1 else major
+
+
+def java_options():
+    """
+    JAVA_OPTS 環境變數；沒有 → 與 somtoolbox.sh 相同（-server -Xmx<總記憶體 - 256>M）
+    """
+    if os.environ.get("JAVA_OPTS"):
+        return os.environ["JAVA_OPTS"].split()
+    try:
+        with open("/proc/meminfo") as f:
+            total_kb = int(next(line for line in f if line.startswith("MemTotal")).split()[1])
+    except (OSError, StopIteration, ValueError):
+        total_kb = 2 * 1024 * 1024
+    return ["-server", f"-Xmx{total_kb // 1024 - 256}M"]
+
+
+def java_command():
+    """
+    啟動 service 的指令；java 不存在 / 版本 < 11（沒有 single-file source 模式）→ None
+    """
+    java = os.environ.get("JAVA", "java")
+    if shutil.which(java) is None:
+        return None
+    major = java_major_version(java)
+    if major is None or major < 11:
+        return None
+    command = [java, *java_options()]
+    if 12 <= major <= 23:
+        # Java 18+ 預設不允許 System.setSecurityManager（攔截 System.exit 用）；Java 24 起完全移除
+        command.append("-Djava.security.manager=allow")
+    return command + ["-cp", somtoolbox_classpath(), SERVICE_SOURCE]
+
+
+def start_service():
+    """
+    開一個 service 並等到 READY；失敗 → None
+    """
+    command = java_command()
+    if command is None:
+        return None
+    env = dict(os.environ, SOMTOOLBOX_BASEDIR=GHSOM_DIR)
+    start = time.perf_counter()
+    try:
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, text=True, encoding="utf-8", errors="replace",
+                                   bufsize=1, env=env, start_new_session=True)
+    except OSError as e:
+        print(f"[WARNING] Cannot start the somtoolbox service: {e}")
+        return None
+    service = {"process": process, "jobs": 0, "trap_exit": True, "progress": None}
+    threading.Thread(target=_pump_log, args=(service,), daemon=True).start()
+
+    ready, _, _ = select.select([process.stdout], [], [], SERVICE_START_TIMEOUT)
+    line = process.stdout.readline() if ready else ""
+    if not line.startswith("READY"):
+        print(f"[WARNING] somtoolbox service did not start ({line.strip() or 'no response'})")
+        stop_service(service)
+        return None
+
+    print(f"[INFO] somtoolbox service pid {process.pid} ready in {time.perf_counter() - start:.2f}s "
+          f"({line.split(maxsplit=1)[1].strip()})")
+    service["trap_exit"] = "no-trap-exit" not in line
+    return service
+
+
+def _pump_log(service):
+    # somtoolbox 的 log → worker log；有 job 在跑 → 同時記進它的 progress
+    for line in service["process"].stderr:
+        print(line, end="" if line.endswith("\n") else "\n", flush=True)
+        progress = service["progress"]
+        if progress is not None:
+            record_line(progress, line)
+    service["process"].stderr.close()
+
+
+def stop_service(service):
+    process = service["process"]
+    if process.poll() is None:
+        try:
+            process.stdin.write("QUIT\n")
+            process.stdin.flush()
+            process.wait(timeout=10)
+        except (OSError, ValueError, subprocess.TimeoutExpired):
+            process.kill()
+            process.wait()
+    for stream in (process.stdin, process.stdout):
+        try:
+            stream.close()
+        except (OSError, ValueError):
+            pass
+
+
+def shutdown_services():
+    with _LOCK:
+        services, _IDLE[:] = list(_IDLE), []
+    for service in services:
+        stop_service(service)
+
+
+def _acquire():
+    global _STARTED
+    service, dead = None, []
+    with _LOCK:
+        while _IDLE and service is None:
+            candidate = _IDLE.pop()
+            if candidate["process"].poll() is None:
+                service = candidate
+            else:
+                dead.append(candidate)
+        if not _STARTED:
+            atexit.register(shutdown_services)
+            _STARTED = True
+    # 閒置時結束的 service：關掉 pipe（reader thread 讀到 EOF 後結束）
+    for candidate in dead:
+        stop_service(candidate)
+    return service if service is not None else start_service()
+
+
+def _release(service):
+    if service["jobs"] >= SERVICE_MAX_JOBS or service["process"].poll() is not None:
+        stop_service(service)
+        return
+    with _LOCK:
+        _IDLE.append(service)
+
+
+def _wait_reply(service, progress, baseline_mb):
+    """
+    等 TRAIN 的回覆；有 progress → 每 POLL_INTERVAL 秒檢查一次上限，超過就 kill 整個 service
+    baseline_mb : TRAIN 前 service 的 RSS；memory 上限只算這個 job 讓 RSS 增加的部分
+    """
+    process = service["process"]
+    while True:
+        ready, _, _ = select.select([process.stdout], [], [], POLL_INTERVAL)
+        if ready:
+            return process.stdout.readline()
+        if process.poll() is not None:
+            return ""
+        if progress is None:
+            continue
+        reason = check_limits(progress, process.pid, baseline_mb)
+        if reason is not None:
+            kill_process_group(process, reason, progress)
+            return ""
+        write_progress(progress)
+
+
+def run_in_service(args, progress=None):
+    """
+    args     : somtoolbox.sh 的參數（例如 ["GHSOM", prop_path, "-h"]），路徑要是絕對路徑
+    progress : train_monitor.new_progress(...)（None → 不記錄進度、不檢查上限）
+    回傳 exit code；service 無法啟動 → None（呼叫端改用 somtoolbox.sh）
+    """
+    service = _acquire()
+    if service is None:
+        return None
+
+    process = service["process"]
+    service["progress"] = progress
+    baseline_mb = 0.0
+    if progress is not None:
+        # JVM 的 heap 長大後不會還給 OS：前面 job 留下的 RSS 不算進這個 job 的 memory 上限
+        baseline_mb = process_group_rss_mb(process.pid) or 0.0
+        write_progress(progress, pid=process.pid, rss_baseline_mb=baseline_mb)
+    try:
+        process.stdin.write("TRAIN " + "\t".join(args) + "\n")
+        process.stdin.flush()
+        line = _wait_reply(service, progress, baseline_mb)
+    except (OSError, ValueError):
+        line = ""
+    service["progress"] = None
+    service["jobs"] += 1
+    exit_code = _reply_exit_code(service, line)
+    if progress is not None:
+        finish_progress(progress, exit_code)
+    return exit_code
+
+
+def _reply_exit_code(service, line):
+    process = service["process"]
+
+    reply = line.split()
+    if len(reply) == 3 and reply[0] in ("DONE", "RESTART"):
+        if reply[0] == "RESTART":
+            print("[WARNING] somtoolbox service hit a fatal error; the next job gets a fresh JVM.")
+            stop_service(service)
+        else:
+            _release(service)
+        return int(reply[1])
+
+    # 沒有回覆：JVM 在這個 job 中結束（沒有 exit trap 時 somtoolbox 的 System.exit、crash、被 kill）
+    exit_code = process.wait()
+    stop_service(service)
+    if exit_code < 0:
+        # 被 signal 結束（kill / OOM killer）→ 與 os.system 相同的 128 + signal
+        exit_code = 128 - exit_code
+    if service["trap_exit"] and exit_code == 0:
+        # System.exit 已被攔下 → 沒有回覆就結束一定是異常
+        exit_code = 1
+    if exit_code != 0:
+        print(f"[WARNING] somtoolbox service exited with code {exit_code} during the job.")
+    return exit_code
@@ -0,0 +1,639 @@
+import os
+import sys
+import gzip
+import json
+import time
+import uuid
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+import pandas as pd
+from programs.pipeline.result_cache import CACHE_DIR, file_sha256, job_fingerprint
+
+
+# ============================================================
+# ⭐ Pure-NumPy GHSOM 訓練引擎（somtoolbox.sh 的替代方案）
+# ============================================================
+# 讀同一份 .prop / .in，輸出與 somtoolbox 相同格式的 .unit.gz / .wgt.gz / .map，
+# get_ghsom_dim、save_cluster_with_clustered_label、feature map 都不用改。
+#
+# 演算法（GHSOM，Dittenbach et al.；qe = unit 的 mapped vectors 到 unit 的距離總和，即 $QUANTERROR_UNIT）：
+#   layer 0 : 全部 vector 的平均，qe0 = 各 vector 到平均的距離總和
+#   水平成長（tau1）: 每張 map 從 xSize × ySize 開始訓練；map 的 MQE（有 vector 的 unit 的 qe 平均，
+#                    即 $QUANTERROR_MAP）≥ tau1 × parent unit 的 qe → 在 qe 最大的 unit 與它最不像的
+#                    鄰居之間插入一列 / 一行（權重取兩側平均），重新訓練
+#   垂直展開（tau2）: unit 的 qe ≥ tau2 × qe0 → 以它的 mapped vectors 訓練一張子 map
+#
+# 訓練是 mini-batch SOM：每一步取一批 vector，BMU 用
+# ||x||² - 2·x·Wᵀ + ||w||² 一次 GEMM（BLAS）算完，再把整批的 neighbourhood 加權平均一次更新。
+# learning rate 與 neighbourhood 都是 exponential decay。訓練量（schedule）：
+#   "fixed"    : 每張 map 訓練 numIterations 個 vector、每批 TRAIN_BATCH（與 somtoolbox 相同的 iteration 數）
+#   "adaptive" : 依 map 的 vectors 數決定 —— ADAPTIVE_EPOCHS 個 epoch（限制在 ADAPTIVE_MIN/MAX_ITERATIONS），
+#                每批約 vectors / ADAPTIVE_BATCH_DIVISOR 個；小的 leaf map 不再浪費 20000 次，
+#                大的第一層 map 也能看過每個 cell。QE 連續 CONVERGENCE_PATIENCE 次
+#                進步不到 CONVERGENCE_TOL 就提前停止
+# 兩種都在訓練中檢查 QE_CHECKS 次 QE（固定子集的平均距離），每張 map 的 iteration 數與
+# QE trajectory 寫到 <outputDirectory>/<prefix>_training.json
+#
+# 輸出檔名與 somtoolbox 相同：
+#   <prefix>.unit.gz / .wgt.gz / .map                   : 第一層
+#   <prefix>_submap_lvl2_<x>x<y>.*                      : 第一層 unit (x, y) 展開的子 map
+#   <prefix>_submap_lvl<L>_<x1>x<y1>_..._<x>x<y>.*      : 更深的層，路徑上每個 parent unit 都寫進檔名
+# lvl 後面只有一位數（save_cluster_with_clustered_label 只讀一位）→ 最多 MAX_LEVELS 層
+ENGINES = ("somtoolbox", "numpy")
+SCHEDULES = ("fixed", "adaptive")
+TRAIN_BATCH = 256
+ADAPTIVE_EPOCHS = 5
+ADAPTIVE_MIN_ITERATIONS = 1000
+ADAPTIVE_MAX_ITERATIONS = 5_000_000
+ADAPTIVE_BATCH_DIVISOR = 100
+ADAPTIVE_MIN_BATCH = 32
+ADAPTIVE_MAX_BATCH = 4096
+QE_CHECKS = 20
+QE_SAMPLE_ROWS = 4096
+CONVERGENCE_TOL = 1e-3
+CONVERGENCE_PATIENCE = 2
+TRAINING_REPORT_SUFFIX = "_training.json"
+BMU_BATCH_ROWS = 65536
+LEARN_RATE_FINAL_RATIO = 0.01
+SIGMA_FINAL = 0.1
+MAX_LEVELS = 9
+
+
+def read_prop(prop_path):
+    """
+    somtoolbox 的 .prop（key=value）→ dict；路徑相對於 workingDirectory（相對於 .prop 所在資料夾）
+    """
+    prop = {}
+    with open(prop_path, "r", encoding="utf-8") as f:
+        for line in f:
+            key, sep, value = line.strip().partition("=")
+            if sep:
+                prop[key.strip()] = value.strip()
+
+    working_dir = os.path.join(os.path.dirname(os.path.abspath(prop_path)), prop.get("workingDirectory", "./"))
+    return {
+        "name_prefix": prop["namePrefix"],
+        "vector_file": os.path.normpath(os.path.join(working_dir, prop["vectorFileName"])),
+        "output_dir": os.path.normpath(os.path.join(working_dir, prop["outputDirectory"])),
+        "tau1": float(prop.get("tau", 0.1)),
+        "tau2": float(prop.get("tau2", 0.01)),
+        "x_size": int(prop.get("xSize", 2)),
+        "y_size": int(prop.get("ySize", 2)),
+        "learn_rate": float(prop.get("learnRate", 0.7)),
+        "iterations": int(prop.get("numIterations", 20000)),
+        "seed": int(prop.get("randomSeed", 7)),
+        "schedule": "fixed",
+    }
+
+
+def read_input_vectors(in_path):
+    """
+    SOMLib .in（$ header + 每列 vector 值 + vector name）→ (float32 n × dim, names)
+    """
+    header = {}
+    n_header = 0
+    with open(in_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("$"):
+                key, _, value = line.strip().partition(" ")
+                header[key] = value
+            elif line.strip():
+                break
+            n_header += 1
+
+    dim = int(header["$VECDIM"])
+    df = pd.read_csv(in_path, sep=" ", header=None, skiprows=n_header, skip_blank_lines=True,
+                     dtype={**{i: np.float32 for i in range(dim)}, dim: str}, usecols=range(dim + 1))
+    return df.iloc[:, :dim].to_numpy(dtype=np.float32), df.iloc[:, dim].to_numpy(dtype=object)
+
+
+# ------------------------------------------------------------
+# BMU 搜尋 / 訓練
+# ------------------------------------------------------------
+def best_matching_units(X, W, batch_rows=BMU_BATCH_ROWS):
+    """
+    每個 vector 的 BMU 與到 BMU 的歐氏距離（float64）
+    分塊做 ||x||² - 2·x·Wᵀ + ||w||²（GEMM），距離再以 x - w 重算一次，不受 float32 相消誤差影響
+    """
+    n_rows = X.shape[0]
+    bmu = np.empty(n_rows, dtype=np.int64)
+    dist = np.empty(n_rows, dtype=np.float64)
+    w_sq = np.einsum("ij,ij->i", W, W)
+    for start in range(0, n_rows, batch_rows):
+        block = X[start:start + batch_rows]
+        scores = w_sq - 2.0 * (block @ W.T)
+        winners = np.argmin(scores, axis=1)
+        diff = block.astype(np.float64) - W[winners]
+        bmu[start:start + len(block)] = winners
+        dist[start:start + len(block)] = np.sqrt(np.einsum("ij,ij->i", diff, diff))
+    return bmu, dist
+
+
+def grid_coordinates(x_dim, y_dim):
+    # unit 順序與 .unit 檔相同：x 先變（(0,0), (1,0), ..., (0,1), ...）
+    ys, xs = np.divmod(np.arange(x_dim * y_dim), x_dim)
+    return np.column_stack([xs, ys]).astype(np.float32)
+
+
+def training_schedule(n_rows, params):
+    """
+    (iterations, batch, early_stopping)：fixed → numIterations / TRAIN_BATCH；adaptive → 依 vectors 數
+    """
+    if params["schedule"] == "adaptive":
+        iterations = int(np.clip(ADAPTIVE_EPOCHS * n_rows, ADAPTIVE_MIN_ITERATIONS, ADAPTIVE_MAX_ITERATIONS))
+        batch = int(np.clip(n_rows // ADAPTIVE_BATCH_DIVISOR, ADAPTIVE_MIN_BATCH, ADAPTIVE_MAX_BATCH))
+        return iterations, batch, True
+    return params["iterations"], TRAIN_BATCH, False
+
+
+def train_map(X, W, x_dim, y_dim, iterations, learn_rate, rng, batch=TRAIN_BATCH, early_stopping=False):
+    """
+    mini-batch SOM，就地更新 W（k × dim，float32）
+    每一步：整批 vector 的 BMU（一次 GEMM）→ neighbourhood 加權平均 → 每個 unit 往平均移動
+    移動比例 1 - (1 - lr)^(neighbourhood 權重和)，等於把這批 vector 依序做 online update 的近似
+    每 1/QE_CHECKS 的進度在固定子集（等距取列，不消耗亂數）上算一次平均 QE
+    回傳 { "iterations"（實際訓練的 vector 數）, "qe_trajectory", "stopped_early" }
+    """
+    coords = grid_coordinates(x_dim, y_dim)
+    grid_sq = ((coords[:, None, :] - coords[None, :, :]) ** 2).sum(axis=2)
+    sigma0 = max(1.0, max(x_dim, y_dim) / 2.0)
+    steps = max(1, -(-iterations // batch))
+    check_every = max(1, steps // QE_CHECKS)
+    sample = X[np.unique(np.linspace(0, X.shape[0] - 1, min(X.shape[0], QE_SAMPLE_ROWS)).astype(np.int64))]
+
+    used, stalled, trajectory = 0, 0, []
+    for step in range(steps):
+        progress = step / steps
+        lr = learn_rate * LEARN_RATE_FINAL_RATIO ** progress
+        sigma = sigma0 * (SIGMA_FINAL / sigma0) ** progress
+
+        xb = X[rng.integers(0, X.shape[0], size=min(batch, iterations - step * batch))]
+        winners = np.argmin(np.einsum("ij,ij->i", W, W) - 2.0 * (xb @ W.T), axis=1)
+        h = np.exp(-grid_sq[winners] / (2.0 * sigma * sigma)).astype(np.float32)
+
+        mass = h.sum(axis=0)
+        active = mass > 1e-6
+        target = (h[:, active].T @ xb) / mass[active, None]
+        rate = 1.0 - (1.0 - lr) ** mass[active]
+        W[active] += rate[:, None].astype(np.float32) * (target - W[active])
+        used += len(xb)
+
+        if (step + 1) % check_every == 0 or step == steps - 1:
+            qe = float(best_matching_units(sample, W)[1].mean())
+            if trajectory and trajectory[-1] - qe < CONVERGENCE_TOL * trajectory[-1]:
+                stalled += 1
+            else:
+                stalled = 0
+            trajectory.append(qe)
+            if early_stopping and stalled >= CONVERGENCE_PATIENCE and step < steps - 1:
+                return {"iterations": used, "qe_trajectory": trajectory, "stopped_early": True}
+    return {"iterations": used, "qe_trajectory": trajectory, "stopped_early": False}
+
+
+def map_errors(bmu, dist, n_units):
+    counts = np.bincount(bmu, minlength=n_units)
+    qe = np.bincount(bmu, weights=dist, minlength=n_units)
+    mqe = np.divide(qe, counts, out=np.zeros(n_units), where=counts > 0)
+    return counts, qe, mqe
+
+
+def insert_units(W, x_dim, y_dim, error_unit):
+    """
+    error 最大的 unit 與它權重最不像的鄰居之間插入一行（左右鄰居）或一列（上下鄰居）
+    新 unit 的權重 = 兩側的平均；回傳 (W, x_dim, y_dim)，沒有鄰居（1 × 1）→ None
+    """
+    grid = W.reshape(y_dim, x_dim, -1)
+    ey, ex = divmod(error_unit, x_dim)
+    neighbours = [(nx, ny) for nx, ny in ((ex - 1, ey), (ex + 1, ey), (ex, ey - 1), (ex, ey + 1))
+                  if 0 <= nx < x_dim and 0 <= ny < y_dim]
+    if not neighbours:
+        return None
+    nx, ny = max(neighbours, key=lambda p: float(np.linalg.norm(grid[ey, ex] - grid[p[1], p[0]])))
+
+    if nx != ex:
+        left = min(ex, nx)
+        new = (grid[:, left] + grid[:, left + 1]) / 2
+        grid = np.concatenate([grid[:, :left + 1], new[:, None], grid[:, left + 1:]], axis=1)
+        x_dim += 1
+    else:
+        top = min(ey, ny)
+        new = (grid[top] + grid[top + 1]) / 2
+        grid = np.concatenate([grid[:top + 1], new[None], grid[top + 1:]], axis=0)
+        y_dim += 1
+    return np.ascontiguousarray(grid.reshape(x_dim * y_dim, -1)), x_dim, y_dim
+
+
+def grow_map(X, parent_qe, params, rng):
+    """
+    一張 map 的水平成長：訓練 → map MQE < tau1 × parent unit 的 qe 就停，否則插入一行 / 一列再訓練
+    回傳 map dict（weights / 大小 / 每個 vector 的 BMU 與距離 / 每次訓練的 schedule 紀錄）
+    """
+    x_dim, y_dim = params["x_size"], params["y_size"]
+    n_units = x_dim * y_dim
+    W = X[rng.choice(X.shape[0], n_units, replace=X.shape[0] < n_units)].astype(np.float32)
+    iterations, batch, early_stopping = training_schedule(X.shape[0], params)
+
+    cycles = []
+    while True:
+        cycles.append(train_map(X, W, x_dim, y_dim, iterations, params["learn_rate"], rng,
+                                batch, early_stopping))
+        bmu, dist = best_matching_units(X, W)
+        counts, qe, mqe = map_errors(bmu, dist, x_dim * y_dim)
+        map_mqe = float(qe[counts > 0].mean())
+        if map_mqe < params["tau1"] * parent_qe or x_dim * y_dim >= X.shape[0]:
+            break
+        grown = insert_units(W, x_dim, y_dim, int(np.argmax(qe)))
+        if grown is None:
+            break
+        W, x_dim, y_dim = grown
+
+    return {"weights": W, "x_dim": x_dim, "y_dim": y_dim, "bmu": bmu, "dist": dist,
+            "counts": counts, "qe": qe, "mqe": mqe, "batch": batch, "cycles": cycles}
+
+
+# ------------------------------------------------------------
+# 輸出（somtoolbox 格式）
+# ------------------------------------------------------------
+def submap_name(prefix, path):
+    """
+    path : 從第一層開始，每層 parent unit 的 (x, y)
+    """
+    level = len(path) + 1
+    return f"{prefix}_submap_lvl{level}_" + "_".join(f"{x}x{y}" for x, y in path)
+
+
+def write_unit_file(path, prefix, som, names, children):
+    """
+    children : { unit index : 子 map 名稱 }
+    UNIT_ID 沿用第一層的 prefix（與 somtoolbox 相同）
+    """
+    x_dim, y_dim = som["x_dim"], som["y_dim"]
+    order = np.argsort(som["bmu"], kind="stable")
+    bounds = np.r_[0, np.cumsum(som["counts"])]
+
+    with gzip.open(path, "wt", encoding="utf-8", compresslevel=6) as f:
+        f.write(f"$TYPE som\n$GRID_LAYOUT rectangular\n$GRID_TOPOLOGY planar\n$FILE_FORMAT_VERSION 1.2\n"
+                f"$XDIM {x_dim}\n$YDIM {y_dim}\n")
+        for unit in range(x_dim * y_dim):
+            y, x = divmod(unit, x_dim)
+            f.write(f"$POS_X {x}\n$POS_Y {y}\n$UNIT_ID {prefix}_({x}/{y})\n"
+                    f"$QUANTERROR_UNIT {float(som['qe'][unit])!r}\n"
+                    f"$QUANTERROR_UNIT_AVG {float(som['mqe'][unit])!r}\n"
+                    f"$NR_VEC_MAPPED {int(som['counts'][unit])}\n")
+            members = order[bounds[unit]:bounds[unit + 1]]
+            if len(members):
+                f.write("$MAPPED_VECS\n")
+                f.write("\n".join(names[members]))
+                f.write("\n$MAPPED_VECS_DIST " + " ".join(map(repr, som["dist"][members].tolist())) + "\n")
+            if unit in children:
+                f.write(f"$NR_SOMS_MAPPED 1\n$URL_MAPPED_SOMS {children[unit]}\n")
+
+
+def write_weight_file(path, prefix, som):
+    x_dim, y_dim = som["x_dim"], som["y_dim"]
+    W = som["weights"].astype(np.float64)
+    with gzip.open(path, "wt", encoding="utf-8", compresslevel=6) as f:
+        f.write(f"$TYPE som\n$GRID_LAYOUT rectangular\n$GRID_TOPOLOGY planar\n"
+                f"$XDIM {x_dim}\n$YDIM {y_dim}\n$ZDIM 1\n$VEC_DIM {W.shape[1]}\n")
+        for unit in range(x_dim * y_dim):
+            y, x = divmod(unit, x_dim)
+            f.write(" ".join(map(repr, W[unit].tolist())) + f" SOM_MAP_{prefix}_({x}/{y}/0)\n")
+
+
+def write_map_file(path, som, params, n_vectors, vector_file, base):
+    quanterror_map = float(som["qe"].mean())
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"$TYPE som\n$GRID_TOPOLOGY planar\n$GRID_LAYOUT rectangular\n"
+                f"$XDIM {som['x_dim']}\n$YDIM {som['y_dim']}\n$ZDIM 1\n$VEC_DIM {som['weights'].shape[1]}\n"
+                f"$STORAGE_DATE {time.strftime('%m/%d/%y, %I:%M %p')}\n"
+                f"$LEARNRATE_TYPE exponential\n$LEARNRATE_INIT {params['learn_rate']}\n"
+                f"$NEIGHBORHOOD_TYPE exponential\n$NEIGHBORHOOD_INIT 1.0\n"
+                f"$RAND_INIT {params['seed']}\n$ITERATIONS_TOTAL {sum(c['iterations'] for c in som['cycles'])}\n"
+                f"$NR_TRAINVEC_TOTAL {n_vectors}\n$VEC_NORMALIZED false\n"
+                f"$QUANTERROR_MAP {quanterror_map!r}\n$QUANTERROR_VEC {quanterror_map / n_vectors!r}\n"
+                f"$URL_TRAINING_VEC {vector_file}\n$URL_WEIGHT_VEC {base}.wgt\n$URL_UNIT_DESCR {base}.unit\n"
+                f"$METRIC L2Metric\n$DATA_TYPE unknown\n")
+
+
+def write_som(output_dir, name, prefix, som, names, children, params, vector_file):
+    base = os.path.join(output_dir, name)
+    write_unit_file(base + ".unit.gz", prefix, som, names, children)
+    write_weight_file(base + ".wgt.gz", prefix, som)
+    write_map_file(base + ".map", som, params, len(som["bmu"]), vector_file, base)
+
+
+# ------------------------------------------------------------
+# Map cache（tau2 sweep 的 warm start）
+# ------------------------------------------------------------
+# 一張 map 的訓練結果只由 (它的 vectors, parent unit 的 qe, 亂數) 決定：
+#   vectors   ← .in 內容 + parent unit 路徑（路徑上每張 map 的結果）
+#   parent qe ← 同上
+#   亂數      ← (randomSeed, 路徑)
+# tau2 只決定哪些 unit 要展開，不影響已經訓練的 map → 只有 tau2 不同的 job，
+# 相同路徑的 map 完全一樣。訓練完的 weights 以
+#   job_fingerprint(.in 的 sha256, seed / tau1 / 大小 / learn rate / iterations / schedule)
+# cache 在 web/cache/ghsom_maps/<fingerprint>/<路徑>.npz；cache hit → 不訓練，
+# 只重算一次 BMU（與訓練完的最後一次 BMU 相同）。
+# 10 個 tau2 的 sweep 只訓練一次第一層（較小的 tau2 多展開的子 map 也會留給之後的 job）。
+# MAP_CACHE_VERSION：訓練演算法改變時加一，舊的 cache 就不會被用到
+MAP_CACHE_DIR = os.path.join(CACHE_DIR, "ghsom_maps")
+MAP_CACHE_VERSION = 1
+
+
+def map_cache_fingerprint(data_hash, params):
+    keys = ("seed", "tau1", "x_size", "y_size", "learn_rate", "iterations", "schedule")
+    return job_fingerprint(data_hash, dict({key: params[key] for key in keys},
+                                           stage="ghsom_map", version=MAP_CACHE_VERSION))
+
+
+def map_cache_path(cache_dir, path):
+    return os.path.join(cache_dir, ("_".join(f"{x}x{y}" for x, y in path) or "root") + ".npz")
+
+
+def save_cached_map(cache_path, som):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    # 同一份資料的兩個 job 可能同時在訓練同一張 map → 暫存檔名不能撞
+    tmp_path = f"{cache_path}.{uuid.uuid4().hex[:8]}.tmp.npz"
+    np.savez(tmp_path, weights=som["weights"], x_dim=som["x_dim"], y_dim=som["y_dim"],
+             batch=som["batch"], vectors=len(som["bmu"]), cycles=json.dumps(som["cycles"]))
+    os.replace(tmp_path, cache_path)
+
+
+def load_cached_map(cache_path, X):
+    """
+    cache 的 weights → 與 grow_map 相同的 map dict；沒有 / 讀不了 / vectors 數不同 → None
+    """
+    try:
+        with np.load(cache_path, allow_pickle=False) as z:
+            if int(z["vectors"]) != X.shape[0] or z["weights"].shape[1] != X.shape[1]:
+                return None
+            W = z["weights"]
+            x_dim, y_dim, batch = int(z["x_dim"]), int(z["y_dim"]), int(z["batch"])
+            cycles = json.loads(str(z["cycles"]))
+    except (OSError, KeyError, ValueError):
+        return None
+    bmu, dist = best_matching_units(X, W)
+    counts, qe, mqe = map_errors(bmu, dist, x_dim * y_dim)
+    return {"weights": W, "x_dim": x_dim, "y_dim": y_dim, "bmu": bmu, "dist": dist,
+            "counts": counts, "qe": qe, "mqe": mqe, "batch": batch, "cycles": cycles}
+
+
+# ------------------------------------------------------------
+# 階層
+# ------------------------------------------------------------
+# 一張 map 訓練完後，每個展開的 unit 的子 map 只依賴 mapped 到那個 unit 的 vectors，
+# 兄弟子樹之間完全獨立 → workers > 1 時分派到 process pool 同時訓練：
+#   - 第一層在主 process 訓練，子 map 依 vectors 數由大到小送進 pool
+#   - worker 訓練完一張 map，vectors ≥ PARALLEL_SPLIT_ROWS 的子 map 回傳給主 process 再分派，
+#     較小的子樹直接在同一個 worker 內遞迴（小 map 只要幾 ms，不值得來回傳送）
+#   - vectors 存成 .npy 讓 worker memory-map（不必 pickle 整份 X），跑完刪掉
+#   - 每個 worker 的 BLAS threads = CPU 數 / workers，避免 oversubscription
+# 每張 map 的檔案由訓練它的 process 寫，$URL_MAPPED_SOMS 的名稱由路徑決定 → 結果與 workers 數無關
+PARALLEL_SPLIT_ROWS = 5000
+TRAIN_VECTORS_SUFFIX = "_train_vectors.npy"
+TRAIN_NAMES_SUFFIX = "_train_names.npy"
+
+_WORKER = {}
+
+
+def map_report(name, path, som):
+    """
+    一張 map 的訓練紀錄（training.json）：每次訓練（成長前後各一次）的 iteration 數與 QE trajectory
+    """
+    cycles = som["cycles"]
+    return {
+        "name": name,
+        "level": len(path) + 1,
+        "vectors": int(len(som["bmu"])),
+        "x_dim": som["x_dim"],
+        "y_dim": som["y_dim"],
+        "growth_steps": len(cycles) - 1,
+        "batch": som["batch"],
+        "iterations": int(sum(c["iterations"] for c in cycles)),
+        "stopped_early": int(sum(c["stopped_early"] for c in cycles)),
+        "mqe": round(float(som["dist"].mean()), 6),
+        "cached": bool(som.get("cached", False)),
+        "qe_trajectory": [[round(v, 6) for v in c["qe_trajectory"]] for c in cycles],
+    }
+
+
+def train_one_map(X, names, task, job):
+    """
+    task : (子 map 的 vectors（X 的列）, parent unit 的 qe, parent unit 路徑)
+    job  : { params, prefix, expand_qe, output_dir, vector_file, cache_dir }
+    訓練一張 map（cache_dir 有這張 map → 直接用）→ 決定要展開的 unit → 寫檔；
+    回傳 (子 map 的 task list, 訓練紀錄)
+    """
+    rows, parent_qe, path = task
+    params, prefix = job["params"], job["prefix"]
+    X_map = np.asarray(X[rows])
+    cache_path = map_cache_path(job["cache_dir"], path) if job["cache_dir"] else None
+    som = load_cached_map(cache_path, X_map) if cache_path else None
+    if som is not None:
+        som["cached"] = True
+    else:
+        rng = np.random.default_rng([params["seed"], *[v for xy in path for v in xy]])
+        som = grow_map(X_map, parent_qe, params, rng)
+        if cache_path:
+            save_cached_map(cache_path, som)
+
+    children, tasks = {}, []
+    if len(path) + 1 < MAX_LEVELS:
+        for unit in np.flatnonzero((som["qe"] >= job["expand_qe"]) & (som["qe"] > 0) & (som["counts"] > 1)):
+            if som["counts"][unit] == len(rows) and path:
+                # 子 map 沒有把 vectors 分開（全部在同一個 unit）→ 再展開也一樣，停在這裡
+                continue
+            y, x = divmod(int(unit), som["x_dim"])
+            child_path = path + ((x, y),)
+            children[int(unit)] = submap_name(prefix, child_path)
+            tasks.append((rows[som["bmu"] == unit], float(som["qe"][unit]), child_path))
+
+    name = prefix if not path else submap_name(prefix, path)
+    write_som(job["output_dir"], name, prefix, som, names[rows], children, params, job["vector_file"])
+    return tasks, map_report(name, path, som)
+
+
+def train_subtree(X, names, task, job, split_rows=None, on_map=None):
+    """
+    task 的 map 與它的子樹（depth-first）；split_rows 有給 → vectors ≥ split_rows 的子 map 不在這裡訓練，
+    回傳給呼叫端分派；回傳 (未訓練的 task list, 訓練紀錄 list)
+    on_map : 每張 map 訓練完呼叫 on_map(report)（只在 parent process）
+    """
+    returned, reports = [], []
+    stack = [task]
+    while stack:
+        tasks, report = train_one_map(X, names, stack.pop(), job)
+        reports.append(report)
+        if on_map is not None:
+            on_map(report)
+        for child in tasks:
+            if split_rows is not None and len(child[0]) >= split_rows:
+                returned.append(child)
+            else:
+                stack.append(child)
+    return returned, reports
+
+
+def _init_worker(vectors_path, names_path, blas_threads):
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=blas_threads)
+    except ImportError:
+        pass
+    _WORKER["X"] = np.load(vectors_path, mmap_mode="r")
+    _WORKER["names"] = np.load(names_path, mmap_mode="r").astype(object)
+
+
+def _train_subtree_in_worker(task, job):
+    return train_subtree(_WORKER["X"], _WORKER["names"], task, job, PARALLEL_SPLIT_ROWS)
+
+
+def train_children_parallel(X, names, tasks, job, workers, on_map=None):
+    """
+    第一層的子 map（tasks）分派到 workers 個 process；回傳訓練紀錄 list
+    on_map : worker 送回一棵子樹時，對其中每張 map 呼叫 on_map(report)
+    """
+    base = os.path.join(os.path.dirname(job["vector_file"]) or ".", job["prefix"])
+    vectors_path, names_path = base + TRAIN_VECTORS_SUFFIX, base + TRAIN_NAMES_SUFFIX
+    np.save(vectors_path, X)
+    np.save(names_path, np.asarray(names, dtype=str))
+
+    reports = []
+    blas_threads = max(1, (os.cpu_count() or 1) // workers)
+    try:
+        with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                 initargs=(vectors_path, names_path, blas_threads)) as pool:
+            running = set()
+
+            def submit(pending):
+                # vectors 多的子樹先送（最慢的先開始，尾端比較不會只剩一個 worker 在跑）
+                for task in sorted(pending, key=lambda t: len(t[0]), reverse=True):
+                    running.add(pool.submit(_train_subtree_in_worker, task, job))
+
+            submit(tasks)
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    running.discard(future)
+                    pending, subtree_reports = future.result()
+                    reports.extend(subtree_reports)
+                    if on_map is not None:
+                        for report in subtree_reports:
+                            on_map(report)
+                    submit(pending)
+    finally:
+        for path in (vectors_path, names_path):
+            if os.path.exists(path):
+                os.remove(path)
+    return reports
+
+
+def train_hierarchy(X, names, params, output_dir, vector_file="", workers=1, cache_dir=None,
+                    on_map=None):
+    """
+    整棵 GHSOM；每張 map 訓練完馬上寫檔
+    每張 map 的亂數由 (randomSeed, parent unit 路徑) 決定，與訓練順序 / workers 數無關
+    workers > 1 → 第一層以下的子 map 分派到 process pool
+    cache_dir : 這份 .in + 訓練參數的 map cache（None → 不讀也不寫 cache）
+    on_map : 每張 map 訓練完呼叫 on_map(report, qe0)（training.json 的那筆紀錄；訓練進度用）
+    每張 map 的 iteration 數 / QE trajectory 寫到 <output_dir>/<prefix>_training.json
+    回傳 { "maps", "levels", "qe0", "workers", "schedule", "iterations", "maps_stopped_early",
+           "maps_cached", "report" }
+    """
+    prefix = params["name_prefix"]
+    mean = X.mean(axis=0, dtype=np.float64)
+    qe0 = float(sum(np.linalg.norm(X[start:start + BMU_BATCH_ROWS] - mean, axis=1).sum()
+                    for start in range(0, X.shape[0], BMU_BATCH_ROWS)))
+    print(f"[INFO] NumPy GHSOM: {X.shape[0]} vectors x {X.shape[1]} dims, qe0 = {qe0:.6g}")
+
+    job = {"params": params, "prefix": prefix, "expand_qe": params["tau2"] * qe0,
+           "output_dir": output_dir, "vector_file": vector_file, "cache_dir": cache_dir}
+    root = (np.arange(X.shape[0]), qe0, ())
+    report_map = None if on_map is None else (lambda report: on_map(report, qe0))
+    if workers <= 1:
+        _, reports = train_subtree(X, names, root, job, on_map=report_map)
+    else:
+        tasks, reports = train_subtree(X, names, root, job, split_rows=0, on_map=report_map)
+        if tasks:
+            print(f"[INFO] Training {len(tasks)} child maps on {workers} processes")
+            reports += train_children_parallel(X, names, tasks, job, workers, report_map)
+
+    reports.sort(key=lambda r: (r["level"], r["name"]))
+    report_path = os.path.join(output_dir, prefix + TRAINING_REPORT_SUFFIX)
+    with open(report_path, "w") as f:
+        json.dump({"schedule": params["schedule"], "tau1": params["tau1"], "tau2": params["tau2"],
+                   "qe0": qe0, "maps": reports}, f, indent=4)
+
+    return {
+        "maps": len(reports),
+        "levels": max(r["level"] for r in reports),
+        "qe0": qe0,
+        "workers": max(1, workers),
+        "schedule": params["schedule"],
+        "iterations": sum(r["iterations"] for r in reports),
+        "maps_stopped_early": sum(1 for r in reports if r["stopped_early"]),
+        "maps_cached": sum(1 for r in reports if r["cached"]),
+        "report": report_path,
+    }
+
+
+def resolve_workers(workers):
+    # 0 / None → 全部 CPU
+    if not workers:
+        return os.cpu_count() or 1
+    return max(1, int(workers))
+
+
+def train_ghsom(prop_path, workers=1, schedule="fixed", map_cache=True, on_map=None):
+    """
+    somtoolbox.sh GHSOM <prop> 的替代：讀 .prop / .in，輸出寫到 outputDirectory
+    workers   : 同時訓練子 map 的 process 數（1 → 單一 process；0 → CPU 數）
+    schedule  : "fixed" → 每張 map numIterations；"adaptive" → 依 map 的 vectors 數 + QE 收斂提前停止
+    map_cache : 相同 .in / seed / tau1 / 訓練參數已訓練過的 map 直接沿用（只有 tau2 不同的 job）；
+                結果與重新訓練相同，False → 全部重新訓練（benchmark 量訓練時間用）
+    on_map    : 每張 map 訓練完呼叫 on_map(report, qe0)（train_monitor.record_map）
+    回傳 train_hierarchy 的 stats + "seconds"
+    """
+    if schedule not in SCHEDULES:
+        raise ValueError(f"Unknown training schedule '{schedule}', choose from {list(SCHEDULES)}")
+    start = time.perf_counter()
+    params = dict(read_prop(prop_path), schedule=schedule)
+    X, names = read_input_vectors(params["vector_file"])
+    os.makedirs(params["output_dir"], exist_ok=True)
+
+    cache_dir = None
+    if map_cache:
+        cache_dir = os.path.join(MAP_CACHE_DIR, map_cache_fingerprint(file_sha256(params["vector_file"]), params))
+        if os.path.exists(map_cache_path(cache_dir, ())):
+            print(f"[CACHE HIT] Reusing trained GHSOM maps from {cache_dir}")
+
+    stats = train_hierarchy(X, names, params, params["output_dir"], params["vector_file"],
+                            resolve_workers(workers), cache_dir, on_map)
+    stats["seconds"] = round(time.perf_counter() - start, 3)
+    print(f"[OK] NumPy GHSOM: {stats['maps']} maps ({stats['maps_cached']} from cache), {stats['levels']} levels, "
+          f"{stats['iterations']} iterations ({stats['schedule']}, {stats['maps_stopped_early']} maps stopped early) "
+          f"in {stats['seconds']}s → {params['output_dir']}")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train a GHSOM with the NumPy engine (somtoolbox.sh GHSOM replacement)')
+    parser.add_argument('prop', type=str, help='the .prop file written by create_ghsom_prop_file')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processes training sibling child maps in parallel (0 = all CPUs)')
+    parser.add_argument('--schedule', type=str, default='fixed', choices=list(SCHEDULES),
+                        help='fixed: numIterations per map; adaptive: sized to each map, stops when QE plateaus')
+    parser.add_argument('--no_map_cache', action='store_true',
+                        help='retrain every map instead of reusing maps cached by earlier runs on the same data')
+    args = parser.parse_args()
+    try:
+        train_ghsom(args.prop, args.workers, args.schedule, not args.no_map_cache)
+    except (OSError, KeyError, ValueError) as e:
+        print("Error:", e)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
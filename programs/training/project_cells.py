@@ -0,0 +1,145 @@
+import os
+import re
+from fractions import Fraction
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from programs.training.numpy_ghsom import best_matching_units
+from programs.data_processing.ghsom_output import open_ghsom_output, read_unit_file
+
+
+# ============================================================
+# ⭐ 抽樣訓練 → 其餘 cell 投影到訓練好的階層
+# ============================================================
+# 百萬 cell 的資料只需要 subnum（uniform / sketch）個 cell 讓 GHSOM 學到結構；
+# 沒被抽到的 cell 從第一層開始往下走：
+#   1. 在目前這張 map 的 .wgt prototypes 中找 BMU（分塊 GEMM，與 numpy 引擎相同）
+#   2. BMU 有子 map（.unit 的 $URL_MAPPED_SOMS）→ 到子 map 繼續找，沒有 → 停在這個 leaf
+# 每張 map 一次處理所有走到它的 cell。label 欄位的格式與 save_cluster_with_clustered_label 相同：
+#   clustered_label : 每層 "XDIM;YDIM;x;y;" 串起來
+#   x_y_label       : 每層 "-<x>x<y>" 串起來；clusterL<e> 是第 e 層的 "<x>x<y>"
+#   point_x / y     : GHSOM_center_point（Fraction）
+# 直接讀 .wgt.gz / .unit.gz（舊 job 已解壓的 .wgt / .unit 也可以），somtoolbox 與 numpy 引擎的輸出都可以用
+WEIGHT_LABEL = re.compile(r"\((\d+)/(\d+)/\d+\)$")
+
+
+def read_weight_file(path):
+    """
+    .wgt → (unit × dim 的 float64 weights（x 先變，與 .unit 相同）, XDIM, YDIM)
+    unit 的位置以每列最後的 SOM_MAP_<prefix>_(x/y/z) 為準
+    """
+    header, rows = {}, []
+    with open_ghsom_output(path) as f:
+        for line in f:
+            tokens = line.split()
+            if not tokens:
+                continue
+            if tokens[0].startswith("$"):
+                header[tokens[0]] = tokens[1:]
+                continue
+            match = WEIGHT_LABEL.search(tokens[-1])
+            if match is None:
+                raise ValueError(f"Unexpected weight vector label '{tokens[-1]}' in {path}")
+            rows.append((int(match.group(1)), int(match.group(2)), tokens[:-1]))
+
+    x_dim, y_dim = int(header["$XDIM"][0]), int(header["$YDIM"][0])
+    W = np.empty((x_dim * y_dim, len(rows[0][2])), dtype=np.float64)
+    for x, y, values in rows:
+        W[y * x_dim + x] = np.asarray(values, dtype=np.float64)
+    return W, x_dim, y_dim
+
+
+def read_unit_children(path):
+    """
+    .unit → { unit index（y * XDIM + x）: 子 map 名稱 }
+    """
+    header, units = read_unit_file(path)
+    x_dim = int(header["$XDIM"])
+    return {unit["y"] * x_dim + unit["x"]: unit["child"] for unit in units if unit["child"] is not None}
+
+
+def load_map(output_dir, name, maps):
+    if name not in maps:
+        base = os.path.join(output_dir, name)
+        W, x_dim, y_dim = read_weight_file(base + ".wgt")
+        maps[name] = {"weights": W, "x_dim": x_dim, "y_dim": y_dim,
+                      "children": read_unit_children(base + ".unit")}
+    return maps[name]
+
+
+def center_point(dimension_list):
+    # 與 save_cluster_with_clustered_label.GHSOM_center_point 相同
+    Bx = By = Fraction(1)
+    Px = Py = Fraction(0)
+    for x_dim, y_dim, x, y in dimension_list:
+        Bx *= Fraction(1, int(x_dim))
+        By *= Fraction(1, int(y_dim))
+        Px += Bx * int(x)
+        Py += By * int(y)
+    return [Px + Bx * Fraction(1, 2), Py + By * Fraction(1, 2)]
+
+
+def descend(X, output_dir, prefix, maps=None):
+    """
+    X : n × dim（與 .in 相同的 feature 空間）→ 每列的 leaf label（dict of object arrays）
+    """
+    maps = {} if maps is None else maps
+    n_rows = X.shape[0]
+    labels = {"clustered_label": np.full(n_rows, np.nan, dtype=object),
+              "x_y_label": np.full(n_rows, np.nan, dtype=object),
+              "point_x": np.full(n_rows, np.nan, dtype=object),
+              "point_y": np.full(n_rows, np.nan, dtype=object)}
+
+    # (map 名稱, 走到這張 map 的列, 上層的 [XDIM, YDIM, x, y] list)
+    stack = [(prefix, np.arange(n_rows), [])]
+    while stack:
+        name, rows, dimensions = stack.pop()
+        som = load_map(output_dir, name, maps)
+        bmu, _ = best_matching_units(X[rows], som["weights"])
+        for unit in np.unique(bmu):
+            members = rows[bmu == unit]
+            y, x = divmod(int(unit), som["x_dim"])
+            path = dimensions + [[som["x_dim"], som["y_dim"], x, y]]
+            if int(unit) in som["children"]:
+                stack.append((som["children"][int(unit)], members, path))
+                continue
+            labels["clustered_label"][members] = "".join(f"{a};{b};{c};{d};" for a, b, c, d in path)
+            labels["x_y_label"][members] = "".join(f"-{c}x{d}" for _, _, c, d in path)
+            for level, (_, _, c, d) in enumerate(path, start=1):
+                column = labels.setdefault(f"clusterL{level}", np.full(n_rows, np.nan, dtype=object))
+                column[members] = f"{c}x{d}"
+            point = center_point(path)
+            for column, value in zip(("point_x", "point_y"), point):
+                # 每個 cell 一個 Fraction（與 df.loc[index, 'point_x'] = point[0] 相同）
+                labels[column][members] = [value] * len(members)
+    return labels
+
+
+def project_cells(output_dir, prefix, blocks, rows, decimals=None):
+    """
+    blocks   : 依序產生全部 cell 的 feature block（DataFrame / ndarray / csr_matrix，與寫 .in 時相同的值）
+    rows     : 要投影的 raw-data 列（sorted，通常是沒被抽到訓練的 cell）
+    decimals : .in 有 round → 投影前也 round 到同樣的位數
+    回傳 DataFrame（index = rows）：clustered_label / x_y_label / clusterL* / point_x / point_y
+    """
+    maps, parts = {}, []
+    row_start = 0
+    for block in blocks:
+        row_stop = row_start + block.shape[0]
+        lo, hi = np.searchsorted(rows, [row_start, row_stop])
+        if hi > lo:
+            picked = rows[lo:hi] - row_start
+            if sparse.issparse(block):
+                X = block[picked].toarray().astype(np.float64)
+            else:
+                X = np.asarray(block, dtype=np.float64)[picked]
+            if decimals is not None:
+                X = X.round(decimals)
+            parts.append(pd.DataFrame(descend(X, output_dir, prefix, maps), index=rows[lo:hi]))
+        row_start = row_stop
+
+    if not parts:
+        return pd.DataFrame(index=rows)
+    projected = pd.concat(parts)
+    level_columns = sorted((c for c in projected.columns if c.startswith("clusterL")), key=lambda c: int(c[8:]))
+    return projected[["clustered_label", "x_y_label", *level_columns, "point_x", "point_y"]]
@@ -0,0 +1,230 @@
+import os
+import json
+import time
+import signal
+import threading
+import subprocess
+
+
+# ============================================================
+# ⭐ 訓練 process 的進度與資源上限
+# ============================================================
+# somtoolbox 以前用 os.system 跑：40 分鐘的訓練中看不到進度，也沒辦法 timeout / kill。
+# 這裡改成 managed subprocess：
+#   - stdout / stderr 一行一行讀（照舊印到 worker log），最後 LOG_TAIL 行與行數記進 progress
+#     somtoolbox 的 log 文字沒有固定格式，這裡不從 log 猜 map 數 / 層數 / QE；
+#     只記錄量得到的東西：elapsed、process group 的 RSS、exit code、log tail
+#   - numpy 引擎（programs/training/numpy_ghsom.py）每訓練完一張 map 就回呼 record_map：
+#     maps_trained / depth / map 大小 / MQE 是實際訓練紀錄，不是 parse 出來的
+#   - 進度 snapshot 寫到 job 資料夾的 train_progress.json（tmp + os.replace），web app 直接讀
+#   - timeout_s：wall-clock 上限；memory_mb：整個 process group（somtoolbox.sh + JVM）的 RSS 上限
+#     超過 → SIGTERM 整個 process group，KILL_GRACE_S 秒後 SIGKILL
+# 常駐 JVM service（jvm_service.py）用同一個 log tail 與上限；memory 只算 TRAIN 之後 RSS 增加的部分
+PROGRESS_NAME = "train_progress.json"
+POLL_INTERVAL = 1.0
+KILL_GRACE_S = 10
+LOG_TAIL = 20
+MAX_EVENTS = 50
+
+
+def progress_path(app_path):
+    return os.path.join(app_path, PROGRESS_NAME)
+
+
+def new_progress(path, job, engine, mode, timeout_s=None, memory_mb=None):
+    """
+    一個 job 的訓練進度（dict；monitor 與 reader thread 共用，改之前先拿 progress["lock"]）
+    """
+    return {
+        "path": path,
+        "lock": threading.Lock(),
+        "started": time.perf_counter(),
+        "state": {
+            "job": job,
+            "engine": engine,
+            "mode": mode,                   # "launch"（somtoolbox.sh）/ "service"（常駐 JVM）/ "numpy"
+            "status": "running",            # running → finished / failed / killed
+            "pid": None,
+            "started_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "updated_at": None,
+            "elapsed_s": 0.0,
+            # numpy 引擎的訓練紀錄（record_map）；somtoolbox → 維持 None
+            "maps_trained": None,
+            "depth": None,                  # 最近訓練完的 map 在第幾層
+            "max_depth": None,
+            "map_size": None,
+            "qe": {},                       # qe0 與最近訓練完的 map 的 mqe
+            "log_lines": 0,
+            "log_tail": [],                 # 最後 LOG_TAIL 行 log（原文）
+            "limits": {"timeout_s": timeout_s, "memory_mb": memory_mb},
+            "rss_mb": None,
+            "peak_rss_mb": None,
+            "rss_baseline_mb": None,        # 常駐 JVM：TRAIN 前 service 已經有的 RSS
+            "exit_code": None,
+            "error": None,
+            "events": [],                   # 最近 MAX_EVENTS 張訓練完的 map（numpy 引擎）
+        },
+    }
+
+
+def record_line(progress, line):
+    line = line.strip()
+    if not line:
+        return
+    with progress["lock"]:
+        state = progress["state"]
+        state["log_lines"] += 1
+        state["log_tail"].append(line[-500:])
+        del state["log_tail"][:-LOG_TAIL]
+
+
+def record_map(progress, report, qe0=None):
+    """
+    numpy 引擎訓練完一張 map（numpy_ghsom.map_report）→ 更新 progress 並寫檔
+    """
+    elapsed = round(time.perf_counter() - progress["started"], 2)
+    with progress["lock"]:
+        state = progress["state"]
+        state["maps_trained"] = (state["maps_trained"] or 0) + 1
+        state["depth"] = report["level"]
+        state["max_depth"] = max(state["max_depth"] or 0, report["level"])
+        state["map_size"] = f"{report['x_dim']}x{report['y_dim']}"
+        state["qe"]["mqe"] = report["mqe"]
+        if qe0 is not None:
+            state["qe"]["qe0"] = qe0
+        state["events"].append({"t": elapsed, "map": report["name"], "level": report["level"],
+                                "size": state["map_size"], "mqe": report["mqe"],
+                                "cached": report["cached"]})
+        del state["events"][:-MAX_EVENTS]
+    write_progress(progress)
+
+
+def write_progress(progress, **updates):
+    with progress["lock"]:
+        state = progress["state"]
+        state.update(updates)
+        state["elapsed_s"] = round(time.perf_counter() - progress["started"], 2)
+        state["updated_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        snapshot = json.dumps(state, indent=4)
+    if progress["path"] is None:
+        return
+    tmp_path = progress["path"] + ".tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            f.write(snapshot)
+        os.replace(tmp_path, progress["path"])
+    except OSError as e:
+        print(f"[WARNING] Failed to write training progress: {e}")
+
+
+def finish_progress(progress, exit_code, error=None):
+    with progress["lock"]:
+        killed = progress["state"]["status"] == "killed"
+    status = "killed" if killed else ("finished" if exit_code == 0 and error is None else "failed")
+    write_progress(progress, status=status, exit_code=exit_code,
+                   error=error or progress["state"]["error"])
+
+
+def process_group_rss_mb(pgid):
+    """
+    process group 中所有 process 的 RSS 總和（MB）；讀不到 /proc → None
+    """
+    total_kb, found = 0, False
+    try:
+        pids = [name for name in os.listdir("/proc") if name.isdigit()]
+    except OSError:
+        return None
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat", "r") as f:
+                # comm 可能有空白 → 從最後一個 ")" 之後切
+                fields = f.read().rsplit(")", 1)[1].split()
+            if int(fields[2]) != pgid:
+                continue
+            with open(f"/proc/{pid}/status", "r") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total_kb += int(line.split()[1])
+                        break
+            found = True
+        except (OSError, IndexError, ValueError):
+            continue
+    return round(total_kb / 1024, 1) if found else None
+
+
+def check_limits(progress, pgid, baseline_mb=0.0):
+    """
+    更新 RSS；超過 wall-clock / memory 上限 → 回傳原因（字串），否則 None
+    baseline_mb : job 開始前 process group 已經有的 RSS；memory 上限只算超出的部分
+                  （常駐 JVM 的 heap 長大後不會還給 OS，前面 job 用掉的不算這個 job 的）
+    """
+    rss_mb = process_group_rss_mb(pgid)
+    with progress["lock"]:
+        state = progress["state"]
+        limits = state["limits"]
+        if rss_mb is not None:
+            state["rss_mb"] = rss_mb
+            state["peak_rss_mb"] = max(state["peak_rss_mb"] or 0, rss_mb)
+    elapsed = time.perf_counter() - progress["started"]
+    if limits["timeout_s"] is not None and elapsed > limits["timeout_s"]:
+        return f"wall-clock limit of {limits['timeout_s']}s exceeded"
+    if limits["memory_mb"] is not None and rss_mb is not None and rss_mb - baseline_mb > limits["memory_mb"]:
+        if baseline_mb:
+            return (f"memory limit of {limits['memory_mb']} MB exceeded "
+                    f"({round(rss_mb - baseline_mb, 1)} MB above the {baseline_mb} MB baseline)")
+        return f"memory limit of {limits['memory_mb']} MB exceeded ({rss_mb} MB)"
+    return None
+
+
+def kill_process_group(process, reason, progress):
+    print(f"[ERROR] GHSOM training killed: {reason}")
+    with progress["lock"]:
+        progress["state"]["status"] = "killed"
+        progress["state"]["error"] = reason
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=KILL_GRACE_S)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    process.wait()
+
+
+def _pump_output(stream, progress):
+    for line in stream:
+        print(line, end="" if line.endswith("\n") else "\n", flush=True)
+        record_line(progress, line)
+
+
+def run_monitored(cmd, progress, env=None):
+    """
+    cmd : argv list；stdout / stderr 合併後逐行印出並記進 log tail
+    回傳 exit code（被 signal 結束 → 128 + signal，與 os.system 相同）
+    """
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                               encoding="utf-8", errors="replace", bufsize=1, env=env,
+                               start_new_session=True)
+    reader = threading.Thread(target=_pump_output, args=(process.stdout, progress), daemon=True)
+    reader.start()
+    write_progress(progress, pid=process.pid)
+
+    while True:
+        try:
+            process.wait(timeout=POLL_INTERVAL)
+            break
+        except subprocess.TimeoutExpired:
+            pass
+        reason = check_limits(progress, process.pid)
+        if reason is not None:
+            kill_process_group(process, reason, progress)
+            break
+        write_progress(progress)
+
+    reader.join()
+    process.stdout.close()
+    exit_code = process.returncode
+    if exit_code < 0:
+        exit_code = 128 - exit_code
+    finish_progress(progress, exit_code)
+    return exit_code
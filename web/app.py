@@ -3,7 +3,9 @@ import sys
 import uuid
 import json
 import csv
-from flask import Flask, render_template, request, jsonify, redirect
+import gzip
+import zlib
+from flask import Flask, render_template, request, jsonify, redirect, abort, Response
 
 # ==========================================================
 # ⭐ 確保 Python 找得到 scGHSOM 專案根目錄
@@ -13,6 +15,18 @@ if ROOT_DIR not in sys.path:
     sys.path.insert(0, ROOT_DIR)
 
 from programs.Visualize.cluster_feature_map import init_feature_map_dash
+from programs.pipeline.result_cache import (
+    save_stream_sha256, job_fingerprint, lookup_result, register_alias, resolve_job_id
+)
+from programs.pipeline.metrics import REGISTRY
+from programs.training.train_monitor import PROGRESS_NAME
+from programs.data_processing.binary_readers import parse_channel_list
+from programs.data_processing.upload_validation import validate_upload
+from programs.pipeline.upload_sessions import (
+    UPLOAD_CHUNK_BYTES, upload_format, create_session, load_session, append_chunk, finalize_session,
+    discard_session
+)
+from execute import pipeline_fingerprint_params
 
 
 # ==========================================================
@@ -25,12 +39,26 @@ RAW_DATA_DIR = os.path.join(BASE_DIR, "raw-data")
 QUEUE_DIR = os.path.join(BASE_DIR, "web", "queue")
 RESULT_DIR = os.path.join(BASE_DIR, "Result")
 APPLICATION_DIR = os.path.join(BASE_DIR, "applications")
+WORKER_METRICS_PATH = os.path.join(BASE_DIR, "web", "metrics", "worker.prom")
 
 os.makedirs(RAW_DATA_DIR, exist_ok=True)
 os.makedirs(QUEUE_DIR, exist_ok=True)
 os.makedirs(RESULT_DIR, exist_ok=True)
 
 
+# ==========================================================
+# ⭐ Metrics（/metrics，Prometheus text format）
+# ==========================================================
+QUEUE_DEPTH = REGISTRY.gauge(
+    "scghsom_queue_depth", "Jobs waiting or running in web/queue.")
+FAILED_JOBS = REGISTRY.gauge(
+    "scghsom_failed_jobs", "Jobs left as .failed in web/queue.")
+RESULT_CACHE_REQUESTS = REGISTRY.counter(
+    "scghsom_result_cache_requests_total", "Fingerprint lookups on /submit.", ["result"])
+REJECTED_UPLOADS = REGISTRY.counter(
+    "scghsom_rejected_uploads_total", "Uploads rejected by validation on /submit.")
+
+
 # ==========================================================
 # ⭐ 初始化 Dash（僅建立一次）
 # ==========================================================
@@ -83,30 +111,54 @@ def contact():
 # ==========================================================
 # 提交分析表單
 # ==========================================================
-@app.route('/submit', methods=['POST'])
-def submit():
-    file = request.files.get('file')
-    tau1 = request.form.get('tau1')
-    tau2 = request.form.get('tau2')
-    index = request.form.get('index') or None
-    label = request.form.get('label') or None
-    gmail = request.form.get('gmail') or None
+def parse_job_form(form):
+    """
+    表單 / upload session 的 job 參數 → dict；tau 不是正數 → ValueError
+    """
+    try:
+        tau1, tau2 = float(form.get('tau1')), float(form.get('tau2'))
+    except (TypeError, ValueError):
+        raise ValueError(f"tau1 / tau2 must be numbers (got '{form.get('tau1')}', '{form.get('tau2')}').")
+    if tau1 <= 0 or tau2 <= 0:
+        raise ValueError("tau1 and tau2 must be positive numbers.")
+    return {
+        "tau1": tau1,
+        "tau2": tau2,
+        "index": form.get('index') or None,
+        "label": form.get('label') or None,
+        "gmail": form.get('gmail') or None,
+        "channels": parse_channel_list(form.get('channels')),
+    }
 
-    job_id = f"scGHSOM_{uuid.uuid4().hex[:8]}"
 
-    # 儲存 raw-data
-    if file:
-        raw_path = os.path.join(RAW_DATA_DIR, f"{job_id}.csv")
-        file.save(raw_path)
+def lookup_cached_job(job_id, raw_path, data_hash, job):
+    """
+    ⭐ 相同資料 + 相同參數已經跑過 → 直接沿用結果，不進 queue
+    回傳 (fingerprint, 已完成的 job 或 None)
+    """
+    params = pipeline_fingerprint_params(job["tau1"], job["tau2"], job["index"], job["label"],
+                                         channels=job["channels"])
+    fingerprint = job_fingerprint(data_hash, params)
+    source_job = lookup_result(fingerprint)
 
-    # 儲存到 queue
+    RESULT_CACHE_REQUESTS.inc(result="hit" if source_job is not None else "miss")
+    if source_job is not None:
+        register_alias(job_id, source_job)
+        os.remove(raw_path)
+        print(f"[CACHE HIT] {job_id} → {source_job}")
+    return fingerprint, source_job
+
+
+def enqueue_job(job_id, job, fingerprint):
     job_info = {
         "job_id": job_id,
-        "tau1": float(tau1),
-        "tau2": float(tau2),
-        "index": index,
-        "label": label,
-        "gmail": gmail
+        "tau1": job["tau1"],
+        "tau2": job["tau2"],
+        "index": job["index"],
+        "label": job["label"],
+        "channels": job["channels"],
+        "gmail": job["gmail"],
+        "fingerprint": fingerprint
     }
 
     queue_path = os.path.join(QUEUE_DIR, f"{job_id}.json")
@@ -114,6 +166,76 @@ def submit():
         json.dump(job_info, f, indent=4)
 
     print(f"[NEW JOB CREATED] {job_info}")
+    return job_info
+
+
+def log_validation(job_id, summary):
+    print(f"[VALIDATED] {job_id}: {summary['rows']} rows, {summary['markers']} markers")
+    if summary["constant"]:
+        print(f"[WARNING] {job_id}: constant marker columns {summary['constant']}")
+
+
+@app.route('/submit', methods=['POST'])
+def submit():
+    file = request.files.get('file')
+    tau1 = request.form.get('tau1')
+    tau2 = request.form.get('tau2')
+    gmail = request.form.get('gmail') or None
+
+    def reject(message):
+        REJECTED_UPLOADS.inc()
+        return render_template(
+            'run.html',
+            title='Run Analysis',
+            message=message,
+            tau1=tau1,
+            tau2=tau2,
+            gmail=gmail
+        )
+
+    # CSV / FCS / h5ad 原樣存檔（binary 由 worker 直接讀進 columnar store，不轉 CSV）；.csv.gz 邊收邊解壓
+    if not file:
+        return reject("Please choose a data file to upload.")
+    try:
+        ext, compressed = upload_format(file.filename)
+        job = parse_job_form(request.form)
+    except ValueError as e:
+        return reject(str(e))
+
+    job_id = f"scGHSOM_{uuid.uuid4().hex[:8]}"
+
+    # 儲存 raw-data（存檔時順便算 sha256）
+    raw_path = os.path.join(RAW_DATA_DIR, f"{job_id}{ext}")
+    try:
+        data_hash = save_stream_sha256(gzip.GzipFile(fileobj=file.stream) if compressed else file.stream,
+                                       raw_path)
+    except (OSError, EOFError, zlib.error) as e:
+        os.remove(raw_path)
+        return reject(f"Upload rejected: invalid gzip data ({e}).")
+
+    fingerprint, source_job = lookup_cached_job(job_id, raw_path, data_hash, job)
+    if source_job is not None:
+        return render_template(
+            'run.html',
+            title='Run Analysis',
+            message=f"Upload successful! Your Job ID: {job_id} (identical job already analysed, results are ready)",
+            tau1=tau1,
+            tau2=tau2,
+            gmail=gmail
+        )
+
+    # ⭐ 壞掉的上傳（非數值欄位、打錯 index / label、全是 NA 的 marker ...）現在就擋下，不進 queue
+    #    （cache hit 的資料與參數已經成功跑過，不用再檢查）
+    try:
+        summary = validate_upload(raw_path, job["index"], job["label"], job["channels"])
+    except ValueError as e:
+        os.remove(raw_path)
+        print(f"[REJECTED] {job_id}: {e}")
+        return reject(f"Upload rejected: {e}")
+    log_validation(job_id, summary)
+
+    # 儲存到 queue
+    enqueue_job(job_id, job, fingerprint)
 
     return render_template(
         'run.html',
@@ -125,12 +247,127 @@ def submit():
     )
 
 
+# ==========================================================
+# ⭐ Resumable chunked upload API（多 GB 的檔案，programs/pipeline/upload_sessions.py）
+# ==========================================================
+# POST   /api/upload                    { filename, tau1, tau2, index?, label?, channels?, gmail? }
+#                                        → 201 { upload_id, offset: 0, chunk_bytes }
+# PUT    /api/upload/<id>?offset=N      body = 原始 bytes → { offset }；offset 不對 → 409 { offset }
+# GET    /api/upload/<id>               → { offset }（斷線後從這裡續傳）
+# POST   /api/upload/<id>/finalize      → { job_id, cached }
+# DELETE /api/upload/<id>               → 放棄上傳
+# 內容有問題 → 422 { error }，session 刪除
+def reject_upload(upload_id, message):
+    discard_session(upload_id)
+    REJECTED_UPLOADS.inc()
+    print(f"[REJECTED] upload {upload_id}: {message}")
+    return jsonify({"error": f"Upload rejected: {message}"}), 422
+
+
+@app.route('/api/upload', methods=['POST'])
+def api_create_upload():
+    payload = request.get_json(silent=True) or request.form
+    try:
+        job = parse_job_form(payload)
+        session = create_session(payload.get('filename'), job)
+    except ValueError as e:
+        REJECTED_UPLOADS.inc()
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({"upload_id": session["upload_id"], "offset": 0, "chunk_bytes": UPLOAD_CHUNK_BYTES}), 201
+
+
+@app.route('/api/upload/<upload_id>', methods=['GET'])
+def api_upload_status(upload_id):
+    session = load_session(upload_id)
+    if session is None:
+        return jsonify({"error": "Unknown upload"}), 404
+    return jsonify({"upload_id": upload_id, "filename": session["filename"], "offset": session["offset"]})
+
+
+@app.route('/api/upload/<upload_id>', methods=['PUT'])
+def api_upload_chunk(upload_id):
+    try:
+        offset = int(request.args.get('offset', ''))
+    except ValueError:
+        return jsonify({"error": "offset query parameter is required"}), 400
+
+    data = request.get_data(cache=False)
+    try:
+        new_offset = append_chunk(upload_id, offset, data)
+    except KeyError:
+        return jsonify({"error": "Unknown upload"}), 404
+    except ValueError as e:
+        return reject_upload(upload_id, str(e))
+
+    if new_offset != offset + len(data):
+        # 重送 / 漏送 → 告訴 client 伺服器實際收到哪裡
+        return jsonify({"error": "Offset mismatch", "offset": new_offset}), 409
+    return jsonify({"offset": new_offset})
+
+
+@app.route('/api/upload/<upload_id>', methods=['DELETE'])
+def api_discard_upload(upload_id):
+    if load_session(upload_id) is None:
+        return jsonify({"error": "Unknown upload"}), 404
+    discard_session(upload_id)
+    return jsonify({"discarded": upload_id})
+
+
+@app.route('/api/upload/<upload_id>/finalize', methods=['POST'])
+def api_finalize_upload(upload_id):
+    session = load_session(upload_id)
+    if session is None:
+        return jsonify({"error": "Unknown upload"}), 404
+    job = session["params"]
+
+    job_id = f"scGHSOM_{uuid.uuid4().hex[:8]}"
+    raw_path = os.path.join(RAW_DATA_DIR, f"{job_id}{session['ext']}")
+    try:
+        # 內容在收 chunk 時已經檢查 / hash 過，這裡只剩最後一列與搬檔
+        data_hash, summary = finalize_session(upload_id, raw_path, job["channels"])
+    except ValueError as e:
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+        return reject_upload(upload_id, str(e))
+    discard_session(upload_id)
+    log_validation(job_id, summary)
+
+    fingerprint, source_job = lookup_cached_job(job_id, raw_path, data_hash, job)
+    if source_job is None:
+        enqueue_job(job_id, job, fingerprint)
+    return jsonify({"job_id": job_id, "cached": source_job is not None, "rows": summary["rows"]})
+
+
+# ==========================================================
+# ⭐ Metrics endpoint（只給本機 scrape）
+# ==========================================================
+@app.route('/metrics')
+def metrics():
+    if request.remote_addr not in ("127.0.0.1", "::1"):
+        abort(403)
+
+    queue_files = os.listdir(QUEUE_DIR)
+    QUEUE_DEPTH.set(sum(1 for f in queue_files if f.endswith(".json")))
+    FAILED_JOBS.set(sum(1 for f in queue_files if f.endswith(".failed")))
+
+    body = REGISTRY.render()
+
+    # worker 是另一個 process，metrics 由它定期寫成檔案
+    if os.path.exists(WORKER_METRICS_PATH):
+        with open(WORKER_METRICS_PATH, "r") as f:
+            body += f.read()
+
+    return Response(body, mimetype="text/plain; version=0.0.4")
+
+
 # ==========================================================
 # Job Summary API
 # ==========================================================
 @app.route('/api/job/<job_id>')
 def get_job_summary(job_id):
 
+    job_id = resolve_job_id(job_id)
     filename = f"{job_id}_result.csv"
     filepath = os.path.join(RESULT_DIR, filename)
 
@@ -159,15 +396,42 @@ def get_job_summary(job_id):
         return jsonify({"found": False})
 
 
+# ==========================================================
+# ⭐ Training Progress API（worker 寫的 train_progress.json）
+# ==========================================================
+@app.route('/api/job/<job_id>/progress')
+def get_job_progress(job_id):
+
+    source_job = resolve_job_id(job_id)
+    folders = sorted(
+        f for f in os.listdir(APPLICATION_DIR)
+        if f.startswith(source_job + "-")
+    )
+
+    for folder in folders:
+        path = os.path.join(APPLICATION_DIR, folder, PROGRESS_NAME)
+        if not os.path.exists(path):
+            continue
+        try:
+            with open(path, "r") as f:
+                return jsonify({"found": True, "progress": json.load(f)})
+        except (OSError, ValueError):
+            # worker 以 os.replace 寫入，讀到一半的檔案不會發生；讀不到就當作還沒有
+            break
+
+    return jsonify({"found": False})
+
+
 # ==========================================================
 # ⭐ Feature Map API — 回傳 Dash URL
 # ==========================================================
 @app.route('/api/feature/<job_id>')
 def api_feature_map(job_id):
 
+    source_job = resolve_job_id(job_id)
     folders = [
         f for f in os.listdir(APPLICATION_DIR)
-        if f.startswith(job_id + "-")
+        if f.startswith(source_job + "-")
     ]
 
     if not folders:
@@ -2,6 +2,8 @@ import os
 import sys
 import time
 import json
+import shutil
+import threading
 
 # ----------------------------------------------------------
 # 專案根目錄（scGHSOM）
@@ -14,7 +16,13 @@ os.chdir(BASE_DIR)
 # ⭐ 讓 Python 找到 execute.py
 sys.path.append(BASE_DIR)
 
-from execute import run_pipeline
+from execute import PIPELINE_STAGES, prepare_pipeline, finish_pipeline, run_stage
+from programs.data_processing.raw_data_reader import DEFAULT_MEMORY_BUDGET_MB
+from programs.data_processing.columnar_store import store_path
+from programs.data_processing.binary_readers import RAW_EXTENSIONS
+from programs.pipeline.result_cache import lookup_result, record_result, register_alias
+from programs.pipeline.scheduler import StageScheduler
+from programs.pipeline.metrics import REGISTRY, STAGE_BUCKETS
 
 # ----------------------------------------------------------
 # 資料夾路徑
@@ -23,28 +31,155 @@ QUEUE_DIR = os.path.join(BASE_DIR, "web", "queue")
 RAW_DATA_DIR = os.path.join(BASE_DIR, "raw-data")
 APPLICATION_DIR = os.path.join(BASE_DIR, "applications")
 LABEL_BACKUP_DIR = os.path.join(BASE_DIR, "label")   # ←⭐ 你要的最外層資料夾
+METRICS_PATH = os.path.join(BASE_DIR, "web", "metrics", "worker.prom")   # web/app.py 的 /metrics 會讀
 
 os.makedirs(LABEL_BACKUP_DIR, exist_ok=True)
 
+# ----------------------------------------------------------
+# ⭐ Resource pools：JVM 訓練與 Python stages 分開排程，不同 job 的 stage 可以重疊
+# ----------------------------------------------------------
+JVM_SLOTS = int(os.environ.get("SCGHSOM_JVM_SLOTS", 1))
+PYTHON_SLOTS = int(os.environ.get("SCGHSOM_PYTHON_SLOTS", 1))
+# 同時載入記憶體的 job 上限（每個 job 會持有自己的 raw-data DataFrame）
+MAX_JOBS_IN_FLIGHT = int(os.environ.get("SCGHSOM_MAX_JOBS", JVM_SLOTS + PYTHON_SLOTS + 1))
+# 1 → somtoolbox 在常駐 JVM 中訓練（每個 jvm slot 一個 service），省下每個 job 的 JVM 啟動
+JVM_SERVICE = os.environ.get("SCGHSOM_JVM_SERVICE", "0") == "1"
+# 1 → somtoolbox 不寫 .dwm 與 HTML 報表（job 資料夾較小，shared volume 的 I/O 較少）
+LEAN_OUTPUT = os.environ.get("SCGHSOM_LEAN_OUTPUT", "0") == "1"
+# somtoolbox 訓練的 wall-clock（秒）/ RSS（MB）上限；沒設定 → 不限
+# （SCGHSOM_JVM_SERVICE=1 時 memory 只算 job 開始後 service 增加的 RSS）
+TRAIN_TIMEOUT_S = float(os.environ["SCGHSOM_TRAIN_TIMEOUT_S"]) if os.environ.get("SCGHSOM_TRAIN_TIMEOUT_S") else None
+TRAIN_MEMORY_MB = int(os.environ["SCGHSOM_TRAIN_MEMORY_MB"]) if os.environ.get("SCGHSOM_TRAIN_MEMORY_MB") else None
+
+# ----------------------------------------------------------
+# ⭐ Raw-data ingestion：大型上傳用 chunked（分塊 float32，格式化階段記憶體有上限）
+#   或 columnar（CSV 只 parse 一次轉成 .npy store，之後各 stage memory-map 需要的欄位）
+# ----------------------------------------------------------
+INGEST_MODE = os.environ.get("SCGHSOM_INGEST", "memory")
+MEMORY_BUDGET_MB = int(os.environ.get("SCGHSOM_MEMORY_BUDGET_MB", DEFAULT_MEMORY_BUDGET_MB))
+
 print(f"[WORKER STARTED]")
 print(f"Current working directory: {os.getcwd()}")
 print(f"Queue directory: {QUEUE_DIR}")
 print(f"Raw-data directory: {RAW_DATA_DIR}")
 print(f"Label backup directory: {LABEL_BACKUP_DIR}")
+print(f"Pools: jvm={JVM_SLOTS}, python={PYTHON_SLOTS}, max jobs in flight={MAX_JOBS_IN_FLIGHT}")
+print(f"JVM service: {'on' if JVM_SERVICE else 'off'}, lean output: {'on' if LEAN_OUTPUT else 'off'}")
+print(f"Training limits: wall-clock {TRAIN_TIMEOUT_S} s, memory {TRAIN_MEMORY_MB} MB (None → unlimited)")
+print(f"Ingest: {INGEST_MODE} (memory budget {MEMORY_BUDGET_MB} MB)")
 print("========================================================")
 
 
 # ----------------------------------------------------------
-# Worker 無限循環
+# ⭐ Worker metrics（寫到 METRICS_PATH，由 Flask /metrics 輸出）
 # ----------------------------------------------------------
-while True:
-    files = [f for f in os.listdir(QUEUE_DIR) if f.endswith(".json")]
+JOBS_IN_FLIGHT = REGISTRY.gauge(
+    "scghsom_worker_jobs_in_flight", "Jobs currently scheduled in the worker.")
+JOBS_TOTAL = REGISTRY.counter(
+    "scghsom_worker_jobs_total", "Jobs finished by the worker.", ["status"])
+STAGE_SECONDS = REGISTRY.histogram(
+    "scghsom_stage_duration_seconds", "Wall time of executed pipeline stages.",
+    ["stage", "pool"], buckets=STAGE_BUCKETS)
+STAGE_FAILURES = REGISTRY.counter(
+    "scghsom_stage_failures_total", "Pipeline stages that raised.", ["stage"])
 
-    if not files:
-        time.sleep(2)
-        continue
 
-    job_file = sorted(files)[0]
+def export_metrics():
+    try:
+        REGISTRY.write(METRICS_PATH)
+    except OSError as e:
+        print(f"[WARNING] Failed to write worker metrics: {e}")
+
+
+def run_stage_with_metrics(ctx, stage):
+    try:
+        run_stage(ctx, stage)
+    except Exception:
+        STAGE_FAILURES.inc(stage=stage["name"])
+        raise
+    finally:
+        # manifest 判定 up to date 而跳過的 stage 沒有 timing，不算進 latency
+        elapsed = ctx["timings"].get(stage["name"])
+        if elapsed is not None:
+            STAGE_SECONDS.observe(elapsed, stage=stage["name"], pool=stage.get("pool", "python"))
+        export_metrics()
+
+
+# ----------------------------------------------------------
+# Job 完成後的清理
+# ----------------------------------------------------------
+def cleanup_job(job_id, job_path):
+    # ------------------------------------------------------
+    # ⭐ Step 1：刪 raw-data（CSV / FCS / h5ad）
+    # ------------------------------------------------------
+    raw_file_path = os.path.join(RAW_DATA_DIR, f"{job_id}.csv")
+    for ext in RAW_EXTENSIONS:
+        path = os.path.join(RAW_DATA_DIR, f"{job_id}{ext}")
+        if os.path.exists(path):
+            raw_file_path = path
+            break
+    if os.path.exists(raw_file_path):
+        os.remove(raw_file_path)
+        print(f"[RAW DATA CLEANED] Removed {os.path.basename(raw_file_path)}")
+    else:
+        print(f"[RAW DATA MISSING] {raw_file_path} not found")
+
+    # columnar store（SCGHSOM_INGEST=columnar）與 raw-data 一起刪
+    store_dir = store_path(raw_file_path)
+    if os.path.isdir(store_dir):
+        shutil.rmtree(store_dir)
+        print(f"[RAW DATA CLEANED] Removed {os.path.basename(store_dir)}")
+
+    # ------------------------------------------------------
+    # ⭐ Step 2：刪 queue JSON（最後才刪）
+    # ------------------------------------------------------
+    os.remove(job_path)
+    print(f"[QUEUE CLEANED] Removed {os.path.basename(job_path)}")
+
+
+def fail_job(job_id, job_path, error):
+    print(f"[ERROR] Job {job_id} failed: {error}")
+    # 失敗的 job 改名為 .failed，避免 worker 一直重跑同一個 job
+    os.replace(job_path, job_path[:-len(".json")] + ".failed")
+
+
+# ----------------------------------------------------------
+# 排程狀態：已經開始（尚未清理完）的 queue 檔
+# ----------------------------------------------------------
+started_jobs = set()
+started_lock = threading.Lock()
+
+
+def release_job(job_file):
+    with started_lock:
+        started_jobs.discard(job_file)
+        JOBS_IN_FLIGHT.set(len(started_jobs))
+    export_metrics()
+
+
+def on_job_done(job_id, ctx, error):
+    """
+    scheduler 回呼：所有 stage 完成或任一 stage 失敗
+    """
+    job_path = ctx["queue_path"]
+    try:
+        report = finish_pipeline(ctx, error)
+        JOBS_TOTAL.inc(status=report["status"])
+        if report["status"] == "failed":
+            fail_job(job_id, job_path, report["error"])
+        else:
+            if ctx["fingerprint"]:
+                record_result(ctx["fingerprint"], job_id)
+            print(f"[JOB COMPLETED] {job_id}")
+            cleanup_job(job_id, job_path)
+    except Exception as e:
+        print(f"[ERROR] Failed to finalize job {job_id}: {e}")
+    finally:
+        release_job(os.path.basename(job_path))
+        print("--------------------------------------------------------")
+
+
+def start_job(job_file):
     job_path = os.path.join(QUEUE_DIR, job_file)
 
     print(f"\n[JOB FOUND] {job_file}")
@@ -57,69 +192,72 @@ while True:
     tau2 = job_info["tau2"]
     index = job_info.get("index")
     label = job_info.get("label")  # ←⭐ 使用者在前端填的 label 欄位名（可能為 None）
+    channels = job_info.get("channels")  # FCS / h5ad 的 channel / gene subset（None → 全部）
+    fingerprint = job_info.get("fingerprint")
 
     print(f"[RUNNING JOB] job_id={job_id}")
     print(f"  tau1={tau1}, tau2={tau2}, index={index}, label={label}")
 
     try:
-        run_pipeline(
+        # ⭐ 同樣的 job 在排隊期間已經跑完 → 直接 alias，不重跑
+        source_job = lookup_result(fingerprint) if fingerprint else None
+
+        if source_job is not None:
+            register_alias(job_id, source_job)
+            print(f"[CACHE HIT] {job_id} → {source_job}")
+            JOBS_TOTAL.inc(status="cache_hit")
+            cleanup_job(job_id, job_path)
+            release_job(job_file)
+            return
+
+        # ⭐ label 備份已併入 pipeline（同一份 raw-data，不再重讀 CSV）
+        ctx = prepare_pipeline(
             data=job_id,
             tau1=tau1,
             tau2=tau2,
             index=index,
-            label=label
+            label=label,
+            label_backup_dir=LABEL_BACKUP_DIR,
+            ingest=INGEST_MODE,
+            memory_budget_mb=MEMORY_BUDGET_MB,
+            channels=channels,
+            jvm_service=JVM_SERVICE,
+            lean_output=LEAN_OUTPUT,
+            train_timeout_s=TRAIN_TIMEOUT_S,
+            train_memory_mb=TRAIN_MEMORY_MB
         )
-        print(f"[JOB COMPLETED] {job_id}")
+        ctx["queue_path"] = job_path
+        ctx["fingerprint"] = fingerprint
 
-    except Exception as e:
-        print(f"[ERROR] Job {job_id} failed: {e}")
+        scheduler.submit_job(job_id, ctx, PIPELINE_STAGES, on_job_done)
 
-    else:
-        # ------------------------------------------------------
-        # ⭐ Step 1：備份 label 欄位（若使用者有填）
-        # ------------------------------------------------------
-        raw_file = os.path.join(RAW_DATA_DIR, f"{job_id}.csv")
-
-        if label is not None:
-            try:
-                import pandas as pd
-
-                if os.path.exists(raw_file):
-                    df_raw = pd.read_csv(raw_file)
+    except Exception as e:
+        JOBS_TOTAL.inc(status="failed")
+        fail_job(job_id, job_path, e)
+        release_job(job_file)
 
-                    if label in df_raw.columns:
-                        df_label = df_raw[[label]]
-                        backup_path = os.path.join(LABEL_BACKUP_DIR, f"{job_id}_label.csv")
-                        df_label.to_csv(backup_path, index=False)
-                        print(f"[LABEL SAVED] → {backup_path}")
-                    else:
-                        print(f"[WARNING] Label column '{label}' not found in raw CSV. Skip backup.")
 
-                else:
-                    print(f"[WARNING] Raw-data file missing, cannot backup label.")
+scheduler = StageScheduler(run_stage_with_metrics, {"jvm": JVM_SLOTS, "python": PYTHON_SLOTS})
+export_metrics()
 
-            except Exception as e:
-                print(f"[ERROR] Failed to backup label column: {e}")
 
-        else:
-            print(f"[INFO] User did not provide label. No label backup needed.")
-
-        # ------------------------------------------------------
-        # ⭐ Step 2：刪 raw-data CSV
-        # ------------------------------------------------------
-        raw_file_path = os.path.join(RAW_DATA_DIR, f"{job_id}.csv")
-        if os.path.exists(raw_file_path):
-            os.remove(raw_file_path)
-            print(f"[RAW DATA CLEANED] Removed {job_id}.csv")
-        else:
-            print(f"[RAW DATA MISSING] {raw_file_path} not found")
+# ----------------------------------------------------------
+# Worker 無限循環：有空位就把下一個 job 的 DAG 交給 scheduler
+# ----------------------------------------------------------
+while True:
+    with started_lock:
+        files = [
+            f for f in sorted(os.listdir(QUEUE_DIR))
+            if f.endswith(".json") and f not in started_jobs
+        ]
+        has_slot = len(started_jobs) < MAX_JOBS_IN_FLIGHT
+        if files and has_slot:
+            started_jobs.add(files[0])
+            JOBS_IN_FLIGHT.set(len(started_jobs))
 
-        # ------------------------------------------------------
-        # ⭐ Step 3：刪 queue JSON（最後才刪）
-        # ------------------------------------------------------
-        os.remove(job_path)
-        print(f"[QUEUE CLEANED] Removed {job_file}")
+    if not files or not has_slot:
+        time.sleep(2)
+        continue
 
-    print("--------------------------------------------------------")
+    start_job(files[0])
     time.sleep(1)
-